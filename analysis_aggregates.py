@@ -0,0 +1,425 @@
+"""
+Persisted aggregates behind the agent, churn and lifecycle analyses.
+
+Every planning application is reduced to one analysis_facts row: its agent,
+applicant, registration month, contact details and, for invalid applications,
+the outcome of the follow-up search. The facts are summed into aggregate
+tables keyed by agent, LPA and month, and analysis_watermark records the
+applications.updated_at up to which changes have been folded in.
+
+An incremental run re-derives the facts of applications changed since the
+watermark, of applications whose canonical agent moved with the dedup map or
+the agent name clusters, and of the invalid applications by the same applicants (whose follow-up the
+changes may affect), then applies only the difference to the aggregates. A
+full rebuild first brings the aggregates up to date that way, then recomputes
+every fact and reports where the incrementally maintained aggregates disagree
+with it.
+
+Usage:
+  python analysis_aggregates.py [--full-rebuild]
+"""
+
+import argparse
+import time
+from collections import namedtuple
+
+from psycopg2.extras import execute_values
+
+from analyze_lifecycle import follow_ups, lifecycle_stats
+from metrics import count, span
+from shared_utils import (extract_email, is_agent_change,
+                          DerivedFieldCache, FollowUpMatcher)
+
+WATERMARK_NAME = 'analysis'
+
+FACT_COLUMNS = ('id', 'lpa', 'month', 'agent', 'agent_email', 'applicant', 'is_invalid',
+                'email', 'phone',
+                'follow_up_id', 'follow_up_lpa', 'follow_up_days', 'agent_changed',
+                'lpa_follow_up_id', 'lpa_follow_up_lpa', 'lpa_follow_up_days', 'lpa_agent_changed')
+
+Fact = namedtuple('Fact', FACT_COLUMNS)
+
+# table -> (key columns, counter columns). The first counter is zero only
+# when every counter is, so rows whose first counter drops to zero are removed.
+AGGREGATES = {
+    'agg_agent_month': (('agent', 'lpa', 'month'),
+                        ('total', 'invalid', 'fired', 'retained')),
+    'agg_agent_contact': (('agent', 'kind', 'value'),
+                          ('n',)),
+    'agg_lpa_month': (('lpa', 'month'),
+                      ('total', 'invalid', 'followed_up', 'follow_up_days', 'agent_changed',
+                       'lpa_followed_up', 'lpa_follow_up_days', 'lpa_agent_changed')),
+}
+
+
+# --- Facts ---
+
+def _month(dt):
+    return f"{dt.year:04d}-{dt.month:02d}"
+
+
+def _outcome(inv, match, derived):
+    """(follow-up id, lpa, days, agent changed) for one follow-up search result."""
+    if match is None:
+        return None, None, None, None
+    return (match['_id'], match['_lpa'], (match['_dt'] - inv['_dt']).days,
+            is_agent_change(derived.agent(inv), derived.agent(match)))
+
+
+def compute_fact(app, derived, matcher):
+    """Reduces one application to the Fact its aggregate contributions derive from."""
+    email_raw = app.get('agentEmail')
+    phone = app.get('agentTelephoneNumber')
+    is_invalid = app['_category'] == 'invalid'
+    match, lpa_match = follow_ups(matcher, app) if is_invalid else (None, None)
+    return Fact(app['_id'], app['_lpa'], _month(app['_dt']), derived.agent(app),
+                (email_raw or '').strip().lower(), derived.fullname(app), is_invalid,
+                extract_email(email_raw) if email_raw else '', phone.strip() if phone else '',
+                *_outcome(app, match, derived), *_outcome(app, lpa_match, derived))
+
+
+def contributions(fact):
+    """Yields (table, key, counters) for everything one fact adds to the aggregates."""
+    invalid = int(fact.is_invalid)
+    followed = fact.follow_up_id is not None
+    lpa_followed = fact.lpa_follow_up_id is not None
+    yield 'agg_agent_month', (fact.agent, fact.lpa, fact.month), (
+        1, invalid, int(followed and bool(fact.agent_changed)), int(followed and not fact.agent_changed))
+    if fact.email:
+        yield 'agg_agent_contact', (fact.agent, 'email', fact.email), (1,)
+    if fact.phone:
+        yield 'agg_agent_contact', (fact.agent, 'phone', fact.phone), (1,)
+    yield 'agg_lpa_month', (fact.lpa, fact.month), (
+        1, invalid, int(followed), fact.follow_up_days or 0, int(bool(fact.agent_changed)),
+        int(lpa_followed), fact.lpa_follow_up_days or 0, int(bool(fact.lpa_agent_changed)))
+
+
+def sum_contributions(facts, sign=1, totals=None):
+    """Adds (or with sign=-1 subtracts) the facts' contributions into totals,
+    a {table: {key: [counters]}} mapping."""
+    if totals is None:
+        totals = {table: {} for table in AGGREGATES}
+    for fact in facts:
+        for table, key, counters in contributions(fact):
+            current = totals[table].get(key)
+            if current is None:
+                current = totals[table][key] = [0] * len(counters)
+            for i, value in enumerate(counters):
+                current[i] += sign * value
+    return totals
+
+
+# --- Storage ---
+
+def get_watermark(cur):
+    cur.execute("SELECT folded_until FROM analysis_watermark WHERE name = %s", (WATERMARK_NAME,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _set_watermark(cur, folded_until):
+    cur.execute("""INSERT INTO analysis_watermark (name, folded_until, updated_at)
+                   VALUES (%s, %s, NOW())
+                   ON CONFLICT (name) DO UPDATE SET
+                      folded_until = EXCLUDED.folded_until,
+                      updated_at = EXCLUDED.updated_at""",
+                (WATERMARK_NAME, folded_until))
+
+
+def _key_arrays(keys):
+    keys = list(keys)
+    return [k[0] for k in keys], [k[1] for k in keys]
+
+
+def _load_facts(cur, keys):
+    ids, lpas = _key_arrays(keys)
+    cur.execute(f"""SELECT {', '.join(FACT_COLUMNS)} FROM analysis_facts
+                    WHERE (id, lpa) IN (SELECT * FROM unnest(%s::int[], %s::text[]))""",
+                (ids, lpas))
+    return [Fact(*row) for row in cur.fetchall()]
+
+
+def _replace_facts(cur, keys, facts):
+    ids, lpas = _key_arrays(keys)
+    cur.execute("""DELETE FROM analysis_facts
+                   WHERE (id, lpa) IN (SELECT * FROM unnest(%s::int[], %s::text[]))""",
+                (ids, lpas))
+    if facts:
+        execute_values(cur, f"INSERT INTO analysis_facts ({', '.join(FACT_COLUMNS)}) VALUES %s",
+                       facts, page_size=1000)
+
+
+def _apply_deltas(cur, deltas):
+    """Adds signed counter deltas to the aggregate tables, dropping emptied rows."""
+    for table, rows in deltas.items():
+        keys, counters = AGGREGATES[table]
+        values = [key + tuple(vec) for key, vec in rows.items() if any(vec)]
+        if not values:
+            continue
+        updates = ", ".join(f"{c} = {table}.{c} + EXCLUDED.{c}" for c in counters)
+        execute_values(cur, f"""INSERT INTO {table} ({', '.join(keys + counters)}) VALUES %s
+                                ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}""",
+                       values, page_size=1000)
+        cur.execute(f"DELETE FROM {table} WHERE {counters[0]} = 0")
+
+
+def read_aggregates(cur):
+    """Returns the stored aggregates in the {table: {key: [counters]}} shape."""
+    stored = {}
+    for table, (keys, counters) in AGGREGATES.items():
+        cur.execute(f"SELECT {', '.join(keys + counters)} FROM {table}")
+        stored[table] = {row[:len(keys)]: list(row[len(keys):]) for row in cur.fetchall()}
+    return stored
+
+
+def diff_aggregates(stored, expected):
+    """Lists (table, key, stored, expected) for every aggregate row that differs."""
+    mismatches = []
+    for table in AGGREGATES:
+        have, want = stored.get(table, {}), expected.get(table, {})
+        for key in sorted(set(have) | set(want), key=repr):
+            a, b = have.get(key), want.get(key)
+            # An all-zero row is the same as a missing one
+            a = a if a and any(a) else None
+            b = b if b and any(b) else None
+            if a != b:
+                mismatches.append((table, key, a, b))
+    return mismatches
+
+
+def _store_map(cur, table, column, mapping, keys=None):
+    """Records a column -> agent map the facts were derived with (all of it,
+    or just keys) in analysis_agent_map or analysis_name_map."""
+    if keys is None:
+        cur.execute(f"DELETE FROM {table}")
+        keys = mapping.keys()
+    else:
+        cur.execute(f"DELETE FROM {table} WHERE {column} = ANY(%s)", (list(keys),))
+    values = [(key, mapping[key]) for key in keys if key in mapping]
+    if values:
+        execute_values(cur, f"INSERT INTO {table} ({column}, agent) VALUES %s", values, page_size=1000)
+
+
+# --- Rebuild and incremental update ---
+
+def _snapshot_time(cur, dataset):
+    if dataset.snapshot_time is not None:
+        return dataset.snapshot_time
+    cur.execute("SELECT LOCALTIMESTAMP")
+    return cur.fetchone()[0]
+
+
+def rebuild_aggregates(conn, dataset, verify=True):
+    """Recomputes every fact and aggregate from the dataset.
+
+    With verify, the changes since the last run are first folded in by
+    update_aggregates, and the aggregates it leaves are compared against the
+    recomputed ones, so a full rebuild checks the incremental path. Returns
+    (facts written, mismatches)."""
+    cur = conn.cursor()
+    folded_until = _snapshot_time(cur, dataset)
+    dedup_map = dataset.dedup_map()
+    name_clusters = dataset.name_clusters()
+    derived = DerivedFieldCache(dedup_map, name_clusters)
+    matcher = FollowUpMatcher(dataset.apps, derived)
+
+    facts = [compute_fact(app, derived, matcher) for app in dataset.apps]
+    expected = sum_contributions(facts)
+
+    mismatches = []
+    if verify and get_watermark(cur) is not None:
+        update_aggregates(conn, dataset)
+        mismatches = diff_aggregates(read_aggregates(cur), expected)
+
+    cur.execute("TRUNCATE analysis_facts, " + ", ".join(AGGREGATES))
+    execute_values(cur, f"INSERT INTO analysis_facts ({', '.join(FACT_COLUMNS)}) VALUES %s",
+                   facts, page_size=1000)
+    _apply_deltas(cur, expected)
+    _store_map(cur, 'analysis_agent_map', 'email', dedup_map)
+    _store_map(cur, 'analysis_name_map', 'name', name_clusters)
+    _set_watermark(cur, folded_until)
+    conn.commit()
+    cur.close()
+    return len(facts), mismatches
+
+
+def update_aggregates(conn, dataset):
+    """Folds the applications changed since the watermark into the aggregates.
+
+    The follow-up matcher is built over the whole dataset, but only the
+    affected applications are re-matched and re-aggregated. Falls back to a
+    full rebuild on the first run. Returns the number of facts re-derived."""
+    cur = conn.cursor()
+    watermark = get_watermark(cur)
+    if watermark is None:
+        cur.close()
+        return rebuild_aggregates(conn, dataset, verify=False)[0]
+
+    folded_until = _snapshot_time(cur, dataset)
+    dedup_map = dataset.dedup_map()
+    name_clusters = dataset.name_clusters()
+    derived = DerivedFieldCache(dedup_map, name_clusters)
+    by_key = {(a['_id'], a['_lpa']): a for a in dataset.apps}
+
+    # 1. Applications saved since the last run
+    cur.execute("SELECT id, lpa FROM applications WHERE updated_at > %s AND updated_at <= %s",
+                (watermark, folded_until))
+    touched = set(cur.fetchall())
+
+    # 2. Applications whose email now resolves to a different canonical agent
+    cur.execute("SELECT email, agent FROM analysis_agent_map")
+    stored_map = dict(cur.fetchall())
+    moved_emails = {email for email in set(stored_map) | set(dedup_map)
+                    if stored_map.get(email) != dedup_map.get(email)}
+    if moved_emails:
+        cur.execute("SELECT id, lpa FROM analysis_facts WHERE agent_email = ANY(%s)", (list(moved_emails),))
+        touched.update(cur.fetchall())
+
+    # 3. Applications whose agent name now falls in a different name cluster
+    cur.execute("SELECT name, agent FROM analysis_name_map")
+    stored_names = dict(cur.fetchall())
+    moved_names = {name for name in set(stored_names) | set(name_clusters)
+                   if stored_names.get(name, name) != name_clusters.get(name, name)}
+    if moved_names:
+        cur.execute("SELECT id, lpa FROM analysis_facts WHERE agent = ANY(%s)",
+                    (list({stored_names.get(name, name) for name in moved_names}),))
+        touched.update(cur.fetchall())
+
+    # 4. Invalid applications by the same applicants, before and after the change
+    old_facts = {(f.id, f.lpa): f for f in _load_facts(cur, touched)}
+    applicants = {f.applicant for f in old_facts.values()}
+    applicants.update(derived.fullname(by_key[k]) for k in touched if k in by_key)
+    affected = set(touched)
+    if applicants:
+        cur.execute("SELECT id, lpa FROM analysis_facts WHERE is_invalid AND applicant = ANY(%s)",
+                    (list(applicants),))
+        rematch = set(cur.fetchall()) - affected
+        old_facts.update(((f.id, f.lpa), f) for f in _load_facts(cur, rematch))
+        affected |= rematch
+
+    matcher = FollowUpMatcher(dataset.apps, derived)
+    new_facts = [compute_fact(by_key[k], derived, matcher) for k in affected if k in by_key]
+
+    deltas = sum_contributions(new_facts)
+    sum_contributions(old_facts.values(), sign=-1, totals=deltas)
+
+    _replace_facts(cur, affected, new_facts)
+    _apply_deltas(cur, deltas)
+    _store_map(cur, 'analysis_agent_map', 'email', dedup_map, moved_emails)
+    _store_map(cur, 'analysis_name_map', 'name', name_clusters, moved_names)
+    _set_watermark(cur, folded_until)
+    conn.commit()
+    cur.close()
+    return len(affected)
+
+
+# --- Reports ---
+# Ties are broken as in the full analyses: agents by name, contact details by
+# value and LPAs by name, all in code point ("C" collation) order, so both
+# paths write byte-identical reports for the same data.
+
+def agents_report(conn):
+    """analyze_agents output, read from the aggregates."""
+    cur = conn.cursor()
+    cur.execute("""SELECT DISTINCT ON (agent, kind) agent, kind, value
+                   FROM agg_agent_contact
+                   ORDER BY agent, kind, n DESC, value COLLATE "C" """)
+    contacts = {(agent, kind): value for agent, kind, value in cur.fetchall()}
+    cur.execute("""SELECT agent, SUM(total), SUM(invalid)
+                   FROM agg_agent_month
+                   WHERE agent <> 'unknown/none' AND length(agent) >= 3
+                   GROUP BY agent
+                   HAVING SUM(total) > 0
+                   ORDER BY SUM(invalid) DESC, agent COLLATE "C" """)
+    results = [{
+        'name': agent,
+        'total': total,
+        'invalid': invalid,
+        'rate': (invalid / total) * 100,
+        'email': contacts.get((agent, 'email'), ""),
+        'phone': contacts.get((agent, 'phone'), ""),
+    } for agent, total, invalid in cur.fetchall()]
+    cur.close()
+    return results
+
+
+def churn_report(conn):
+    """analyze_churn_agents output, read from the aggregates."""
+    cur = conn.cursor()
+    cur.execute("""SELECT agent, SUM(invalid), SUM(fired), SUM(retained)
+                   FROM agg_agent_month
+                   WHERE length(agent) >= 3
+                   GROUP BY agent
+                   HAVING SUM(fired) > 0
+                   ORDER BY SUM(fired) DESC, agent COLLATE "C" """)
+    results = [{
+        'name': agent,
+        'invalid': invalid,
+        'fired': fired,
+        'retained': retained,
+        'loss_rate': (fired / (fired + retained)) * 100,
+    } for agent, invalid, fired, retained in cur.fetchall()]
+    cur.close()
+    return results
+
+
+def lifecycle_report(conn):
+    """analyze_lifecycle output, read from the aggregates."""
+    cur = conn.cursor()
+    cur.execute("""SELECT COALESCE(SUM(total), 0), COALESCE(SUM(invalid), 0), COALESCE(SUM(followed_up), 0),
+                          COALESCE(SUM(follow_up_days), 0), COALESCE(SUM(agent_changed), 0)
+                   FROM agg_lpa_month""")
+    overall = lifecycle_stats("Overall", *cur.fetchone())
+    cur.execute("""SELECT lpa, SUM(total), SUM(invalid), SUM(lpa_followed_up),
+                          SUM(lpa_follow_up_days), SUM(lpa_agent_changed)
+                   FROM agg_lpa_month
+                   GROUP BY lpa
+                   ORDER BY lpa COLLATE "C" """)
+    by_lpa = {lpa: lifecycle_stats(f"LPA: {lpa}", *counts) for lpa, *counts in cur.fetchall()}
+    cur.close()
+    return {
+        'overall': overall,
+        'by_lpa': by_lpa
+    }
+
+
+def refresh_aggregates(conn, dataset, full_rebuild=False):
+    """Brings the aggregates up to date, printing what was done."""
+    start = time.perf_counter()
+    if full_rebuild:
+        with span("analysis.aggregates", mode="rebuild") as rebuilt:
+            written, mismatches = rebuild_aggregates(conn, dataset)
+            rebuilt.add(items=written)
+        count("aggregate_mismatches", len(mismatches))
+        print(f"Aggregates rebuilt from {written} applications in {time.perf_counter() - start:.2f}s", flush=True)
+        if mismatches:
+            print(f"WARNING: {len(mismatches)} aggregate rows differed from the incremental result:", flush=True)
+            for table, key, stored, expected in mismatches[:20]:
+                print(f"  {table} {key}: stored {stored}, recomputed {expected}", flush=True)
+        else:
+            print("Incremental aggregates verified against the full rebuild.", flush=True)
+        return mismatches
+    with span("analysis.aggregates", mode="update") as updated:
+        refreshed = update_aggregates(conn, dataset)
+        updated.add(items=refreshed)
+    print(f"Aggregates updated: {refreshed} applications re-derived in {time.perf_counter() - start:.2f}s", flush=True)
+    return []
+
+
+if __name__ == "__main__":
+    import main
+    from shared_utils import load_analysis_dataset
+
+    parser = argparse.ArgumentParser(description="Update the persisted analysis aggregates")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Recompute everything and verify against the incremental aggregates")
+    args = parser.parse_args()
+
+    main.setup_database()
+    connection = main.get_db_connection()
+    try:
+        data = load_analysis_dataset(conn=connection)
+        print(f"Dataset: {data.summary()}", flush=True)
+        refresh_aggregates(connection, data, full_rebuild=args.full_rebuild)
+    finally:
+        connection.close()
@@ -1,87 +1,184 @@
 import psycopg2
+from psycopg2.extras import execute_values
+import numpy as np
 import textwrap
 import re
 import os
-from collections import Counter
 import dotenv
-from shared_utils import clean_note
+from clustering import NOTE_THRESHOLD, assign_to_clusters, minhash_signatures, word_shingles
+from metrics import count, timed
+import sql_profile
+from shared_utils import backfill_decision_categories, clean_note
 
 dotenv.load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def analyze_detailed_failures():
-    if not DATABASE_URL:
-        print("DATABASE_URL not set")
-        return
-        
-    conn = psycopg2.connect(DATABASE_URL)
-    c = conn.cursor()
-    
-    # 1. Get Top 10 Categories
-    query_cats = """
-    SELECT 
-        c.short_desc, 
-        COUNT(*) as freq
+GENERIC_NOTE = "(Generic/No specific note parsed)"
+
+# How note signatures are computed; stored clusters of any other kind are
+# dropped and their notes clustered again
+NOTE_SIGNATURE_KIND = "word 2-grams"
+
+# Top categories, each with its top notes, in one pass over the invalid
+# applications' conditions. Notes are counted by their near-duplicate cluster
+# (see update_note_clusters). Categories are ranked by their total, and the
+# DENSE_RANK tie-break on short_desc keeps each category's rows together. Ties
+# are broken in code point order (COLLATE "C"), as snapshot.detailed_failures
+# does, whatever the database collation.
+DETAILED_FAILURES_QUERY = """
+WITH note_counts AS (
+    SELECT c.short_desc,
+           COALESCE(NULLIF(COALESCE(nc.cluster, c.clean_note), ''), %(generic)s) AS note,
+           COUNT(*) AS n
     FROM conditions c
     JOIN applications a ON c.app_id = a.id AND c.lpa = a.lpa
-    WHERE a.decision LIKE '%INVALID%'
-    GROUP BY c.short_desc
-    ORDER BY freq DESC
-    LIMIT 30
-    """
-    
-    c.execute(query_cats)
-    top_categories = c.fetchall()
-    
+    LEFT JOIN note_clusters nc ON nc.note = c.clean_note
+    WHERE a.decision_category = 'invalid'
+    GROUP BY c.short_desc, 2
+),
+ranked AS (
+    SELECT short_desc, note, n,
+           CAST(SUM(n) OVER (PARTITION BY short_desc) AS BIGINT) AS total,
+           ROW_NUMBER() OVER (PARTITION BY short_desc ORDER BY n DESC, note COLLATE "C") AS note_rank
+    FROM note_counts
+)
+SELECT category_rank, short_desc, total, note, n
+FROM (
+    SELECT *, DENSE_RANK() OVER (ORDER BY total DESC, short_desc COLLATE "C") AS category_rank
+    FROM ranked
+) r
+WHERE category_rank <= %(categories)s AND note_rank <= %(notes)s
+ORDER BY category_rank, note_rank
+"""
+
+
+def backfill_clean_notes(conn, batch_size=5000):
+    """Fills conditions.clean_note for rows saved before it was computed at ingest."""
+    c = conn.cursor()
+    filled = 0
+    while True:
+        c.execute("SELECT id, long_desc FROM conditions WHERE clean_note IS NULL ORDER BY id LIMIT %s",
+                  (batch_size,))
+        rows = c.fetchall()
+        if not rows:
+            break
+        execute_values(c, """UPDATE conditions SET clean_note = v.note
+                             FROM (VALUES %s) AS v (id, note)
+                             WHERE conditions.id = v.id""",
+                       [(cond_id, clean_note(desc) or '') for cond_id, desc in rows])
+        conn.commit()
+        filled += len(rows)
+    if filled:
+        print(f"Backfilled clean_note for {filled} conditions", flush=True)
+    return filled
+
+
+def _load_note_signatures(conn):
+    """The stored (cluster labels, signatures) of every clustered note, streamed in."""
+    cur = conn.cursor(name='note_signatures')
+    cur.itersize = 10000
+    cur.execute("SELECT cluster, signature FROM note_clusters ORDER BY note")
+    labels, signatures = [], []
+    for cluster, signature in cur:
+        labels.append(cluster)
+        signatures.append(np.frombuffer(bytes(signature), dtype='<u4'))
+    cur.close()
+    return labels, signatures
+
+
+@timed("analysis.note_clusters")
+def update_note_clusters(conn, threshold=NOTE_THRESHOLD):
+    """Assigns the invalid applications' notes that are not in note_clusters yet
+    to a near-duplicate cluster, so notes differing only in an address, date or
+    spacing are counted together.
+
+    A new note joins the cluster of the most similar clustered note; groups of
+    new notes with no such match start a cluster labelled by their most common
+    note. Clustered notes keep their label. Returns the number of notes added."""
+    c = conn.cursor()
+    c.execute("DELETE FROM note_clusters WHERE signature_kind IS DISTINCT FROM %s", (NOTE_SIGNATURE_KIND,))
+    if c.rowcount:
+        print(f"Dropped {c.rowcount} note clusters with outdated signatures", flush=True)
+        conn.commit()
+    c.execute("""SELECT c.clean_note
+                 FROM conditions c
+                 JOIN applications a ON c.app_id = a.id AND c.lpa = a.lpa
+                 WHERE a.decision_category = 'invalid' AND c.clean_note <> ''
+                   AND NOT EXISTS (SELECT 1 FROM note_clusters nc WHERE nc.note = c.clean_note)
+                 GROUP BY c.clean_note
+                 ORDER BY COUNT(*) DESC, c.clean_note""")
+    notes = [note for (note,) in c.fetchall()]
+    if not notes:
+        return 0
+
+    labels, known = _load_note_signatures(conn)
+    signatures = minhash_signatures(*word_shingles(notes))
+    known = np.array(known, dtype=np.uint32).reshape(len(known), signatures.shape[1])
+    components, matches = assign_to_clusters(known, signatures, threshold)
+    # Notes are ordered most common first, so a component's label is its most common note
+    clusters = [labels[match] if match >= 0 else notes[component]
+                for component, match in zip(components.tolist(), matches.tolist())]
+
+    execute_values(c, """INSERT INTO note_clusters (note, cluster, signature, signature_kind) VALUES %s
+                         ON CONFLICT ((md5(note))) DO NOTHING""",
+                   [(note, cluster, psycopg2.Binary(signature.astype('<u4').tobytes()), NOTE_SIGNATURE_KIND)
+                    for note, cluster, signature in zip(notes, clusters, signatures)],
+                   page_size=1000)
+    conn.commit()
+    count("notes_clustered", len(notes))
+    print(f"Clustered {len(notes)} new invalidation notes "
+          f"({sum(match >= 0 for match in matches.tolist())} joined existing clusters)", flush=True)
+    return len(notes)
+
+
+def analyze_detailed_failures(conn=None, categories=30, notes_per_category=5):
+    own_conn = conn is None
+    if own_conn:
+        if not DATABASE_URL:
+            print("DATABASE_URL not set")
+            return
+        conn = sql_profile.connect(DATABASE_URL)
+
+    try:
+        backfill_decision_categories(conn)
+        backfill_clean_notes(conn)
+        update_note_clusters(conn)
+
+        c = conn.cursor()
+        c.execute(DETAILED_FAILURES_QUERY,
+                  {'generic': GENERIC_NOTE, 'categories': categories, 'notes': notes_per_category})
+        rows = c.fetchall()
+    finally:
+        if own_conn:
+            conn.close()
+
+    return report_detailed_failures(rows)
+
+
+def report_detailed_failures(rows):
+    """Prints and returns the analysis from (category rank, category, total,
+    note, note count) rows, ordered by category rank and then note rank."""
     print("--- Detailed Invalidation Analysis ---\n")
-    
+
     results = []
-    
-    for rank, (category, count) in enumerate(top_categories, 1):
-        print(f"{rank}. {category} (Total: {count})")
-        
-        try:
-            # 2. Get all descriptions for this category
-            c.execute("""
-                SELECT c.long_desc 
-                FROM conditions c 
-                JOIN applications a ON c.app_id = a.id AND c.lpa = a.lpa
-                WHERE a.decision LIKE '%%INVALID%%' AND c.short_desc = %s
-            """, (category,))
-            
-            descriptions = c.fetchall()
-            
-            # 3. Extract and Count Specific Notes
-            notes = []
-            for (desc,) in descriptions:
-                note = clean_note(desc)
-                if note:
-                    notes.append(note)
-                else:
-                    notes.append("(Generic/No specific note parsed)")
-
-            note_counts = Counter(notes).most_common(5)
-            
-            top_notes = []
-            for i, (issue, issue_count) in enumerate(note_counts, 1):
-                wrapped = textwrap.fill(issue, width=90)
-                indented = textwrap.indent(wrapped, '      ')
-                print(f"   {chr(96+i)}. ({issue_count} cases)")
-                print(indented)
-                top_notes.append({'note': issue, 'count': issue_count})
-            
-            print("")
-            results.append({
-                'category': category,
-                'total_count': count,
-                'top_notes': top_notes
-            })
-        except Exception as e:
-            print(f"   [ERROR processing category '{category}']: {e}")
-            import traceback
-            traceback.print_exc()
-        
-    conn.close()
+    for rank, category, count, issue, issue_count in rows:
+        if not results or results[-1]['rank'] != rank:
+            if results:
+                print("")
+            print(f"{rank}. {category} (Total: {count})")
+            results.append({'rank': rank, 'category': category, 'total_count': count, 'top_notes': []})
+
+        top_notes = results[-1]['top_notes']
+        wrapped = textwrap.fill(issue, width=90)
+        indented = textwrap.indent(wrapped, '      ')
+        print(f"   {chr(97 + len(top_notes))}. ({issue_count} cases)")
+        print(indented)
+        top_notes.append({'note': issue, 'count': issue_count})
+    if results:
+        print("")
+
+    for r in results:
+        del r['rank']
     return results
 
 if __name__ == "__main__":
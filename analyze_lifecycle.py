@@ -5,163 +5,146 @@ from datetime import datetime
 import re
 import os
 import dotenv
-from shared_utils import normalize_text, get_fullname, get_agent, location_match, is_planning_application, build_agent_dedup_map
+from shared_utils import normalize_text, get_fullname, get_agent, load_analysis_dataset, FollowUpMatcher, DerivedFieldCache, is_agent_change
 
 dotenv.load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def analyze_lifecycle():
-    if not DATABASE_URL:
-        print("DATABASE_URL not set")
-        return
+def follow_ups(matcher, inv):
+    """Returns (match, lpa_match) for one invalid application: its follow-up
+    among all applications and its follow-up within inv's own LPA. They only
+    differ when the applicant re-applied in another LPA first, so the
+    restricted search runs only in that case."""
+    match = matcher.find(inv)
+    if match is None or match['_lpa'] == inv['_lpa']:
+        return match, match
+    lpa = inv['_lpa']
+    return match, matcher.find(inv, within=lambda cand: cand['_lpa'] == lpa)
 
-    conn = psycopg2.connect(DATABASE_URL)
-    c = conn.cursor()
+
+def match_invalids(apps, derived):
+    """Finds the follow-up to every invalid application in a single pass.
+
+    Returns one (inv, match, lpa_match) tuple per invalid application, as
+    computed by follow_ups."""
+    matcher = FollowUpMatcher(apps, derived)
+    outcomes = []
+    for inv in apps:
+        if inv['_category'] != 'invalid':
+            continue
+        outcomes.append((inv, *follow_ups(matcher, inv)))
+    return outcomes
+
+
+def summarise_outcomes(label, total_apps, outcomes, derived, lpa_scoped=False):
+    """Aggregates lifecycle stats for one group from precomputed follow-ups.
+
+    lpa_scoped selects the within-LPA follow-up, matching how per-LPA figures
+    have always been reported; other groupings use the overall follow-up."""
+    total_invalids = len(outcomes)
     
-    # Get all apps including LPA
-    c.execute("SELECT id, decision, registration_date, raw_json, lpa FROM applications")
-    rows = c.fetchall()
-    conn.close()
+    followed_up_count = 0
+    total_days = 0
+    architect_churn_count = 0
     
-    apps = []
-    for r in rows:
-        try:
-            # JSONB fix
-            js = r[3]
-            if isinstance(js, str):
-                js = json.loads(js)
-            else:
-                js = js.copy() # Avoid mutation of original if cached
-                
-            js['_id'] = r[0]
-            js['_decision'] = r[1] or ''
-            js['_reg_date'] = r[2] # This is now a date object
-            js['_lpa'] = r[4] or 'unknown'
-
-            if not is_planning_application(js):
-                continue
-
-            # Date fix
-            if r[2]:
-                if isinstance(r[2], str):
-                    try:
-                        js['_dt'] = datetime.fromisoformat(r[2].replace('Z', ''))
-                    except:
-                         js['_dt'] = datetime.min
-                else: 
-                     # It's a date or datetime object
-                     if hasattr(r[2], 'combine'): # likely date
-                        js['_dt'] = datetime.combine(r[2], datetime.min.time())
-                     else:
-                        js['_dt'] = r[2]
-            else:
-                js['_dt'] = datetime.min
-                
-            apps.append(js)
-        except: pass
+    for inv, overall_match, lpa_match in outcomes:
+        match = lpa_match if lpa_scoped else overall_match
         
-    apps.sort(key=lambda x: x['_dt'])
+        if match:
+            followed_up_count += 1
+            delta = (match['_dt'] - inv['_dt']).days
+            total_days += delta
+            
+            if is_agent_change(derived.agent(inv), derived.agent(match)):
+                architect_churn_count += 1
 
-    # Build email-based dedup map
-    dedup_map = build_agent_dedup_map(apps)
-    print(f"Dedup map: {len(dedup_map)} emails -> canonical agents", flush=True)
+    return lifecycle_stats(label, total_apps, total_invalids, followed_up_count,
+                           total_days, architect_churn_count)
 
-    # Helper function to calculate stats for a given list of apps
-    def calculate_stats(app_list, label="Overall"):
-        invalids = [a for a in app_list if 'INVALID' in a['_decision'].upper()]
-        total_invalids = len(invalids)
-        total_apps = len(app_list)
-        
-        followed_up_count = 0
-        abandoned_count = 0
-        total_days = 0
-        architect_churn_count = 0
-        
-        # Build lookup for this specific set of apps
-        apps_by_applicant = {}
-        for a in app_list:
-            nm = get_fullname(a)
-            if nm:
-                if nm not in apps_by_applicant: apps_by_applicant[nm] = []
-                apps_by_applicant[nm].append(a)
-        
-        for inv in invalids:
-            inv_id = inv['_id']
-            inv_name = get_fullname(inv)
-            inv_dt = inv['_dt']
-            
-            match = None
-            candidates = apps_by_applicant.get(inv_name, [])
-            
-            for cand in candidates:
-                if cand['_id'] == inv_id: continue
-                if cand['_dt'] <= inv_dt: continue
-                
-                if location_match(inv, cand):
-                   match = cand
-                   break
-            
-            if match:
-                followed_up_count += 1
-                delta = (match['_dt'] - inv_dt).days
-                total_days += delta
-                
-                agent_inv = get_agent(inv, dedup_map)
-                agent_new = get_agent(match, dedup_map)
-                
-                is_churn = False
-                if agent_inv and agent_new:
-                    if agent_inv == agent_new: is_churn = False
-                    elif agent_inv in agent_new or agent_new in agent_inv: is_churn = False
-                    else: is_churn = True
-                        
-                if is_churn:
-                    architect_churn_count += 1
-            else:
-                abandoned_count += 1
-
-        # Calculate Rates
-        invalidation_rate = (total_invalids / total_apps) * 100 if total_apps > 0 else 0
-        follow_rate = (followed_up_count / total_invalids) * 100 if total_invalids > 0 else 0
-        abandon_rate = (abandoned_count / total_invalids) * 100 if total_invalids > 0 else 0
-        avg_days = total_days / followed_up_count if followed_up_count else 0
-        churn_rate = (architect_churn_count / followed_up_count) * 100 if followed_up_count else 0
-        
-        # Print Summary
-        print(f"\n--- {label} Analysis ---")
-        print(f"Total Applications: {total_apps}")
-        print(f"Total Invalids: {total_invalids}")
-        print(f"Invalidation Rate: {invalidation_rate:.1f}%")
-        print(f"Follow-up Rate: {follow_rate:.1f}% ({followed_up_count})")
-        print(f"Abandonment Rate: {abandon_rate:.1f}% ({abandoned_count})")
-        print(f"Avg Time to Re-apply: {avg_days:.1f} days")
-        print(f"Architect Churn Rate: {churn_rate:.1f}% ({architect_churn_count} changes)")
-        
-        return {
-            'label': label,
-            'total_applications': total_apps,
-            'total_invalids': total_invalids,
-            'overall_invalidation_rate': invalidation_rate,
-            'follow_up_rate': follow_rate,
-            'abandon_rate': abandon_rate,
-            'avg_days_to_reapply': avg_days,
-            'architect_churn_rate': churn_rate
-        }
+
+def lifecycle_stats(label, total_apps, total_invalids, followed_up_count, total_days, architect_churn_count):
+    """Turns one group's lifecycle counts into the reported rates, printing a summary."""
+    abandoned_count = total_invalids - followed_up_count
+
+    # Calculate Rates
+    invalidation_rate = (total_invalids / total_apps) * 100 if total_apps > 0 else 0
+    follow_rate = (followed_up_count / total_invalids) * 100 if total_invalids > 0 else 0
+    abandon_rate = (abandoned_count / total_invalids) * 100 if total_invalids > 0 else 0
+    avg_days = total_days / followed_up_count if followed_up_count else 0
+    churn_rate = (architect_churn_count / followed_up_count) * 100 if followed_up_count else 0
+    
+    # Print Summary
+    print(f"\n--- {label} Analysis ---")
+    print(f"Total Applications: {total_apps}")
+    print(f"Total Invalids: {total_invalids}")
+    print(f"Invalidation Rate: {invalidation_rate:.1f}%")
+    print(f"Follow-up Rate: {follow_rate:.1f}% ({followed_up_count})")
+    print(f"Abandonment Rate: {abandon_rate:.1f}% ({abandoned_count})")
+    print(f"Avg Time to Re-apply: {avg_days:.1f} days")
+    print(f"Architect Churn Rate: {churn_rate:.1f}% ({architect_churn_count} changes)")
+    
+    return {
+        'label': label,
+        'total_applications': total_apps,
+        'total_invalids': total_invalids,
+        'overall_invalidation_rate': invalidation_rate,
+        'follow_up_rate': follow_rate,
+        'abandon_rate': abandon_rate,
+        'avg_days_to_reapply': avg_days,
+        'architect_churn_rate': churn_rate
+    }
+
+
+def group_outcomes(apps, outcomes, key, derived, label_format="{}", lpa_scoped=False):
+    """Aggregates stats per group (e.g. LPA, registration year, agent) from the
+    shared outcomes of match_invalids. key maps an application to its group;
+    groups come back in key order."""
+    totals = {}
+    for a in apps:
+        k = key(a)
+        totals[k] = totals.get(k, 0) + 1
+
+    grouped = {k: [] for k in totals}
+    for outcome in outcomes:
+        grouped[key(outcome[0])].append(outcome)
+
+    return {
+        k: summarise_outcomes(label_format.format(k), totals[k], grouped[k], derived, lpa_scoped=lpa_scoped)
+        for k in sorted(totals)
+    }
+
+
+def analyze_lifecycle(dataset=None):
+    if dataset is None:
+        if not DATABASE_URL:
+            print("DATABASE_URL not set")
+            return
+        dataset = load_analysis_dataset(DATABASE_URL)
+        print(f"Dataset: {dataset.summary()}", flush=True)
+
+    # Already filtered to planning applications and sorted by date
+    apps = dataset.apps
+
+    # Email-based dedup map: the persisted agent_aliases, or built from apps
+    dedup_map = dataset.dedup_map()
+    name_clusters = dataset.name_clusters()
+    print(f"Dedup map: {len(dedup_map)} emails -> canonical agents, "
+          f"{len(name_clusters)} name variants clustered", flush=True)
+
+    derived = DerivedFieldCache(dedup_map, name_clusters)
+
+    # Follow-up matching runs once; every breakdown below is aggregated from it
+    outcomes = match_invalids(apps, derived)
 
     # 1. Overall Stats
-    overall_stats = calculate_stats(apps, "Overall")
+    overall_stats = summarise_outcomes("Overall", len(apps), outcomes, derived)
     
     # 2. Per LPA Stats
-    lpa_groups = {}
-    for a in apps:
-        l = a.get('_lpa', 'unknown')
-        if l not in lpa_groups: lpa_groups[l] = []
-        lpa_groups[l].append(a)
-        
-    lpa_stats = {}
-    for lpa, lpa_apps in lpa_groups.items():
-        lpa_stats[lpa] = calculate_stats(lpa_apps, f"LPA: {lpa}")
+    lpa_stats = group_outcomes(apps, outcomes, lambda a: a.get('_lpa', 'unknown'), derived,
+                               label_format="LPA: {}", lpa_scoped=True)
         
+    print(f"\nCache stats: {derived.summary()}", flush=True)
+
     return {
         'overall': overall_stats,
         'by_lpa': lpa_stats
@@ -1,16 +1,20 @@
-import psycopg2
 import os
 import dotenv
+from shared_utils import backfill_decision_categories
+import sql_profile
 
 dotenv.load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-def analyze_spread():
-    if not DATABASE_URL:
-        print("DATABASE_URL not set")
-        return
+def analyze_spread(conn=None):
+    own_conn = conn is None
+    if own_conn:
+        if not DATABASE_URL:
+            print("DATABASE_URL not set")
+            return
+        conn = sql_profile.connect(DATABASE_URL)
 
-    conn = psycopg2.connect(DATABASE_URL)
+    backfill_decision_categories(conn)
     c = conn.cursor()
     
     # Get all invalidation reasons and their counts
@@ -20,15 +24,21 @@ def analyze_spread():
         COUNT(*) as freq
     FROM conditions c
     JOIN applications a ON c.app_id = a.id
-    WHERE a.decision LIKE '%INVALID%'
+    WHERE a.decision_category = 'invalid'
     GROUP BY c.short_desc
     ORDER BY freq DESC
     """
     
     c.execute(query)
     rows = c.fetchall()
-    conn.close()
-    
+    if own_conn:
+        conn.close()
+
+    return report_spread(rows)
+
+
+def report_spread(rows):
+    """Prints and returns the spread analysis from (reason, count) rows, most frequent first."""
     total_issues = sum(row[1] for row in rows)
     
     print(f"--- Invalidation Spread Analysis ---")
@@ -15,10 +15,11 @@ import argparse
 import os
 import sys
 
-import psycopg2
 from dotenv import load_dotenv
 from pyproj import Transformer
 
+import sql_profile
+
 load_dotenv()
 
 # ITM (EPSG:2157) → WGS84 (EPSG:4326)
@@ -65,7 +66,7 @@ def get_db_connection():
     db_url = os.environ.get("DATABASE_URL")
     if not db_url:
         raise RuntimeError("DATABASE_URL environment variable is not set")
-    return psycopg2.connect(db_url)
+    return sql_profile.connect(db_url)
 
 
 def backfill_from_grid(conn, dry_run: bool = False) -> int:
@@ -220,8 +221,13 @@ def main():
     parser.add_argument("--coords-only", action="store_true", help="Only run ITM→WGS84 conversion")
     parser.add_argument("--geocode-only", action="store_true", help="Only run Google geocoding")
     parser.add_argument("--dry-run", action="store_true", help="Compute but do not write to DB")
+    parser.add_argument("--profile-sql", action="store_true",
+                        help="Profile every SQL statement and write a ranked report to out/sql_profile.txt")
     args = parser.parse_args()
 
+    if args.profile_sql:
+        sql_profile.enable()
+
     run_coords = args.coords_only or (not args.coords_only and not args.geocode_only)
     run_geocode = args.geocode_only or (not args.coords_only and not args.geocode_only)
 
@@ -231,6 +237,9 @@ def main():
             backfill_from_grid(conn, dry_run=args.dry_run)
         if run_geocode:
             backfill_from_geocoding(conn, dry_run=args.dry_run)
+        if args.profile_sql:
+            conn.rollback()
+            sql_profile.write_report("out", conn)
     finally:
         conn.close()
 
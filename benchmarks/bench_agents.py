@@ -0,0 +1,127 @@
+"""
+Benchmark: vectorised agent_stats against the per-application loop.
+
+Builds a synthetic dataset of compact application dicts (as AnalysisDataset
+holds them), checks both implementations agree, and reports their timings.
+
+Usage:
+  python benchmarks/bench_agents.py [--count 1000000] [--agents 5000] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
+
+from analyze_agents import agent_stats  # noqa: E402
+from shared_utils import build_agent_dedup_map, classify_decision, extract_email, get_agent  # noqa: E402
+
+DECISIONS = ["GRANT PERMISSION", "REFUSE PERMISSION", "DECLARE APPLICATION INVALID",
+             "Invalid application", "SPLIT DECISION", ""]
+
+
+def _most_common(counter):
+    """The counter's most frequent value, ties going to the lowest ("" if empty)."""
+    return min(counter.items(), key=lambda item: (-item[1], item[0]))[0] if counter else ""
+
+
+def agent_stats_loop(apps, dedup_map=None, name_clusters=None):
+    """The per-application loop agent_stats replaced, kept as the reference
+    its output is checked and benchmarked against."""
+    stats_by_agent = defaultdict(lambda: {'total': 0, 'invalid': 0, 'emails': Counter(), 'phones': Counter()})
+
+    for js in apps:
+        agent = get_agent(js, dedup_map, name_clusters)
+        if agent == "unknown/none" or len(agent) < 3:
+            continue
+
+        stats_by_agent[agent]['total'] += 1
+        if js['_category'] == 'invalid':
+            stats_by_agent[agent]['invalid'] += 1
+
+        email_raw = js.get('agentEmail')
+        if email_raw:
+            email = extract_email(email_raw)
+            if email: stats_by_agent[agent]['emails'][email] += 1
+
+        phone = js.get('agentTelephoneNumber')
+        if phone:
+            stats_by_agent[agent]['phones'][phone.strip()] += 1
+
+    results = []
+    for agent, stats in stats_by_agent.items():
+        if stats['total'] > 0:
+            results.append({
+                'name': agent,
+                'total': stats['total'],
+                'invalid': stats['invalid'],
+                'rate': (stats['invalid'] / stats['total']) * 100,
+                'email': _most_common(stats['emails']),
+                'phone': _most_common(stats['phones'])
+            })
+    return sorted(results, key=lambda x: (-x['invalid'], x['name']))
+
+
+def synthetic_apps(count, agents=5000, seed=1):
+    """count applications spread over a long-tailed population of agents."""
+    rng = random.Random(seed)
+    practices = []
+    for i in range(agents):
+        domain = rng.choice(["gmail.com", f"practice{i}.ie"])
+        practices.append((f"Practice {i} Architects", f"info{i}@{domain}",
+                          f"01 {rng.randint(1000000, 9999999)}"))
+    base = datetime(2015, 1, 1)
+    apps = []
+    for i in range(count):
+        # Long tail: a few busy practices, many occasional ones
+        decision = rng.choice(DECISIONS)
+        name, email, phone = practices[min(int(rng.paretovariate(1.2)) - 1, agents - 1)
+                                       if rng.random() < 0.5 else rng.randrange(agents)]
+        app = {
+            '_id': i,
+            '_lpa': 'fingal',
+            '_decision': decision,
+            '_category': classify_decision(decision),
+            '_dt': base + timedelta(days=i * 3650 // max(count, 1)),
+            'agentSurname': name if rng.random() > 0.05 else name.upper(),
+        }
+        if rng.random() > 0.2:
+            app['agentEmail'] = email if rng.random() > 0.1 else f"{name} <{email}>"
+        if rng.random() > 0.3:
+            app['agentTelephoneNumber'] = phone
+        apps.append(app)
+    return apps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--agents", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    apps = synthetic_apps(args.count, args.agents, args.seed)
+    dedup_map = build_agent_dedup_map(apps)
+    print(f"Generated {len(apps)} applications in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    expected = agent_stats_loop(apps, dedup_map)
+    loop_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = agent_stats(apps, dedup_map)
+    vector_seconds = time.perf_counter() - start
+
+    assert actual == expected, "vectorised agent_stats disagrees with the loop"
+    print(f"loop:       {loop_seconds:8.2f}s")
+    print(f"vectorised: {vector_seconds:8.2f}s  ({loop_seconds / vector_seconds:.1f}x faster, {len(actual)} agents)")
+
+
+if __name__ == "__main__":
+    main()
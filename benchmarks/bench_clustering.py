@@ -0,0 +1,86 @@
+"""
+Benchmark: LSH clustering of agent name variants.
+
+Generates distinct practice names plus misspelt variants of some of them,
+clusters them with cluster_agent_names and reports the time taken, how many
+candidate pairs the LSH blocking produced and how many variants were joined
+to their original.
+
+Usage:
+  python benchmarks/bench_clustering.py [--names 300000] [--variants 0.2] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from clustering import (_name_key, candidate_pairs, char_ngrams, cluster_agent_names,  # noqa: E402
+                        minhash_signatures)
+
+SYLLABLES = [c + v for c in "bcdfghjklmnprstvwyz" for v in ("a", "e", "i", "o", "u", "ea", "ou")]
+
+
+def _word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _misspell(rng, name):
+    i = rng.randrange(len(name))
+    edit = rng.choice(["drop", "swap", "space"])
+    if edit == "drop":
+        return name[:i] + name[i + 1:]
+    if edit == "swap" and i + 1 < len(name):
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name[:i] + " " + name[i:]
+
+
+def synthetic_names(count, variants=0.2, seed=1):
+    """{name: applications} for count practice names, and (variant, original) pairs."""
+    rng = random.Random(seed)
+    counts = {}
+    while len(counts) < count:
+        counts[f"{_word(rng)} {_word(rng)}"] = rng.randint(1, 50)
+    pairs = []
+    for name in rng.sample(sorted(counts), int(count * variants)):
+        variant = _misspell(rng, name)
+        if variant not in counts and len(_name_key(variant)) >= 3:
+            counts[variant] = 1
+            pairs.append((variant, name))
+    return counts, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--names", type=int, default=300_000)
+    parser.add_argument("--variants", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    counts, pairs = synthetic_names(args.names, args.variants, args.seed)
+    print(f"Generated {len(counts)} distinct names ({len(pairs)} misspelt variants)")
+
+    start = time.perf_counter()
+    clusters = cluster_agent_names(counts)
+    seconds = time.perf_counter() - start
+
+    names = sorted(counts)
+    i, _ = candidate_pairs(minhash_signatures(*char_ngrams([_name_key(name) for name in names])))
+
+    def canonical(name):
+        return clusters.get(name, name)
+
+    joined = sum(canonical(variant) == canonical(original) for variant, original in pairs)
+    print(f"clustered:  {seconds:8.2f}s  ({len(clusters)} names mapped to another)")
+    print(f"candidates: {len(i):8d}   ({len(i) / len(names):.2f} per name)")
+    print(f"variants joined to their original: {joined}/{len(pairs)} ({joined / max(len(pairs), 1):.0%})")
+    sizes = np.bincount(np.unique([canonical(name) for name in names], return_inverse=True)[1])
+    print(f"largest cluster: {sizes.max()} names")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Benchmark suite: shared_utils helpers, the portal parsers and the analyses.
+
+Every case runs on fixed synthetic data (the same for a given size and seed)
+at each of several sizes, a few times; the fastest run is kept. Results are
+saved as a JSON baseline, and compare flags cases that got slower than a
+baseline by more than a threshold, exiting non-zero if any did:
+
+  python benchmarks/suite.py run [--sizes 1000 10000 100000] [--repeat 3] [--only agent]
+                                 [--output benchmarks/baselines/baseline.json]
+  python benchmarks/suite.py compare BASELINE CURRENT [--threshold 0.2]
+
+Baselines are only comparable between runs on the same machine.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
+
+import main  # noqa: E402
+import shared_utils  # noqa: E402
+from analyze_agents import analyze_agents  # noqa: E402
+from analyze_churn_agents import analyze_churn_agents  # noqa: E402
+from analyze_lifecycle import analyze_lifecycle  # noqa: E402
+from snapshot import Snapshot, detailed_failures, spread, write_snapshot  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "baseline.json")
+
+LPAS = ["dunlaoghaire", "fingal", "dublincity", "southdublin"]
+DECISIONS = ["GRANT PERMISSION", "GRANT PERMISSION", "REFUSE PERMISSION", "DECLARE APPLICATION INVALID",
+             "Invalid application", "SPLIT DECISION", "Extension of Duration GRANTED", ""]
+STREETS = ["Main Street", "Church Road", "Seafield Avenue", "Mount Anville Park", "Strand Road",
+           "Castle Court", "Station Road", "Kilmacud Road Upper"]
+REASONS = ["Site Notice", "Newspaper Notice", "Fee", "Drawings", "Site Location Map", "Public Notice"]
+NOTES = ["Site notice at {n} {street} not legible", "Fee incorrect amount, {n} euro outstanding",
+         "drawings missing scale bar", "Newspaper notice published {n} days late",
+         "Site location map does not outline {street} in red"]
+
+
+class BenchData:
+    """Synthetic inputs for one size, built on first use and reused by every case."""
+
+    def __init__(self, size, seed=1):
+        self.size = size
+        self.seed = seed
+        self._cache = {}
+        self.tmp_dir = tempfile.mkdtemp(prefix="bench-")
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def rows(self):
+        """(id, lpa, decision, registration_date, raw_json) rows, as the dataset loader reads them."""
+        return self._get("rows", self._build_rows)
+
+    def _build_rows(self):
+        rng = random.Random(self.seed)
+        agents = max(self.size // 20, 10)
+        practices = [(f"{rng.choice(['Walsh', 'Byrne', 'Kelly', 'O Brien', 'Murphy'])} {i} Architects",
+                      f"info{i}@" + rng.choice(["gmail.com", f"practice{i}.ie"])) for i in range(agents)]
+        base = datetime(2020, 1, 1)
+        rows = []
+        i = 0
+        while len(rows) < self.size:
+            name, email = practices[min(int(rng.paretovariate(1.2)) - 1, agents - 1)]
+            street = rng.choice(STREETS)
+            number = rng.randint(1, 200)
+            easting, northing = 715000 + rng.uniform(-8000, 8000), 728000 + rng.uniform(-8000, 8000)
+            dt = base + timedelta(days=rng.randint(0, 1800))
+            app = {
+                'applicationType': rng.choice(["Permission", "Permission", "Retention", "Outline Permission"]),
+                'agentSurname': name if rng.random() > 0.1 else name.upper(),
+                'agentEmail': email,
+                'applicantForename': rng.choice(["Mary", "John", "Aoife", "Sean"]),
+                'applicantSurname': f"Applicant{rng.randrange(self.size)}",
+                'easting': easting,
+                'northing': northing,
+                'location': f"{number} {street}, Co. Dublin",
+            }
+            decision = rng.choice(DECISIONS)
+            lpa = rng.choice(LPAS)
+            rows.append((i, lpa, decision, dt, app))
+            i += 1
+            if decision in ("DECLARE APPLICATION INVALID", "Invalid application") and rng.random() < 0.6:
+                # Re-application at the same site, often with a different agent
+                follow_up = dict(app, easting=easting + rng.uniform(-20, 20))
+                if rng.random() < 0.5:
+                    follow_up['agentSurname'], follow_up['agentEmail'] = rng.choice(practices)
+                rows.append((i, lpa, "GRANT PERMISSION", dt + timedelta(days=rng.randint(10, 400)), follow_up))
+                i += 1
+        return rows[:self.size]
+
+    def apps(self):
+        return self._get("apps", lambda: shared_utils.build_analysis_dataset(self.rows()).apps)
+
+    def dedup_map(self):
+        return self._get("dedup_map", lambda: shared_utils.build_agent_dedup_map(self.apps()))
+
+    def names(self):
+        return [app['agentSurname'] for app in self.apps()]
+
+    def notes(self):
+        def build():
+            rng = random.Random(self.seed)
+            return [f"Condition {n}: the application is invalid. Note: "
+                    + rng.choice(NOTES).format(n=rng.randint(1, 99), street=rng.choice(STREETS))
+                    + "\n Please resubmit." if n % 4 else f"Condition {n}: invalid under Article 22."
+                    for n in range(self.size)]
+        return self._get("notes", build)
+
+    def portal_pages(self):
+        """(Dublin City pages, South Dublin pages): one page per 100 applications, 40 documents each."""
+        def build():
+            rng = random.Random(self.seed)
+            dublin, south = [], []
+            for page in range(max(self.size // 100, 1)):
+                rows = [{"Guid": f"{page:06d}-{n:04d}", "Doc_Type": rng.choice(["Drawing", "Form", "Letter"]),
+                         "Doc_Ref": f" DOC{n} ", "Date_Received": "2024-03-01T00:00:00"} for n in range(40)]
+                dublin.append(f"<html><script>var model = {json.dumps({'Rows': rows})};</script></html>")
+                south.append("<table>" + "".join(
+                    f'<tr><td headers="DateReceived">0{n % 9 + 1}/03/2024</td>'
+                    f'<td headers="FileName"><a href="/Home/ViewDocument?fileId={page * 100 + n}" '
+                    f'target="_blank">Drawing {n}</a></td><td>PDF</td></tr>' for n in range(40)) + "</table>")
+            return dublin, south
+        return self._get("portal_pages", build)
+
+    def snapshot(self):
+        """A snapshot of the applications with conditions on the invalid ones."""
+        def build():
+            rng = random.Random(self.seed)
+            notes = self.notes()
+            conditions = []
+            for app_id, lpa, decision, _, _ in self.rows():
+                if shared_utils.classify_decision(decision) == 'invalid':
+                    for order in range(rng.randint(1, 4)):
+                        note = notes[rng.randrange(len(notes))]
+                        conditions.append((app_id, lpa, order, rng.choice(REASONS), shared_utils.clean_note(note)))
+            path = os.path.join(self.tmp_dir, "snapshot")
+            keys = [key for _, key in shared_utils.PROJECTED_FIELDS]
+            write_snapshot(path, {
+                'applications': ((app_id, lpa, decision, dt.date(), app['location'],
+                                  *(app.get(key) for key in keys))
+                                 for app_id, lpa, decision, dt, app in self.rows()),
+                'conditions': conditions,
+            })
+            return path
+        return self._get("snapshot", build)
+
+    def close(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def _cold(func):
+    """func with the normalisation caches cleared first, as in a fresh run."""
+    def run():
+        shared_utils._normalize_text_cached.cache_clear()
+        shared_utils._location_tokens_cached.cache_clear()
+        return func()
+    return run
+
+
+# Case name -> builds, from a BenchData, the call to time. Inputs are built
+# before timing starts; each repeat gets a freshly built call.
+CASES = {
+    "normalize_text": lambda data: _cold(lambda names=data.names(): [shared_utils.normalize_text(n) for n in names]),
+    "get_agent": lambda data: (lambda apps=data.apps(), dedup_map=data.dedup_map():
+                               [shared_utils.get_agent(app, dedup_map) for app in apps]),
+    "location_match": lambda data: _cold(lambda apps=data.apps(): [shared_utils.location_match(a, b)
+                                                                   for a, b in zip(apps, apps[1:])]),
+    "build_agent_dedup_map": lambda data: (lambda apps=data.apps(): shared_utils.build_agent_dedup_map(apps)),
+    "clean_note": lambda data: (lambda notes=data.notes(): [shared_utils.clean_note(n) for n in notes]),
+    "parse_dublin_city_documents": lambda data: (lambda pages=data.portal_pages()[0]:
+                                                 [main.parse_dublin_city_documents(p) for p in pages]),
+    "parse_south_dublin_documents": lambda data: (lambda pages=data.portal_pages()[1]:
+                                                  [main.parse_south_dublin_documents(p) for p in pages]),
+    # Each analysis gets a new dataset, so it builds the agent maps itself as in a run
+    "analyze_agents": lambda data: (lambda dataset=shared_utils.AnalysisDataset(data.apps()):
+                                    analyze_agents(dataset=dataset)),
+    "analyze_churn_agents": lambda data: (lambda dataset=shared_utils.AnalysisDataset(data.apps()):
+                                          analyze_churn_agents(dataset=dataset)),
+    "analyze_lifecycle": lambda data: (lambda dataset=shared_utils.AnalysisDataset(data.apps()):
+                                       analyze_lifecycle(dataset=dataset)),
+    "detailed_failures": lambda data: (lambda snapshot=Snapshot(data.snapshot()): detailed_failures(snapshot)),
+    "spread": lambda data: (lambda snapshot=Snapshot(data.snapshot()): spread(snapshot)),
+}
+
+
+def run_case(build, data, repeat):
+    """Timings, in seconds, of repeat runs of the case; the analyses' output is discarded."""
+    timings = []
+    for _ in range(repeat):
+        call = build(data)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            call()
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_suite(sizes=DEFAULT_SIZES, repeat=3, only=None, seed=1):
+    """Runs the cases (those whose name contains only, if given) at every size."""
+    results = {}
+    for size in sizes:
+        data = BenchData(size, seed)
+        try:
+            for name, build in CASES.items():
+                if only and only not in name:
+                    continue
+                timings = run_case(build, data, repeat)
+                key = f"{name}[{size}]"
+                results[key] = {"seconds": min(timings), "runs": timings}
+                print(f"  {key:<42} {min(timings):>10.4f}s", flush=True)
+        finally:
+            data.close()
+    return {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "seed": seed,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=0.2, min_seconds=0.001):
+    """(case, baseline seconds, current seconds, ratio, regressed) for every case in both.
+    Cases faster than min_seconds in both are never flagged, being mostly noise."""
+    rows = []
+    for key in sorted(set(baseline["results"]) & set(current["results"])):
+        before = baseline["results"][key]["seconds"]
+        after = current["results"][key]["seconds"]
+        ratio = after / before if before else float('inf')
+        regressed = ratio > 1 + threshold and max(before, after) >= min_seconds
+        rows.append((key, before, after, ratio, regressed))
+    return rows
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the suite and save the results as a baseline")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--only", help="Only run cases whose name contains this")
+    run_parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    compare_parser = subparsers.add_parser("compare", help="Flag cases slower than in a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="Allowed slowdown as a fraction (default 0.2, i.e. 20%%)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_suite(args.sizes, args.repeat, args.only, args.seed)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {len(results['results'])} results to {args.output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    print(f"{'Case':<42} {'Baseline':>10} {'Current':>10} {'Change':>8}")
+    for key, before, after, ratio, regressed in rows:
+        print(f"{key:<42} {before:>9.4f}s {after:>9.4f}s {ratio - 1:>+7.0%}{'  REGRESSION' if regressed else ''}")
+    regressions = sum(row[4] for row in rows)
+    print(f"\n{regressions} of {len(rows)} cases regressed by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
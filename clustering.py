@@ -0,0 +1,200 @@
+"""
+Near-duplicate clustering of short texts with MinHash and LSH blocking.
+
+Every text is reduced to its set of character n-grams and a MinHash signature
+(one minimum per hash function, computed with NumPy over all texts at once).
+Signatures are cut into bands; texts whose band values all agree land in the
+same bucket and become candidate pairs. Each bucket member is paired with the
+bucket's first member only, so the number of candidates grows linearly with
+the number of texts rather than with its square. Candidates whose estimated
+Jaccard similarity reaches the threshold are joined into clusters.
+
+With the default 16 bands of 4 hashes, a pair at Jaccard similarity 0.6
+becomes a candidate with probability ~0.9, and one at 0.3 with ~0.12.
+
+cluster_agent_names applies this to normalised agent names, giving the
+name -> canonical name map get_agent resolves spelling variants with.
+analyze_invalid.update_note_clusters applies it to invalidation notes, as
+sets of word pairs, assigning only notes not seen before to a cached cluster.
+Pairs rather than single words keep notes that share their subject but not
+their finding ("location plan missing", "location plan incorrect") apart.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+AGENT_NAME_THRESHOLD = 0.6
+NOTE_THRESHOLD = 0.5
+
+_WORD_RE = re.compile(r"[a-z]+|[0-9]+")
+
+# Odd 64-bit multipliers for combining a band's hash values into one key
+_BAND_MIX = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0x27D4EB2F165667C5,
+                      0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9],
+                     dtype=np.uint64)
+
+
+def char_ngrams(texts, k=3):
+    """Character k-grams (k <= 8) of every text, padded with ^ and $ so even a
+    one-character text has one. Returns (row starts, gram codes): codes[starts[i]:
+    starts[i + 1]] are text i's k-grams, each packed from its UTF-8 bytes into
+    an integer. Every text must be non-empty."""
+    encoded = [f"^{text}$".encode() for text in texts]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    ends = np.cumsum(lengths)
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+    rows = np.repeat(np.arange(len(encoded)), lengths)
+    # A gram starts wherever the k bytes from it stay within one text
+    positions = np.flatnonzero(np.arange(len(data)) + k <= ends[rows])
+    codes = np.zeros(len(positions), dtype=np.uint64)
+    for offset in range(k):
+        codes = (codes << np.uint64(8)) | data[positions + offset]
+    return np.searchsorted(rows[positions], np.arange(len(encoded))), codes
+
+
+def word_shingles(texts, k=2):
+    """Sparse codes of every text's distinct word k-grams: runs of k adjacent
+    lower-cased words, with every run of digits reading as one "0" so dates,
+    house numbers and references do not tell notes apart. A text of fewer
+    than k words is one shingle of all of them. Returns (row starts, shingle
+    codes) in the char_ngrams layout; the codes are CRC-32s, so they are
+    stable across runs and signatures computed from them can be stored."""
+    starts = np.zeros(len(texts), dtype=np.int64)
+    codes = []
+    for row, text in enumerate(texts):
+        starts[row] = len(codes)
+        words = ["0" if word.isdigit() else word for word in _WORD_RE.findall(text.lower())] or [text]
+        shingles = {" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))}
+        codes.extend(zlib.crc32(shingle.encode()) for shingle in sorted(shingles))
+    return starts, np.array(codes, dtype=np.uint64)
+
+
+def minhash_signatures(starts, codes, num_perm=64, seed=1):
+    """(rows, num_perm) uint32 MinHash signatures of the sets codes[starts[i]:starts[i + 1]].
+
+    The num_perm multiply-shift hashes are computed once per distinct code,
+    then gathered and reduced one hash at a time, so memory stays
+    proportional to the number of codes rather than codes x num_perm."""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+    distinct, inverse = np.unique(codes, return_inverse=True)
+    hashes = ((a[:, None] * distinct[None, :] + b[:, None]) >> np.uint64(32)).astype(np.uint32)
+    signatures = np.empty((len(starts), num_perm), dtype=np.uint32)
+    for i in range(num_perm):
+        signatures[:, i] = np.minimum.reduceat(hashes[i][inverse], starts)
+    return signatures
+
+
+def candidate_pairs(signatures, bands=16):
+    """Unique (i, j) row pairs, i < j, whose signatures agree on every value
+    of at least one band."""
+    rows, num_perm = signatures.shape
+    width = num_perm // bands
+    firsts, seconds = [], []
+    for band in range(bands):
+        block = signatures[:, band * width:(band + 1) * width].astype(np.uint64)
+        bucket = np.bitwise_xor.reduce(block * _BAND_MIX[:width], axis=1)
+        # Rows in one bucket end up adjacent; pair each with the bucket's first row
+        order = np.argsort(bucket, kind='stable')
+        in_bucket = np.zeros(rows, dtype=bool)
+        in_bucket[1:] = bucket[order[1:]] == bucket[order[:-1]]
+        bucket_first = order[np.maximum.accumulate(np.where(in_bucket, 0, np.arange(rows)))]
+        firsts.append(bucket_first[in_bucket])
+        seconds.append(order[in_bucket])
+    i = np.concatenate(firsts)
+    j = np.concatenate(seconds)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    packed = np.unique(i.astype(np.int64) * rows + j)
+    return packed // rows, packed % rows
+
+
+def connected_components(count, i, j):
+    """Component label (its smallest member) for each of count nodes joined by edges i-j."""
+    labels = np.arange(count)
+    i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+    while len(i):
+        # Hook every edge's larger label onto its smaller one, then flatten
+        li, lj = labels[i], labels[j]
+        low, high = np.minimum(li, lj), np.maximum(li, lj)
+        np.minimum.at(labels, high, low)
+        while True:
+            flattened = labels[labels]
+            if (flattened == labels).all():
+                break
+            labels = flattened
+        keep = labels[i] != labels[j]
+        i, j = i[keep], j[keep]
+    return labels
+
+
+def cluster_signatures(signatures, threshold, bands=16):
+    """Near-duplicate cluster label (smallest member index) for each signature row."""
+    if not len(signatures):
+        return np.empty(0, dtype=np.int64)
+    i, j = candidate_pairs(signatures, bands=bands)
+    # The fraction of agreeing hashes estimates the pair's Jaccard similarity
+    similar = (signatures[i] == signatures[j]).mean(axis=1) >= threshold
+    return connected_components(len(signatures), i[similar], j[similar])
+
+
+def assign_to_clusters(known, new, threshold, bands=16):
+    """Assigns new signature rows to the clusters of already clustered known rows.
+
+    New rows are first grouped among themselves (components, labelled by
+    their smallest row); a group with a known row at or above the threshold
+    joins the cluster of the most similar one. Returns (components, matches):
+    matches[r] is the known row new row r's group joins, or -1 if the group
+    starts a cluster of its own. Known clusters are never merged or split."""
+    offset = len(known)
+    signatures = np.concatenate([known, new]) if offset else new
+    if not len(new):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    i, j = candidate_pairs(signatures, bands=bands)
+    # Pairs are ordered i < j, so known-known pairs are the ones with j < offset
+    i, j = i[j >= offset], j[j >= offset]
+    similarity = (signatures[i] == signatures[j]).mean(axis=1)
+    similar = similarity >= threshold
+    i, j, similarity = i[similar], j[similar], similarity[similar]
+
+    among_new = i >= offset
+    components = connected_components(len(new), i[among_new] - offset, j[among_new] - offset)
+
+    known_rows, groups, scores = i[~among_new], components[j[~among_new] - offset], similarity[~among_new]
+    # Per group: the most similar known row, ties going to the earliest
+    order = np.lexsort((known_rows, -scores, groups))
+    groups, known_rows = groups[order], known_rows[order]
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    best = np.full(len(new), -1, dtype=np.int64)
+    best[groups[first]] = known_rows[first]
+    return components, best[components]
+
+
+def _name_key(name):
+    # Spacing and punctuation differences ("o brien", "o'brien", "obrien") never matter
+    return re.sub(r'[^0-9a-z]', '', name.lower())
+
+
+def cluster_agent_names(name_counts, threshold=AGENT_NAME_THRESHOLD):
+    """Groups spelling variants of agent names.
+
+    name_counts maps each normalised agent name to how many applications use
+    it. Returns {name: canonical name} for every name whose cluster is
+    represented by another name: the cluster's most used one, ties going to
+    the alphabetically first."""
+    # Names too short to be an agent (as the analyses judge them) are left alone
+    names = sorted(name for name in name_counts if len(_name_key(name)) >= 3 and name != "Unknown/None")
+    if not names:
+        return {}
+    labels = cluster_signatures(minhash_signatures(*char_ngrams([_name_key(name) for name in names])), threshold)
+
+    best = {}
+    for name, label in zip(names, labels.tolist()):
+        current = best.get(label)
+        if current is None or name_counts[name] > name_counts[current]:
+            best[label] = name
+    return {name: best[label] for name, label in zip(names, labels.tolist()) if best[label] != name}
+
@@ -0,0 +1,315 @@
+"""
+Extract text from downloaded planning documents into the document_text table.
+
+Cover letters, invalidation letters and planners' reports are parsed in a
+process pool (one worker per core by default). Each file is hashed first so
+that content which has already been processed — including the same file
+downloaded for two applications — is never extracted twice. Results are
+written in batches, and every file runs under a per-file timeout so one
+malformed PDF cannot stall a worker. Files that failed to extract keep their
+error row but are retried on the next run.
+
+Usage:
+  python extract_text.py [--workers N] [--timeout SECONDS] [--batch-size N] [--limit N] [--dry-run]
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import html
+import os
+import re
+import signal
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from psycopg2.extras import execute_values
+
+DEFAULT_TIMEOUT = 60
+DEFAULT_BATCH_SIZE = 100
+
+_TEXT_EXTENSIONS = {'.txt', '.csv'}
+_HTML_EXTENSIONS = {'.html', '.htm'}
+
+# Hashes already present in document_text, installed once per worker process
+_known_hashes = frozenset()
+
+
+class ExtractionTimeout(BaseException):
+    """Raised inside a worker when a single file exceeds its time budget.
+
+    A BaseException so that parsers catching Exception (pypdf does, around
+    malformed objects) cannot swallow it and keep running."""
+
+
+def file_content_hash(path, chunk_size=1 << 20):
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _html_to_text(markup):
+    markup = re.sub(r'(?is)<(script|style)[^>]*>.*?</\1>', ' ', markup)
+    markup = re.sub(r'<[^>]+>', ' ', markup)
+    return html.unescape(markup)
+
+
+def extract_file_text(path):
+    """Extracts plain text from a document.
+
+    Returns:
+        (text, page_count, extractor) — page_count is None for non-paged formats.
+
+    Raises:
+        ValueError: if the file type is not supported.
+    """
+    ext = os.path.splitext(path)[1].lower()
+
+    if ext == '.pdf':
+        from pypdf import PdfReader  # local import — optional dependency
+
+        reader = PdfReader(path)
+        pages = [page.extract_text() or '' for page in reader.pages]
+        return "\n".join(pages), len(pages), 'pypdf'
+
+    if ext in _TEXT_EXTENSIONS or ext in _HTML_EXTENSIONS:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        if ext in _HTML_EXTENSIONS:
+            return _html_to_text(text), None, 'html'
+        return text, None, 'text'
+
+    raise ValueError(f"Unsupported document type: {ext or '(none)'}")
+
+
+def _normalise_whitespace(text):
+    # Collapse runs of spaces but keep paragraph breaks for downstream parsing
+    text = text.replace('\x00', '')
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    text = re.sub(r'\n\s*\n+', '\n\n', text)
+    return text.strip()
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _init_worker(known_hashes):
+    global _known_hashes
+    _known_hashes = frozenset(known_hashes)
+    signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def _extract_one(doc_id, path, timeout):
+    """Worker entry point: hash, skip if known, otherwise extract under a timeout."""
+    result = {
+        'document_id': doc_id,
+        'content_hash': None,
+        'text': None,
+        'page_count': None,
+        'extractor': None,
+        'error': None,
+        'skipped': False,
+        'elapsed': 0.0,
+    }
+    start = time.perf_counter()
+
+    try:
+        result['content_hash'] = file_content_hash(path)
+    except OSError as e:
+        result['error'] = f"read error: {e}"
+        return result
+
+    if result['content_hash'] in _known_hashes:
+        result['skipped'] = True
+        return result
+
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        text, page_count, extractor = extract_file_text(path)
+        result['text'] = _normalise_whitespace(text)
+        result['page_count'] = page_count
+        result['extractor'] = extractor
+    except ExtractionTimeout:
+        result['error'] = f"timeout after {timeout}s"
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        result['elapsed'] = time.perf_counter() - start
+
+    return result
+
+
+def get_pending_documents(conn, limit=None):
+    """Returns (document_id, local_path) for downloaded files not yet linked to
+    extracted text, including those whose last extraction failed."""
+    cur = conn.cursor()
+    query = """
+        SELECT d.id, d.local_path
+        FROM documents d
+        WHERE d.local_path IS NOT NULL
+          AND (d.content_hash IS NULL
+               OR NOT EXISTS (SELECT 1 FROM document_text t
+                              WHERE t.content_hash = d.content_hash AND t.error IS NULL))
+        ORDER BY d.id
+    """
+    params = []
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    cur.close()
+    return rows
+
+
+def get_known_hashes(conn):
+    """Hashes extracted successfully; failed ones are left out so they are retried."""
+    cur = conn.cursor()
+    cur.execute("SELECT content_hash FROM document_text WHERE error IS NULL")
+    hashes = {row[0] for row in cur.fetchall()}
+    cur.close()
+    return hashes
+
+
+def _flush(conn, text_rows, link_rows):
+    cur = conn.cursor()
+    if text_rows:
+        execute_values(
+            cur,
+            """
+            INSERT INTO document_text
+                (content_hash, text, char_count, page_count, extractor, error, extracted_at)
+            VALUES %s
+            ON CONFLICT (content_hash) DO UPDATE SET
+                text = EXCLUDED.text,
+                char_count = EXCLUDED.char_count,
+                page_count = EXCLUDED.page_count,
+                extractor = EXCLUDED.extractor,
+                error = EXCLUDED.error,
+                extracted_at = EXCLUDED.extracted_at
+            WHERE document_text.error IS NOT NULL
+            """,
+            text_rows,
+            template="(%s, %s, %s, %s, %s, %s, NOW())",
+        )
+    if link_rows:
+        execute_values(
+            cur,
+            """
+            UPDATE documents AS d SET content_hash = v.content_hash
+            FROM (VALUES %s) AS v(id, content_hash)
+            WHERE d.id = v.id
+            """,
+            link_rows,
+        )
+    conn.commit()
+    cur.close()
+
+
+def extract_documents(conn, workers=None, timeout=DEFAULT_TIMEOUT, batch_size=DEFAULT_BATCH_SIZE,
+                      limit=None, dry_run=False):
+    """Extracts text for every pending downloaded document.
+
+    Returns:
+        dict of counters: processed, extracted, skipped, failed.
+    """
+    pending = get_pending_documents(conn, limit=limit)
+    known = get_known_hashes(conn)
+    workers = workers or os.cpu_count() or 1
+    print(f"[extract] {len(pending)} documents pending, {len(known)} hashes already extracted, "
+          f"{workers} workers", flush=True)
+
+    stats = {'processed': 0, 'extracted': 0, 'skipped': 0, 'failed': 0}
+    if not pending:
+        return stats
+
+    text_rows = []
+    link_rows = []
+    seen_this_run = set()
+    start = time.time()
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(known,)
+    ) as executor:
+        futures = {executor.submit(_extract_one, doc_id, path, timeout): doc_id for doc_id, path in pending}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except BrokenProcessPool as e:
+                # A worker died (crash or OOM kill); every file still queued
+                # fails the same way and is retried next run
+                stats['processed'] += 1
+                stats['failed'] += 1
+                print(f"[extract] doc {futures[future]}: worker pool broken: {e}", flush=True)
+                continue
+            stats['processed'] += 1
+            content_hash = result['content_hash']
+
+            if content_hash is None:
+                # Unreadable file: nothing to key the result on, retry next run
+                stats['failed'] += 1
+                print(f"[extract] doc {result['document_id']}: {result['error']}", flush=True)
+                continue
+
+            link_rows.append((result['document_id'], content_hash))
+
+            if result['skipped'] or content_hash in seen_this_run:
+                stats['skipped'] += 1
+            else:
+                seen_this_run.add(content_hash)
+                text = result['text']
+                if result['error']:
+                    stats['failed'] += 1
+                    print(f"[extract] doc {result['document_id']}: {result['error']}", flush=True)
+                else:
+                    stats['extracted'] += 1
+                text_rows.append((content_hash, text, len(text) if text else 0,
+                                  result['page_count'], result['extractor'], result['error']))
+
+            if len(link_rows) >= batch_size:
+                if not dry_run:
+                    _flush(conn, text_rows, link_rows)
+                text_rows, link_rows = [], []
+
+            if stats['processed'] % 500 == 0:
+                rate = stats['processed'] / (time.time() - start)
+                print(f"[extract] {stats['processed']}/{len(pending)} ({rate:.1f} files/s)", flush=True)
+
+    if not dry_run:
+        _flush(conn, text_rows, link_rows)
+
+    elapsed = time.time() - start
+    print(f"[extract] {'(dry-run) ' if dry_run else ''}Done in {elapsed:.1f}s. "
+          f"Extracted: {stats['extracted']}, Skipped (known hash): {stats['skipped']}, "
+          f"Failed: {stats['failed']}", flush=True)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract text from downloaded planning documents")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="Per-file timeout in seconds")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows per DB write")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N pending documents")
+    parser.add_argument("--dry-run", action="store_true", help="Extract but do not write to DB")
+    args = parser.parse_args()
+
+    from main import get_db_connection, setup_database
+
+    setup_database()
+    conn = get_db_connection()
+    try:
+        extract_documents(conn, workers=args.workers, timeout=args.timeout,
+                          batch_size=args.batch_size, limit=args.limit, dry_run=args.dry_run)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Instrumented HTTP requests to the council APIs and portals.
+
+get() is requests.get that also records, under the URL's host and an
+endpoint template naming the API method rather than the URL
+("/application/{id}/document", not "/application/1234/document"):
+
+  http_request_seconds   latency histogram (to the response headers; for a
+                         streamed download, not including the body)
+  http_requests          count by status code, or by exception name for a
+                         request that got no response
+  http_response_bytes    body bytes (Content-Length for streamed responses)
+
+host_latency() reads a host's latency quantiles back during the run; they
+are for observation only and do not pace any requests. summary() and
+print_summary() report every host and endpoint at the end of the run.
+"""
+
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from metrics import count, histogram, observe, snapshot
+
+REQUEST_SECONDS = "http_request_seconds"
+
+
+def get(url, endpoint, **kwargs):
+    """requests.get(url, **kwargs), recorded under url's host and endpoint."""
+    labels = {"host": urlparse(url).netloc, "endpoint": endpoint}
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        observe(REQUEST_SECONDS, time.perf_counter() - start, **labels)
+        count("http_requests", status=type(e).__name__, **labels)
+        raise
+    observe(REQUEST_SECONDS, time.perf_counter() - start, **labels)
+    count("http_requests", status=response.status_code, **labels)
+    if kwargs.get("stream"):
+        size = int(response.headers.get("Content-Length") or 0)
+    else:
+        size = len(response.content)
+    count("http_response_bytes", size, **labels)
+    return response
+
+
+def host_latency(host, endpoint=None):
+    """Latency summary (count, mean, p50, p90, p99 seconds) of the requests
+    made so far to host, or to one endpoint of it; None before the first."""
+    if endpoint is None:
+        return histogram(REQUEST_SECONDS, host=host)
+    return histogram(REQUEST_SECONDS, host=host, endpoint=endpoint)
+
+
+def summary():
+    """Per (host, endpoint): requests, failures (a status of 400 or
+    above, or no response), bytes and latency quantiles."""
+    data = snapshot()
+    rows = {}
+    for entry in data["histograms"]:
+        if entry["name"] == REQUEST_SECONDS:
+            labels = entry["labels"]
+            rows[labels["host"], labels["endpoint"]] = {
+                "host": labels["host"], "endpoint": labels["endpoint"],
+                "requests": entry["count"], "failures": 0, "bytes": 0,
+                "statuses": {}, "p50": entry["p50"], "p99": entry["p99"], "mean": entry["mean"],
+            }
+    for entry in data["counters"]:
+        labels = entry["labels"]
+        row = rows.get((labels.get("host"), labels.get("endpoint")))
+        if row is None:
+            continue
+        if entry["name"] == "http_requests":
+            status = labels["status"]
+            row["statuses"][status] = entry["value"]
+            if not status.isdigit() or int(status) >= 400:
+                row["failures"] += entry["value"]
+        elif entry["name"] == "http_response_bytes":
+            row["bytes"] = entry["value"]
+    return [rows[key] for key in sorted(rows)]
+
+
+def print_summary():
+    rows = summary()
+    if not rows:
+        return
+    print("\nHTTP requests:", flush=True)
+    print(f"  {'Host / endpoint':<62} {'Reqs':>6} {'Fail':>5} {'p50 s':>7} {'p99 s':>7} {'MB':>8}",
+          flush=True)
+    for row in rows:
+        name = f"{row['host']}{row['endpoint']}"
+        print(f"  {name[:62]:<62} {row['requests']:>6} {row['failures']:>5} "
+              f"{row['p50']:>7.3f} {row['p99']:>7.3f} {row['bytes'] / 1e6:>8.2f}", flush=True)
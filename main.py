@@ -3,12 +3,20 @@ import json
 import time
 import os
 import re
+import math
+import hashlib
+import weakref
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import dotenv
 from datetime import datetime, timedelta
 import concurrent.futures
 from pyproj import Transformer
+from shared_utils import (ALIAS_DOMAIN_SQL, ALIAS_EMAIL_SQL, PROJECTED_FIELDS, PROJECTED_NUMERIC_COLUMNS,
+                          backfill_decision_categories, classify_decision, clean_note, update_agent_aliases)
+import http_client
+import sql_profile
+from metrics import count, record_span, span, timed, write_metrics
 
 _itm_transformer = Transformer.from_crs("EPSG:2157", "EPSG:4326", always_xy=False)
 
@@ -23,10 +31,18 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set. Please create a .env file.")
 
+# Full-text search document: proposal text ranks above the address
+SEARCH_TSV_EXPR = (
+    "setweight(to_tsvector('english', coalesce(description, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(location, '')), 'B')"
+)
+# Columns filtered by substring in search_applications
+TRIGRAM_COLUMNS = ("description", "location", "decision", "status")
+
 # --- Database Setup & Management ---
 
 def get_db_connection():
-    return psycopg2.connect(DATABASE_URL)
+    return sql_profile.connect(DATABASE_URL)
 
 def setup_database():
     """Initializes the database schema."""
@@ -38,6 +54,7 @@ def setup_database():
     _create_schema(c)
     
     conn.commit()
+    backfill_decision_categories(conn)
     conn.close()
 
 def _create_schema(c):
@@ -59,15 +76,30 @@ def _create_schema(c):
     
     try:
         c.execute("ALTER TABLE applications ADD COLUMN IF NOT EXISTS last_hydrated_at TIMESTAMP")
+        c.execute("ALTER TABLE applications ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT LOCALTIMESTAMP")
+        # classify_decision(decision), computed at ingest; NULL when the decision is
+        # empty or not classified yet (see shared_utils.backfill_decision_categories)
+        c.execute("ALTER TABLE applications ADD COLUMN IF NOT EXISTS decision_category TEXT")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_invalid ON applications (id, lpa) "
+                  "WHERE decision_category = 'invalid'")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_decision_category "
+                  "ON applications (decision_category, decision)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_decision_category_pending ON applications (id) "
+                  "WHERE decision_category IS NULL AND decision <> ''")
+
+        # Type migrations only run on old tables: raw_json cannot be altered
+        # once the generated columns below depend on it
+        c.execute("""SELECT column_name, data_type FROM information_schema.columns
+                     WHERE table_schema = current_schema() AND table_name = 'applications'""")
+        column_types = dict(c.fetchall())
 
         # Migration: text -> date
-        c.execute("ALTER TABLE applications ALTER COLUMN registration_date TYPE DATE USING registration_date::date")
+        if column_types.get('registration_date') != 'date':
+            c.execute("ALTER TABLE applications ALTER COLUMN registration_date TYPE DATE USING registration_date::date")
 
         # Migration: text -> jsonb
-        c.execute("ALTER TABLE applications ALTER COLUMN raw_json TYPE JSONB USING raw_json::jsonb")
-
-        # Migration: add download_url to documents
-        c.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS download_url TEXT")
+        if column_types.get('raw_json') != 'jsonb':
+            c.execute("ALTER TABLE applications ALTER COLUMN raw_json TYPE JSONB USING raw_json::jsonb")
 
     except psycopg2.Error as e:
          print(f"Migration notice: {e}")
@@ -89,6 +121,13 @@ def _create_schema(c):
                   received_date TEXT,
                   media_id INTEGER,
                   FOREIGN KEY(app_id, lpa) REFERENCES applications(id, lpa))''')
+
+    # Migration: add download_url to documents (must run after the table exists)
+    c.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS download_url TEXT")
+
+    # Migration: link documents to their extracted text by file content hash
+    c.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)")
     
     # 3. Conditions Table (Composite FK)
     c.execute('''CREATE TABLE IF NOT EXISTS conditions
@@ -106,6 +145,113 @@ def _create_schema(c):
                   raw_json TEXT,
                   FOREIGN KEY(app_id, lpa) REFERENCES applications(id, lpa))''')
 
+    # clean_note(long_desc), computed at ingest: '' when no note parses, NULL
+    # when not computed yet (see analyze_invalid.backfill_clean_notes)
+    c.execute("ALTER TABLE conditions ADD COLUMN IF NOT EXISTS clean_note TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conditions_clean_note_pending ON conditions (id) WHERE clean_note IS NULL")
+
+    # 4. Document Text Table (one row per distinct file content, see extract_text.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS document_text
+                 (content_hash TEXT PRIMARY KEY,
+                  text TEXT,
+                  char_count INTEGER,
+                  page_count INTEGER,
+                  extractor TEXT,
+                  error TEXT,
+                  extracted_at TIMESTAMP)''')
+
+    # 5. Sync Runs Table (completion markers for cache invalidation)
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_runs
+                 (id SERIAL PRIMARY KEY,
+                  started_at TIMESTAMP,
+                  finished_at TIMESTAMP)''')
+
+    # 6. Analysis aggregates (see analysis_aggregates.py)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_applications_updated_at ON applications (updated_at)")
+    c.execute('''CREATE TABLE IF NOT EXISTS analysis_facts
+                 (id INTEGER,
+                  lpa TEXT,
+                  month TEXT,
+                  agent TEXT,
+                  agent_email TEXT,
+                  applicant TEXT,
+                  is_invalid BOOLEAN,
+                  email TEXT,
+                  phone TEXT,
+                  follow_up_id INTEGER,
+                  follow_up_lpa TEXT,
+                  follow_up_days INTEGER,
+                  agent_changed BOOLEAN,
+                  lpa_follow_up_id INTEGER,
+                  lpa_follow_up_lpa TEXT,
+                  lpa_follow_up_days INTEGER,
+                  lpa_agent_changed BOOLEAN,
+                  PRIMARY KEY (id, lpa))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_facts_applicant ON analysis_facts (applicant) WHERE is_invalid")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_facts_agent_email ON analysis_facts (agent_email)")
+    c.execute('''CREATE TABLE IF NOT EXISTS agg_agent_month
+                 (agent TEXT,
+                  lpa TEXT,
+                  month TEXT,
+                  total INTEGER,
+                  invalid INTEGER,
+                  fired INTEGER,
+                  retained INTEGER,
+                  PRIMARY KEY (agent, lpa, month))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS agg_agent_contact
+                 (agent TEXT,
+                  kind TEXT,
+                  value TEXT,
+                  n INTEGER,
+                  PRIMARY KEY (agent, kind, value))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS agg_lpa_month
+                 (lpa TEXT,
+                  month TEXT,
+                  total INTEGER,
+                  invalid INTEGER,
+                  followed_up INTEGER,
+                  follow_up_days INTEGER,
+                  agent_changed INTEGER,
+                  lpa_followed_up INTEGER,
+                  lpa_follow_up_days INTEGER,
+                  lpa_agent_changed INTEGER,
+                  PRIMARY KEY (lpa, month))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS analysis_agent_map
+                 (email TEXT PRIMARY KEY,
+                  agent TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS analysis_name_map
+                 (name TEXT PRIMARY KEY,
+                  agent TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS analysis_watermark
+                 (name TEXT PRIMARY KEY,
+                  folded_until TIMESTAMP,
+                  updated_at TIMESTAMP)''')
+
+    # 7. Persisted agent dedup map (see shared_utils.update_agent_aliases);
+    # a NULL agent marks an email that no longer has any usable agent name
+    c.execute('''CREATE TABLE IF NOT EXISTS agent_aliases
+                 (email TEXT PRIMARY KEY,
+                  domain TEXT,
+                  agent TEXT,
+                  updated_at TIMESTAMP)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_agent_aliases_domain ON agent_aliases (domain)")
+
+    # 8. Near-duplicate clusters of invalidation notes (see analyze_invalid.update_note_clusters),
+    # keyed on md5 as notes can outgrow a btree entry
+    c.execute('''CREATE TABLE IF NOT EXISTS note_clusters
+                 (note TEXT NOT NULL,
+                  cluster TEXT NOT NULL,
+                  signature BYTEA)''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_note_clusters_note ON note_clusters (md5(note))")
+    c.execute("ALTER TABLE note_clusters ADD COLUMN IF NOT EXISTS signature_kind TEXT")
+
+    # Keyset pagination order for search_applications (scanned backwards for DESC)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_applications_keyset ON applications (registration_date, id, lpa)")
+
+    # Commit the core tables before the optional extensions below, whose
+    # failure handling rolls back the transaction
+    c.connection.commit()
+
     # Add PostGIS extension and geometry column
     try:
         c.execute("CREATE EXTENSION IF NOT EXISTS postgis")
@@ -125,8 +271,59 @@ def _create_schema(c):
     except psycopg2.Error:
         c.connection.rollback()
 
+    # Full-text search over description and location (see search_applications)
+    try:
+        c.execute(f"""ALTER TABLE applications ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                      GENERATED ALWAYS AS ({SEARCH_TSV_EXPR}) STORED""")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_search_tsv ON applications USING GIN (search_tsv)")
+        c.connection.commit()
+    except psycopg2.Error:
+        c.connection.rollback()
+
+    # Stored generated columns for the raw_json keys the analyses read, so
+    # they can select narrow columns instead of decoding whole documents
+    try:
+        for column, key in PROJECTED_FIELDS:
+            if column in PROJECTED_NUMERIC_COLUMNS:
+                expr = (f"CASE WHEN jsonb_typeof(raw_json->'{key}') = 'number' "
+                        f"THEN (raw_json->>'{key}')::double precision END")
+                col_type = "DOUBLE PRECISION"
+            else:
+                expr = f"raw_json->>'{key}'"
+                col_type = "TEXT"
+            c.execute(f"ALTER TABLE applications ADD COLUMN IF NOT EXISTS {column} {col_type} "
+                      f"GENERATED ALWAYS AS ({expr}) STORED")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_application_type ON applications (application_type)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_applications_agent_email ON applications (lower(agent_email))")
+        # The exact expressions update_agent_aliases selects a domain's applications by
+        # (the _ws indexes replace ones over btrim's default, spaces-only, strip)
+        c.execute("DROP INDEX IF EXISTS idx_applications_alias_email")
+        c.execute("DROP INDEX IF EXISTS idx_applications_alias_domain")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_applications_alias_email_ws ON applications ({ALIAS_EMAIL_SQL})")
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_applications_alias_domain_ws ON applications ({ALIAS_DOMAIN_SQL})")
+        c.connection.commit()
+    except psycopg2.Error as e:
+        print(f"Migration notice: {e}")
+        c.connection.rollback()
+
+    # Trigram indexes so substring filters (ILIKE '%x%') avoid sequential scans
+    try:
+        c.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        c.connection.commit()
+    except psycopg2.Error:
+        c.connection.rollback()
+
+    try:
+        for column in TRIGRAM_COLUMNS:
+            c.execute(f"CREATE INDEX IF NOT EXISTS idx_applications_{column}_trgm "
+                      f"ON applications USING GIN ({column} gin_trgm_ops)")
+        c.connection.commit()
+    except psycopg2.Error:
+        c.connection.rollback()
+
 # --- Data Access Object (DAO) Layer ---
 
+@timed("db.write", table="applications", label_args=("lpa",))
 def save_application(app_data, lpa="dunlaoghaire"):
     """Upserts an application record."""
     conn = get_db_connection()
@@ -163,20 +360,22 @@ def save_application(app_data, lpa="dunlaoghaire"):
     
     c.execute('''INSERT INTO applications 
                  (id, reference, registration_date, description, raw_json, 
-                  location, decision, status, grid_x, grid_y, lpa)
-                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                  location, decision, decision_category, status, grid_x, grid_y, lpa, updated_at)
+                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, LOCALTIMESTAMP)
                  ON CONFLICT (id, lpa) DO UPDATE SET
+                    updated_at = LOCALTIMESTAMP,
                     reference = EXCLUDED.reference,
                     registration_date = EXCLUDED.registration_date,
                     description = EXCLUDED.description,
                     raw_json = EXCLUDED.raw_json,
                     location = EXCLUDED.location,
                     decision = EXCLUDED.decision,
+                    decision_category = EXCLUDED.decision_category,
                     status = EXCLUDED.status,
                     grid_x = EXCLUDED.grid_x,
                     grid_y = EXCLUDED.grid_y''', 
               (app_id, reference, reg_date, description, json.dumps(app_data),
-               location, decision, status, grid_x, grid_y, lpa))
+               location, decision, classify_decision(decision), status, grid_x, grid_y, lpa))
 
     # Populate geom from grid coordinates if available
     if grid_x and grid_y:
@@ -195,6 +394,7 @@ def save_application(app_data, lpa="dunlaoghaire"):
     conn.commit()
     conn.close()
 
+@timed("db.write", table="documents", label_args=("lpa",))
 def save_document_metadata(app_id, doc_data, lpa="dunlaoghaire", download_url=None):
     """Saves or updates document metadata."""
     conn = get_db_connection()
@@ -240,6 +440,7 @@ def save_document_metadata(app_id, doc_data, lpa="dunlaoghaire", download_url=No
     conn.commit()
     conn.close()
 
+@timed("db.write", table="conditions", label_args=("lpa",))
 def save_condition_record(app_id, cond_data, lpa="dunlaoghaire"):
     """Saves or updates a condition record."""
     conn = get_db_connection()
@@ -262,26 +463,29 @@ def save_condition_record(app_id, cond_data, lpa="dunlaoghaire"):
         cond_data.get('compliedId'),
         cond_data.get('compliedStatusDescription'),
         cond_data.get('compliedDate'),
-        raw_json
+        raw_json,
+        clean_note(cond_data.get('longPrescription')) or ''
     )
     
     if not existing_id:
          c.execute('''INSERT INTO conditions (
                         short_desc, long_desc, code, code_desc, 
-                        complied_id, complied_desc, complied_date, raw_json,
+                        complied_id, complied_desc, complied_date, raw_json, clean_note,
                         app_id, lpa, order_num)
-                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                       (*fields, app_id, lpa, order_num))
     else:
          c.execute('''UPDATE conditions SET
                         short_desc = %s, long_desc = %s, code = %s, code_desc = %s,
-                        complied_id = %s, complied_desc = %s, complied_date = %s, raw_json = %s
+                        complied_id = %s, complied_desc = %s, complied_date = %s, raw_json = %s,
+                        clean_note = %s
                       WHERE id = %s''',
                       (*fields, existing_id))
     
     conn.commit()
     conn.close()
 
+@timed("db.write", table="documents", label_args=("lpa",))
 def save_document_record(app_id, filename, local_path, lpa="dunlaoghaire"):
     """Updates the local_path for a downloaded document."""
     conn = get_db_connection()
@@ -307,7 +511,7 @@ def get_lpa_code(lpa_name):
     """
     url = f"https://identity.agileapplications.ie/api/client/get?url={lpa_name}"
     try:
-        response = requests.get(url)
+        response = http_client.get(url, "/api/client/get")
         response.raise_for_status()
         data = response.json()
         return data.get('code')
@@ -358,9 +562,11 @@ def fetch_planning_applications(limit=None, date_from='2025-01-09', date_to='202
 
     try:
         print(f"Fetching data for {lpa} (Code: {lpa_code})...", flush=True)
-        response = requests.get(url, headers=headers, params=params, timeout=120)
-        response.raise_for_status()
-        
+        with span("sync.fetch", lpa=lpa) as fetched:
+            response = http_client.get(url, "/application/search", headers=headers, params=params, timeout=120)
+            response.raise_for_status()
+            fetched.add(nbytes=len(response.content))
+
         data = response.json()
         results = []
         if isinstance(data, list):
@@ -383,8 +589,10 @@ def fetch_planning_applications(limit=None, date_from='2025-01-09', date_to='202
                 print(f"Limiting to first {limit} applications.", flush=True)
                 results = results[:limit]
             
-            for app in results:
-                save_application(app, lpa=lpa)
+            with span("sync.save_applications", lpa=lpa) as saved:
+                for app in results:
+                    save_application(app, lpa=lpa)
+                saved.add(items=len(results))
             print(f"Saved {len(results)} applications to database.", flush=True)
             return results
         else:
@@ -392,9 +600,37 @@ def fetch_planning_applications(limit=None, date_from='2025-01-09', date_to='202
             return []
 
     except requests.exceptions.RequestException as e:
+        count("errors", stage="fetch", lpa=lpa)
         print(f"Error fetching data: {e}", flush=True)
         return []
 
+def parse_dublin_city_documents(html):
+    """
+    Parses a Dublin City portal search result page.
+    Returns list of (doc_dict, download_url) tuples compatible with save_document_metadata().
+    """
+    # Extract "var model = {...}" JSON from script tag
+    match = re.search(r'var model\s*=\s*(\{.*?\});', html, re.DOTALL)
+    if not match:
+        return []
+
+    model = json.loads(match.group(1))
+
+    # Map to our document format
+    docs = []
+    for row in model.get("Rows", []):
+        guid = row.get("Guid")
+        doc = {
+            "documentHash": guid,
+            "description": row.get("Doc_Type"),
+            "name": (row.get("Doc_Ref") or "").strip(),
+            "receivedDate": row.get("Date_Received"),
+        }
+        # Build download URL for Dublin City
+        download_url = f"https://webapps.dublincity.ie/PublicAccess_Live/Document/ViewDocument?id={guid}" if guid else None
+        docs.append((doc, download_url))
+    return docs
+
 def fetch_dublin_city_documents(app_reference):
     """
     Fetches document metadata from Dublin City's web portal.
@@ -404,35 +640,58 @@ def fetch_dublin_city_documents(app_reference):
     params = {"FileSystemId": "PL", "Folder1_Ref": app_reference}
 
     try:
-        response = requests.get(url, params=params, timeout=30)
+        response = http_client.get(url, "/PublicAccess_Live/SearchResult/RunThirdPartySearch",
+                                   params=params, timeout=30)
         if response.status_code != 200:
             return []
-
-        # Extract "var model = {...}" JSON from script tag
-        match = re.search(r'var model\s*=\s*(\{.*?\});', response.text, re.DOTALL)
-        if not match:
-            return []
-
-        model = json.loads(match.group(1))
-
-        # Map to our document format
-        docs = []
-        for row in model.get("Rows", []):
-            guid = row.get("Guid")
-            doc = {
-                "documentHash": guid,
-                "description": row.get("Doc_Type"),
-                "name": (row.get("Doc_Ref") or "").strip(),
-                "receivedDate": row.get("Date_Received"),
-            }
-            # Build download URL for Dublin City
-            download_url = f"https://webapps.dublincity.ie/PublicAccess_Live/Document/ViewDocument?id={guid}" if guid else None
-            docs.append((doc, download_url))
-        return docs
+        return parse_dublin_city_documents(response.text)
     except Exception as e:
+        count("errors", stage="portal_documents", lpa="dublincity")
         print(f"Error fetching Dublin City documents for {app_reference}: {e}", flush=True)
         return []
 
+# Parse HTML table rows: <tr> containing date, link, and file type
+# Pattern matches: <a href="/Home/ViewDocument?fileId=XXXXXX" ...>Description</a>
+_SOUTH_DUBLIN_DOCUMENT_RE = re.compile(
+    r'<tr>\s*'
+    r'<td[^>]*headers="DateReceived"[^>]*>\s*([^<]*?)\s*</td>\s*'
+    r'<td[^>]*headers="FileName"[^>]*>\s*'
+    r'<a\s+href="/Home/ViewDocument\?fileId=(\d+)"[^>]*>([^<]+)</a>'
+    r'.*?</tr>',
+    re.DOTALL | re.IGNORECASE
+)
+
+def parse_south_dublin_documents(html):
+    """
+    Parses a South Dublin portal documents page.
+    Returns list of (doc_dict, download_url) tuples compatible with save_document_metadata().
+    """
+    docs = []
+    for match in _SOUTH_DUBLIN_DOCUMENT_RE.finditer(html):
+        received_date = match.group(1).strip()
+        file_id = match.group(2)
+        description = match.group(3).strip()
+
+        # Convert date from DD/MM/YYYY to ISO format
+        if received_date:
+            try:
+                dt = datetime.strptime(received_date, "%d/%m/%Y")
+                received_date = dt.strftime("%Y-%m-%dT00:00:00")
+            except ValueError:
+                pass
+
+        doc = {
+            "documentHash": file_id,  # Use fileId as unique identifier
+            "documentId": file_id,
+            "description": description,
+            "name": description,
+            "receivedDate": received_date,
+        }
+        download_url = f"https://planning.southdublin.ie/Home/ViewDocument?fileId={file_id}"
+        docs.append((doc, download_url))
+
+    return docs
+
 def fetch_south_dublin_documents(app_reference):
     """
     Fetches document metadata from South Dublin's web portal.
@@ -443,51 +702,16 @@ def fetch_south_dublin_documents(app_reference):
     url = f"https://planning.southdublin.ie/Home/Documents?regref={app_reference}"
 
     try:
-        response = requests.get(url, timeout=30)
+        response = http_client.get(url, "/Home/Documents", timeout=30)
         if response.status_code != 200:
             return []
-
-        # Parse HTML table rows: <tr> containing date, link, and file type
-        # Pattern matches: <a href="/Home/ViewDocument?fileId=XXXXXX" ...>Description</a>
-        doc_pattern = re.compile(
-            r'<tr>\s*'
-            r'<td[^>]*headers="DateReceived"[^>]*>\s*([^<]*?)\s*</td>\s*'
-            r'<td[^>]*headers="FileName"[^>]*>\s*'
-            r'<a\s+href="/Home/ViewDocument\?fileId=(\d+)"[^>]*>([^<]+)</a>'
-            r'.*?</tr>',
-            re.DOTALL | re.IGNORECASE
-        )
-
-        docs = []
-        for match in doc_pattern.finditer(response.text):
-            received_date = match.group(1).strip()
-            file_id = match.group(2)
-            description = match.group(3).strip()
-
-            # Convert date from DD/MM/YYYY to ISO format
-            if received_date:
-                try:
-                    from datetime import datetime
-                    dt = datetime.strptime(received_date, "%d/%m/%Y")
-                    received_date = dt.strftime("%Y-%m-%dT00:00:00")
-                except ValueError:
-                    pass
-
-            doc = {
-                "documentHash": file_id,  # Use fileId as unique identifier
-                "documentId": file_id,
-                "description": description,
-                "name": description,
-                "receivedDate": received_date,
-            }
-            download_url = f"https://planning.southdublin.ie/Home/ViewDocument?fileId={file_id}"
-            docs.append((doc, download_url))
-
-        return docs
+        return parse_south_dublin_documents(response.text)
     except Exception as e:
+        count("errors", stage="portal_documents", lpa="southdublin")
         print(f"Error fetching South Dublin documents for {app_reference}: {e}", flush=True)
         return []
 
+@timed("sync.hydrate_application", label_args=("lpa",))
 def hydrate_application(app_id, lpa="dunlaoghaire"):
     """Fetches and saves full details, documents, and conditions for a single app."""
     # print(f"Hydrating App {app_id}...", flush=True)
@@ -501,7 +725,7 @@ def hydrate_application(app_id, lpa="dunlaoghaire"):
     
     try:
         # 1. Details
-        r = requests.get(f"{API_BASE_URL}/application/{app_id}", headers=headers)
+        r = http_client.get(f"{API_BASE_URL}/application/{app_id}", "/application/{id}", headers=headers)
         if r.status_code == 200:
             save_application(r.json(), lpa=lpa)
         
@@ -532,7 +756,8 @@ def hydrate_application(app_id, lpa="dunlaoghaire"):
                     save_document_metadata(app_id, doc, lpa=lpa, download_url=download_url)
         else:
             # Standard API for other LPAs (dunlaoghaire, fingal)
-            r = requests.get(f"{API_BASE_URL}/application/{app_id}/document", headers=headers)
+            r = http_client.get(f"{API_BASE_URL}/application/{app_id}/document", "/application/{id}/document",
+                                headers=headers)
             if r.status_code == 200:
                 docs = r.json()
                 for doc in docs:
@@ -541,10 +766,12 @@ def hydrate_application(app_id, lpa="dunlaoghaire"):
                     download_url = f"{API_BASE_URL}/application/document/{lpa_code}/{doc_hash}" if doc_hash else None
                     save_document_metadata(app_id, doc, lpa=lpa, download_url=download_url)
             else:
+                count("errors", stage="documents", lpa=lpa)
                 print(f"[DOC FETCH ERROR] App {app_id} ({lpa}): status {r.status_code}", flush=True)
 
         # 3. Conditions
-        r = requests.get(f"{API_BASE_URL}/application/{app_id}/conditions", headers=headers)
+        r = http_client.get(f"{API_BASE_URL}/application/{app_id}/conditions", "/application/{id}/conditions",
+                            headers=headers)
         if r.status_code == 200:
             conds = r.json().get('applicationPrescriptions', [])
             if conds:
@@ -560,6 +787,7 @@ def hydrate_application(app_id, lpa="dunlaoghaire"):
         conn.close()
 
     except Exception as e:
+        count("errors", stage="hydrate", lpa=lpa)
         print(f"Error hydrating app {app_id}: {e}", flush=True)
 
 def download_document(doc_hash, save_dir, filename):
@@ -573,7 +801,7 @@ def download_document(doc_hash, save_dir, filename):
             
         filepath = os.path.join(save_dir, filename)
         
-        with requests.get(url, headers=headers, stream=True) as r:
+        with http_client.get(url, "/application/document/{lpa}/{hash}", headers=headers, stream=True) as r:
             r.raise_for_status()
             with open(filepath, 'wb') as f:
                 for chunk in r.iter_content(chunk_size=8192):
@@ -586,14 +814,47 @@ def download_document(doc_hash, save_dir, filename):
 
 # --- Application Logic & Orchestration ---
 
-def search_applications(date_from=None, date_to=None, decision=None, status=None, location_keyword=None, 
-                        min_grid_x=None, max_grid_x=None, min_grid_y=None, max_grid_y=None):
-    """Queries the database for applications matching criteria."""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    query = "SELECT id, reference, registration_date, decision, status, location, description, grid_x, grid_y, lpa FROM applications WHERE 1=1"
+def _like_pattern(value):
+    """Wraps a user-supplied keyword for a substring ILIKE, escaping wildcards."""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+# Row layout returned by search_applications and the lookups below
+SEARCH_COLUMNS = ("id", "reference", "registration_date", "decision", "status",
+                  "location", "description", "grid_x", "grid_y", "lpa")
+
+# Metres per degree of latitude, used to size the index prefilter box
+_METRES_PER_DEGREE = 111_320
+
+def _radius_to_degrees(radius_m, lat):
+    """Converts a radius in metres to a bounding margin in degrees at a latitude.
+    Uses the longitude scale, which is the larger of the two away from the equator."""
+    return radius_m / (_METRES_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01))
+
+def build_search_query(date_from=None, date_to=None, decision=None, status=None, location_keyword=None,
+                       min_grid_x=None, max_grid_x=None, min_grid_y=None, max_grid_y=None,
+                       text_query=None, near=None, radius_m=None, bbox=None, after=None, limit=20):
+    """
+    Builds the SQL and parameters for search_applications.
+    Substring filters are case-insensitive and served by the pg_trgm indexes;
+    text_query is matched against the search_tsv GIN index and ranked.
+    near/bbox filters prefilter with && against idx_applications_geom.
+    """
+    columns = ", ".join(SEARCH_COLUMNS)
     params = []
+
+    if text_query and after:
+        raise ValueError("Keyset pagination is not supported for relevance-ranked text queries")
+    if near and radius_m is None:
+        raise ValueError("near requires radius_m")
+
+    if text_query:
+        query = (f"SELECT {columns}, ts_rank_cd(search_tsv, q) AS rank "
+                 "FROM applications, websearch_to_tsquery('english', %s) AS q "
+                 "WHERE search_tsv @@ q")
+        params.append(text_query)
+    else:
+        query = f"SELECT {columns} FROM applications WHERE 1=1"
     
     if date_from:
         query += " AND registration_date >= %s"
@@ -602,14 +863,14 @@ def search_applications(date_from=None, date_to=None, decision=None, status=None
         query += " AND registration_date <= %s"
         params.append(date_to)
     if decision:
-        query += " AND decision LIKE %s"
-        params.append(f"%{decision}%")
+        query += " AND decision ILIKE %s"
+        params.append(_like_pattern(decision))
     if status:
-        query += " AND status LIKE %s"
-        params.append(f"%{status}%")
+        query += " AND status ILIKE %s"
+        params.append(_like_pattern(status))
     if location_keyword:
-        query += " AND location LIKE %s"
-        params.append(f"%{location_keyword}%")
+        query += " AND location ILIKE %s"
+        params.append(_like_pattern(location_keyword))
     
     if min_grid_x is not None:
         query += " AND grid_x >= %s"
@@ -623,14 +884,161 @@ def search_applications(date_from=None, date_to=None, decision=None, status=None
     if max_grid_y is not None:
         query += " AND grid_y <= %s"
         params.append(max_grid_y)
+
+    # Geospatial filters (WGS84). The && box test is what hits the GIST index;
+    # ST_DWithin on geography then applies the exact distance in metres.
+    if near:
+        lat, lon = near
+        query += (" AND geom && ST_Expand(ST_SetSRID(ST_MakePoint(%s, %s), 4326), %s)"
+                  " AND ST_DWithin(geom::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s)")
+        params.extend([lon, lat, _radius_to_degrees(radius_m, lat), lon, lat, radius_m])
+    if bbox:
+        west, south, east, north = bbox
+        query += " AND geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)"
+        params.extend([west, south, east, north])
+
+    # Keyset pagination on (registration_date, id, lpa), newest first.
+    # Undated rows sort first under DESC, so a cursor still inside them
+    # continues through the undated rows before moving on to dated ones.
+    if after:
+        after_date, after_id, after_lpa = after
+        if after_date is None:
+            query += " AND ((registration_date IS NULL AND (id, lpa) < (%s, %s)) OR registration_date IS NOT NULL)"
+            params.extend([after_id, after_lpa])
+        else:
+            query += " AND (registration_date, id, lpa) < (%s, %s, %s)"
+            params.extend([after_date, after_id, after_lpa])
         
-    query += " ORDER BY registration_date DESC LIMIT 20"
-    
+    if text_query:
+        query += " ORDER BY rank DESC, registration_date DESC"
+    else:
+        query += " ORDER BY registration_date DESC, id DESC, lpa DESC"
+    query += " LIMIT %s"
+    params.append(limit)
+    return query, params
+
+def next_page_cursor(results):
+    """Returns the keyset cursor (registration_date, id, lpa) after the last row
+    of a search_applications page, or None if the page is empty."""
+    if not results:
+        return None
+    last = results[-1]
+    return (last[2], last[0], last[9])
+
+# Prepared statement names per connection; entries go with their connection
+_prepared_statements = weakref.WeakKeyDictionary()
+
+def _to_positional(query):
+    """Rewrites psycopg2 %s placeholders as $1..$n for a server-side PREPARE."""
+    counter = iter(range(1, query.count('%s') + 1))
+    return re.sub(r'%s', lambda _: f"${next(counter)}", query).replace('%%', '%')
+
+def execute_prepared(c, query, params):
+    """Executes a query as a named prepared statement, preparing each distinct
+    query shape once per connection so repeated searches skip planning."""
+    prepared = _prepared_statements.setdefault(c.connection, set())
+    name = "q_" + hashlib.md5(query.encode()).hexdigest()[:16]
+
+    if name not in prepared:
+        c.execute(f"PREPARE {name} AS {_to_positional(query)}")
+        prepared.add(name)
+
+    if params:
+        c.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        c.execute(f"EXECUTE {name}")
+
+def search_applications(date_from=None, date_to=None, decision=None, status=None, location_keyword=None, 
+                        min_grid_x=None, max_grid_x=None, min_grid_y=None, max_grid_y=None,
+                        text_query=None, near=None, radius_m=None, bbox=None, after=None,
+                        limit=20, conn=None):
+    """Queries the database for applications matching criteria.
+
+    text_query is a free-text search over description and location
+    (web-search syntax: quoted phrases, OR, -exclude); results are then
+    ordered by relevance.
+    near=(lat, lon) with radius_m, or bbox=(west, south, east, north),
+    filter by WGS84 position.
+    after is a cursor from next_page_cursor() for fetching the next page.
+
+    Pass conn to reuse an open connection; repeated query shapes on that
+    connection then run as prepared statements."""
+    query, params = build_search_query(
+        date_from=date_from, date_to=date_to, decision=decision, status=status,
+        location_keyword=location_keyword, min_grid_x=min_grid_x, max_grid_x=max_grid_x,
+        min_grid_y=min_grid_y, max_grid_y=max_grid_y, text_query=text_query,
+        near=near, radius_m=radius_m, bbox=bbox, after=after, limit=limit)
+
     print(f"Executing Search: {query} with params {params}", flush=True)
-    c.execute(query, params)
-    results = c.fetchall()
-    conn.close()
-    return results
+    return _fetch_with_conn(conn, query, params)
+
+def _fetch_with_conn(conn, query, params):
+    """Runs a read query on conn, or on a short-lived connection if conn is None."""
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    c = conn.cursor()
+    if own_conn:
+        c.execute(query, params)
+    else:
+        execute_prepared(c, query, params)
+    rows = c.fetchall()
+    c.close()
+    if own_conn:
+        conn.close()
+    return rows
+
+def get_application_detail(app_id, lpa, conn=None):
+    """Returns an application with its documents and conditions, or None."""
+    columns = ", ".join(SEARCH_COLUMNS)
+    rows = _fetch_with_conn(conn, f"SELECT {columns} FROM applications WHERE id = %s AND lpa = %s", (app_id, lpa))
+    if not rows:
+        return None
+    app = dict(zip(SEARCH_COLUMNS, rows[0]))
+
+    docs = _fetch_with_conn(conn, """
+        SELECT filename, description, received_date, download_url
+        FROM documents WHERE app_id = %s AND lpa = %s ORDER BY received_date, id
+    """, (app_id, lpa))
+    app['documents'] = [dict(zip(("filename", "description", "received_date", "download_url"), d)) for d in docs]
+
+    conds = _fetch_with_conn(conn, """
+        SELECT order_num, short_desc, long_desc, code
+        FROM conditions WHERE app_id = %s AND lpa = %s ORDER BY order_num
+    """, (app_id, lpa))
+    app['conditions'] = [dict(zip(("order_num", "short_desc", "long_desc", "code"), c)) for c in conds]
+    return app
+
+def get_agent_history(agent, limit=100, conn=None):
+    """Returns an agent's applications, newest first.
+    agent is matched exactly against agentEmail if it contains '@',
+    otherwise as a substring of agentSurname/agentContactName."""
+    columns = ", ".join(SEARCH_COLUMNS)
+    if '@' in agent:
+        where = "lower(agent_email) = lower(%s)"
+        params = [agent.strip()]
+    else:
+        where = "(agent_surname ILIKE %s OR agent_contact_name ILIKE %s)"
+        params = [_like_pattern(agent), _like_pattern(agent)]
+    query = (f"SELECT {columns} FROM applications WHERE {where} "
+             "ORDER BY registration_date DESC, id DESC, lpa DESC LIMIT %s")
+    return _fetch_with_conn(conn, query, params + [limit])
+
+def get_recent_invalids(days=30, lpa=None, limit=100, conn=None):
+    """Returns applications declared invalid within the last `days` days, newest first."""
+    columns = ", ".join(SEARCH_COLUMNS)
+    query = (f"SELECT {columns} FROM applications "
+             "WHERE decision_category = 'invalid' AND registration_date >= CURRENT_DATE - %s::integer")
+    params = [days]
+    if lpa:
+        query += " AND lpa = %s"
+        params.append(lpa)
+    query += " ORDER BY registration_date DESC, id DESC, lpa DESC LIMIT %s"
+    params.append(limit)
+    return _fetch_with_conn(conn, query, params)
+
+# Fixed pause between hydrated applications, to stay polite to the API
+HYDRATE_DELAY = 0.5
 
 def hydrate_all_applications(limit=None, skip_hydrated=False, lpa_filter=None):
     """Batch processes applications to fetch full details."""
@@ -670,6 +1078,7 @@ def hydrate_all_applications(limit=None, skip_hydrated=False, lpa_filter=None):
     
     total = len(rows)
     print(f"Found {total} applications needing hydration.", flush=True)
+    count("applications_pending_hydration", total, lpa=lpa_filter)
 
     processed = 0
     for i, row in enumerate(rows):
@@ -683,7 +1092,8 @@ def hydrate_all_applications(limit=None, skip_hydrated=False, lpa_filter=None):
         # Already filtered in SQL
         print(f"[{i+1}/{total}] Hydrating {app_id} ({lpa})", end="\r", flush=True)
         hydrate_application(app_id, lpa=lpa)
-        time.sleep(0.5) 
+        count("applications_hydrated", lpa=lpa)
+        time.sleep(HYDRATE_DELAY)
         processed += 1
 
         processed += 1
@@ -703,6 +1113,20 @@ def get_latest_application_date(lpa):
         conn.close()
     return None
 
+def record_sync_run(started_at):
+    """Records a completed sync so readers (e.g. query_service) can invalidate caches."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("INSERT INTO sync_runs (started_at, finished_at) VALUES (%s, NOW())", (started_at,))
+    conn.commit()
+    conn.close()
+
+def get_last_sync_time(conn=None):
+    """Returns when the most recent sync finished, or None."""
+    rows = _fetch_with_conn(conn, "SELECT MAX(finished_at) FROM sync_runs", ())
+    return rows[0][0] if rows else None
+
+@timed("stage.sync_lpa", label_args=("lpa",))
 def run_sync_job(limit=100, date_from=None, date_to=None, lpa="dunlaoghaire"):
     """
     Main Workflow:
@@ -735,8 +1159,11 @@ def run_sync_job(limit=100, date_from=None, date_to=None, lpa="dunlaoghaire"):
     # Always skip existing to avoid re-fetching what we have
     skip_mode = True 
     
-    fetch_planning_applications(limit=limit, date_from=date_from, date_to=date_to, skip_existing=skip_mode, lpa=lpa)
-    hydrate_all_applications(limit=None, skip_hydrated=skip_mode, lpa_filter=lpa) 
+    with span("stage.fetch", lpa=lpa) as fetched:
+        fetched.add(items=len(fetch_planning_applications(limit=limit, date_from=date_from, date_to=date_to,
+                                                          skip_existing=skip_mode, lpa=lpa)))
+    with span("stage.hydrate", lpa=lpa):
+        hydrate_all_applications(limit=None, skip_hydrated=skip_mode, lpa_filter=lpa)
     print("--- Sync Job Complete ---", flush=True)
 
 # --- Entry Point ---
@@ -747,12 +1174,20 @@ from analyze_churn_agents import analyze_churn_agents
 from analyze_invalid import analyze_detailed_failures
 from analyze_lifecycle import analyze_lifecycle
 from analyze_spread import analyze_spread
+from extract_text import extract_documents
+from analysis_aggregates import refresh_aggregates, agents_report, churn_report, lifecycle_report
+from snapshot import Snapshot, export_snapshot, load_snapshot_dataset, detailed_failures, spread
+from report_writer import ReportWriter
+from shared_utils import load_analysis_dataset
 
 import argparse
+import gc
+import multiprocessing
 import sys
 
 # ... previous imports ...
 
+@timed("stage.sync")
 def run_sync_stage():
     """
     Executes the synchronization stage for all LPAs.
@@ -762,6 +1197,7 @@ def run_sync_stage():
     
     # Run setup once to avoid race conditions on table creation
     setup_database()
+    started_at = datetime.now()
     
     print(f"Syncing {len(lpas)} LPAs in parallel...", flush=True)
     
@@ -774,21 +1210,207 @@ def run_sync_stage():
                 future.result()
                 print(f"=== Finished Syncing {lpa} ===", flush=True)
             except Exception as e:
+                count("errors", stage="sync", lpa=lpa)
                 print(f"generated an exception during sync for {lpa}: {e}", flush=True)
 
-def run_analysis_stage():
+    record_sync_run(started_at)
+
+@timed("stage.extract")
+def run_extraction_stage():
+    """
+    Extracts text from downloaded documents into document_text.
+    """
+    print("\n=== Starting Extraction Stage ===", flush=True)
+    setup_database()
+    conn = get_db_connection()
+    try:
+        stats = extract_documents(conn)
+    finally:
+        conn.close()
+    for outcome in ('extracted', 'skipped', 'failed'):
+        count("documents_processed", stats[outcome], outcome=outcome)
+
+# Analyses that read the shared in-memory dataset rather than querying themselves
+DATASET_ANALYSES = {analyze_agents, analyze_churn_agents, analyze_lifecycle}
+
+# Reports read from the persisted aggregates in place of those analyses
+AGGREGATE_REPORTS = {
+    analyze_agents: agents_report,
+    analyze_churn_agents: churn_report,
+    analyze_lifecycle: lifecycle_report,
+}
+
+# Snapshot implementations of the analyses that query the database
+SNAPSHOT_ANALYSES = {
+    analyze_detailed_failures: detailed_failures,
+    analyze_spread: spread,
+}
+
+@timed("stage.export")
+def run_export_stage(path):
+    """
+    Exports the analysis columns to a columnar snapshot at path.
+    """
+    print("\n=== Starting Snapshot Export ===", flush=True)
+    setup_database()
+    conn = get_db_connection()
+    try:
+        export_snapshot(conn, path)
+    finally:
+        conn.close()
+
+# Output file -> analysis
+ANALYSIS_OUTPUTS = {
+    "agents_latest.json": analyze_agents,
+    "churn_latest.json": analyze_churn_agents,
+    "failures_latest.json": analyze_detailed_failures,
+    "lifecycle_latest.json": analyze_lifecycle,
+    "spread_latest.json": analyze_spread
+}
+
+def _agent_shards(reports):
+    """(name, {agent, churn}) per reported agent: its agents_latest row and
+    its churn_latest row, None if it had no invalid applications."""
+    churn = {row['name']: row for row in reports["churn_latest.json"]}
+    for row in reports["agents_latest.json"]:
+        yield row['name'], {"agent": row, "churn": churn.get(row['name'])}
+
+def _lpa_shards(reports):
+    """(lpa, lifecycle figures) per LPA."""
+    yield from reports["lifecycle_latest.json"]["by_lpa"].items()
+
+# Shard directory -> (outputs the shards are cut from, shard generator)
+SHARDED_OUTPUTS = {
+    "agents": (("agents_latest.json", "churn_latest.json"), _agent_shards),
+    "lifecycle": (("lifecycle_latest.json",), _lpa_shards),
+}
+SHARD_SOURCES = {filename for sources, _ in SHARDED_OUTPUTS.values() for filename in sources}
+
+def _write_shards(writer, timestamp, reports):
+    """Writes the per-agent and per-LPA shards of the reports produced."""
+    for directory, (sources, shards) in SHARDED_OUTPUTS.items():
+        missing = [filename for filename in sources if filename not in reports]
+        if missing:
+            print(f"Skipping {directory} shards: no {', '.join(missing)}", flush=True)
+            continue
+        try:
+            with span("analysis.write_shards", directory=directory) as written:
+                written.add(items=writer.write_shards(directory, timestamp, shards(reports)))
+        except Exception as e:
+            count("errors", stage="shards", directory=directory)
+            print(f"Error writing {directory} shards: {e}", flush=True)
+
+# Set before the analysis pool forks, so workers inherit the loaded dataset
+# (copy-on-write) instead of receiving it pickled
+_analysis_context = {'dataset': None, 'aggregates_ready': False, 'snapshot': None}
+
+def compute_analysis(func, dataset=None, aggregates_ready=False, snapshot=None):
+    """
+    Produces one analysis' data: from the aggregates or the shared dataset
+    for the dataset analyses, from the snapshot or by querying for the others.
+    """
+    if snapshot is not None and func in SNAPSHOT_ANALYSES:
+        return SNAPSHOT_ANALYSES[func](snapshot)
+    if func in DATASET_ANALYSES:
+        if aggregates_ready:
+            conn = get_db_connection()
+            try:
+                return AGGREGATE_REPORTS[func](conn)
+            finally:
+                conn.close()
+        if dataset is None:
+            raise RuntimeError("dataset not loaded")
+        return func(dataset=dataset)
+    return func()
+
+def _analysis_worker(filename):
+    """Process pool entry point: runs one analysis against the inherited context.
+    Also returns the SQL it profiled, if profiling, for the parent to merge."""
+    # Statements the parent recorded before forking are the parent's
+    sql_profile.reset()
+    start = time.perf_counter()
+    data = compute_analysis(ANALYSIS_OUTPUTS[filename], **_analysis_context)
+    return data, time.perf_counter() - start, sql_profile.take() if sql_profile.is_enabled() else None
+
+def _write_report(writer, filename, timestamp, data):
+    with span("analysis.write", report=filename):
+        written = writer.write(filename, timestamp, data)
+    count("reports", report=filename, outcome="written" if written else "unchanged")
+
+def _run_analyses_parallel(writer, timestamp, dataset, aggregates_ready, snapshot=None, workers=None,
+                           reports=None):
     """
-    Executes the analysis stage and writes output to JSON.
+    Runs the analyses in a forked process pool and returns their timings.
+    A failing analysis is reported and skipped without affecting the others.
+    The data of the outputs that are sharded is kept in reports, if given.
+    """
+    timings = {}
+    _analysis_context.update(dataset=dataset, aggregates_ready=aggregates_ready, snapshot=snapshot)
+    if dataset is not None:
+        # Build the agent maps once here rather than once per worker
+        dataset.dedup_map()
+        dataset.name_clusters()
+    # Keep the collector from touching (and so copying) the shared dataset pages
+    gc.freeze()
+    try:
+        workers = workers or min(len(ANALYSIS_OUTPUTS), os.cpu_count() or 1)
+        print(f"Running {len(ANALYSIS_OUTPUTS)} analyses on {workers} processes...", flush=True)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = {executor.submit(_analysis_worker, filename): filename for filename in ANALYSIS_OUTPUTS}
+            for future in concurrent.futures.as_completed(futures):
+                filename = futures[future]
+                name = ANALYSIS_OUTPUTS[filename].__name__
+                try:
+                    data, seconds, statements = future.result()
+                    if statements:
+                        sql_profile.merge(statements)
+                    print(f"{name} computed in {seconds:.2f}s", flush=True)
+                    timings[name] = seconds
+                    record_span("analysis.compute", seconds, analysis=name)
+                    _write_report(writer, filename, timestamp, data)
+                    if reports is not None and filename in SHARD_SOURCES:
+                        reports[filename] = data
+                except Exception as e:
+                    count("errors", stage="analysis", analysis=name)
+                    print(f"Error running {name}: {e}", flush=True)
+    finally:
+        gc.unfreeze()
+        _analysis_context.update(dataset=None, aggregates_ready=False, snapshot=None)
+    return timings
+
+def refresh_agent_aliases(full_rebuild=False):
+    """Updates the persisted agent dedup map before the dataset is loaded; on
+    failure the analyses build the map from the dataset instead."""
+    conn = None
+    try:
+        conn = get_db_connection()
+        start = time.perf_counter()
+        recomputed = update_agent_aliases(conn, full_rebuild=full_rebuild)
+        print(f"Agent aliases: {recomputed} emails recomputed in {time.perf_counter() - start:.2f}s", flush=True)
+    except Exception as e:
+        count("errors", stage="agent_aliases")
+        print(f"Error updating agent aliases: {e}", flush=True)
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+@timed("stage.analysis")
+def run_analysis_stage(full_rebuild=False, parallel=False, workers=None, snapshot_path=None, shards=False):
+    """
+    Executes the analysis stage and writes output to JSON (see report_writer).
+
+    Agent, churn and lifecycle figures come from the persisted aggregates,
+    which are brought up to date incrementally (or recomputed and verified
+    with full_rebuild); if that fails the analyses run in full instead.
+    With parallel, the analyses run concurrently in forked worker processes.
+    With snapshot_path, everything is computed from that exported snapshot
+    and the database is not used. With shards, the agent and lifecycle
+    reports are also written as per-agent and per-LPA shards.
     """
     print("\n=== Starting Analysis Stage ===", flush=True)
-    
-    analysis_map = {
-        "agents_latest.json": analyze_agents,
-        "churn_latest.json": analyze_churn_agents,
-        "failures_latest.json": analyze_detailed_failures,
-        "lifecycle_latest.json": analyze_lifecycle,
-        "spread_latest.json": analyze_spread
-    }
+    stage_start = time.perf_counter()
     
     # Output directory
     out_dir = "out"
@@ -796,39 +1418,120 @@ def run_analysis_stage():
         os.makedirs(out_dir)
         
     timestamp = datetime.now().isoformat()
-    
-    for filename, func in analysis_map.items():
-        print(f"Running {func.__name__}...", flush=True)
+    # Reports whose data is unchanged since the last run are not rewritten
+    writer = ReportWriter(out_dir, force=full_rebuild)
+
+    # Load the application dataset once for every analysis that needs it
+    dataset = None
+    snapshot = None
+    try:
+        if snapshot_path:
+            snapshot = Snapshot(snapshot_path)
+            print(f"Using {snapshot.summary()}", flush=True)
+            dataset = load_snapshot_dataset(snapshot)
+        else:
+            # Migrate first so the dataset snapshot postdates any new columns
+            setup_database()
+            refresh_agent_aliases(full_rebuild=full_rebuild)
+            dataset = load_analysis_dataset(DATABASE_URL)
+        print(f"Dataset: {dataset.summary()}", flush=True)
+    except Exception as e:
+        count("errors", stage="dataset")
+        print(f"Error loading analysis dataset: {e}", flush=True)
+        if snapshot_path:
+            return
+
+    aggregates_ready = False
+    if dataset is not None and snapshot is None:
+        conn = None
         try:
-            data = func()
-            result = {
-                "timestamp": timestamp,
-                "data": data
-            }
-            
-            out_path = os.path.join(out_dir, filename)
-            print(f"Writing to {out_path}", flush=True)
-            with open(out_path, 'w') as f:
-                json.dump(result, f, indent=2)
-                
+            conn = get_db_connection()
+            refresh_aggregates(conn, dataset, full_rebuild=full_rebuild)
+            aggregates_ready = True
         except Exception as e:
-            print(f"Error running {func.__name__}: {e}", flush=True)
+            count("errors", stage="aggregates")
+            print(f"Error updating analysis aggregates, running analyses in full: {e}", flush=True)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    if parallel and 'fork' not in multiprocessing.get_all_start_methods():
+        print("Parallel analysis needs fork; running sequentially.", flush=True)
+        parallel = False
+
+    reports = {} if shards else None
+    if parallel:
+        timings = _run_analyses_parallel(writer, timestamp, dataset, aggregates_ready, snapshot, workers,
+                                         reports)
+    else:
+        timings = {}
+        for filename, func in ANALYSIS_OUTPUTS.items():
+            print(f"Running {func.__name__}...", flush=True)
+            try:
+                start = time.perf_counter()
+                with span("analysis.compute", analysis=func.__name__):
+                    data = compute_analysis(func, dataset, aggregates_ready, snapshot)
+                timings[func.__name__] = time.perf_counter() - start
+                print(f"{func.__name__} computed in {timings[func.__name__]:.2f}s", flush=True)
+                _write_report(writer, filename, timestamp, data)
+                if shards and filename in SHARD_SOURCES:
+                    reports[filename] = data
+            except Exception as e:
+                count("errors", stage="analysis", analysis=func.__name__)
+                print(f"Error running {func.__name__}: {e}", flush=True)
+
+    if shards:
+        _write_shards(writer, timestamp, reports)
+
+    print("\nAnalysis timings:", flush=True)
+    for name, seconds in sorted(timings.items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<28} {seconds:>8.2f}s", flush=True)
+    print(f"  {'total (wall clock)':<28} {time.perf_counter() - stage_start:>8.2f}s", flush=True)
     
     print("Analysis Complete.", flush=True)
 
-def run_pipeline(skip_sync=False, skip_analysis=False):
+def run_pipeline(skip_sync=False, skip_analysis=False, extract_text=False, full_rebuild=False,
+                 parallel=False, workers=None, export_snapshot_path=None, snapshot_path=None, shards=False):
     """
     Runs the pipeline based on flags.
     """
-    if not skip_sync:
-        run_sync_stage()
-    else:
-        print("Skipping Sync Stage.")
-        
-    if not skip_analysis:
-        run_analysis_stage()
-    else:
-        print("Skipping Analysis Stage.")
+    try:
+        if not skip_sync:
+            run_sync_stage()
+        else:
+            print("Skipping Sync Stage.")
+
+        if extract_text:
+            run_extraction_stage()
+
+        if export_snapshot_path:
+            run_export_stage(export_snapshot_path)
+
+        if not skip_analysis:
+            run_analysis_stage(full_rebuild=full_rebuild, parallel=parallel, workers=workers,
+                               snapshot_path=snapshot_path, shards=shards)
+        else:
+            print("Skipping Analysis Stage.")
+    finally:
+        http_client.print_summary()
+        # Timings, counts and errors of every stage, for tracking runs over time
+        write_metrics("out")
+        if sql_profile.is_enabled():
+            write_sql_profile()
+
+def write_sql_profile(out_dir="out"):
+    """Writes the --profile-sql report, with plans for the slowest statements
+    if the database is reachable."""
+    conn = None
+    try:
+        conn = psycopg2.connect(DATABASE_URL)
+    except psycopg2.Error as e:
+        print(f"Could not connect to explain the slowest statements: {e}", flush=True)
+    try:
+        sql_profile.write_report(out_dir, conn)
+    finally:
+        if conn is not None:
+            conn.close()
 
 # --- Entry Point ---
 
@@ -836,13 +1539,31 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Planning Slurper Pipeline")
     parser.add_argument("--analyze-only", action="store_true", help="Run only the analysis stage")
     parser.add_argument("--sync-only", action="store_true", help="Run only the sync stage")
+    parser.add_argument("--extract-text", action="store_true", help="Extract text from downloaded documents after sync")
+    parser.add_argument("--full-rebuild", action="store_true",
+                        help="Recompute the analysis aggregates from scratch, verify them against the incremental ones and rewrite every report")
+    parser.add_argument("--parallel", action="store_true", help="Run the analyses concurrently in worker processes")
+    parser.add_argument("--workers", type=int, help="Number of analysis worker processes (default: one per analysis, up to the CPU count)")
+    parser.add_argument("--export-snapshot", metavar="PATH", help="Export the analysis columns to a columnar snapshot after sync")
+    parser.add_argument("--snapshot", metavar="PATH", help="Run the analyses against an exported snapshot instead of the database")
+    parser.add_argument("--shards", action="store_true", help="Also write per-agent and per-LPA report shards with an index")
+    parser.add_argument("--profile-sql", action="store_true",
+                        help="Profile every SQL statement and write a ranked report with EXPLAIN plans to out/sql_profile.txt")
     
     args = parser.parse_args()
+
+    if args.profile_sql:
+        sql_profile.enable()
     
     if args.analyze_only:
-        run_pipeline(skip_sync=True)
+        run_pipeline(skip_sync=True, extract_text=args.extract_text, full_rebuild=args.full_rebuild,
+                     parallel=args.parallel, workers=args.workers,
+                     export_snapshot_path=args.export_snapshot, snapshot_path=args.snapshot, shards=args.shards)
     elif args.sync_only:
-        run_pipeline(skip_analysis=True)
+        run_pipeline(skip_analysis=True, extract_text=args.extract_text,
+                     export_snapshot_path=args.export_snapshot)
     else:
-        run_pipeline()
+        run_pipeline(extract_text=args.extract_text, full_rebuild=args.full_rebuild,
+                     parallel=args.parallel, workers=args.workers,
+                     export_snapshot_path=args.export_snapshot, snapshot_path=args.snapshot, shards=args.shards)
 
@@ -0,0 +1,319 @@
+"""
+Run metrics: timed spans and counters, written out at the end of a run.
+
+A span times a block of work under a name and labels (stage, lpa, table,
+analysis, ...); every span with the same name and labels accumulates into
+one entry of calls, total and slowest seconds, errors (exceptions leaving
+the block), and the items and bytes the block reports having processed:
+
+    with span("sync.fetch", lpa=lpa) as s:
+        response = requests.get(...)
+        s.add(items=len(results), nbytes=len(response.content))
+
+Counters accumulate plain totals (count("errors", stage="hydrate", lpa=lpa)).
+Histograms count observations into fixed buckets (observe("http_request_seconds",
+seconds, host=host, endpoint=endpoint)); histogram() merges the matching
+ones and estimates quantiles from the buckets, the way Prometheus'
+histogram_quantile does, so code can read p50/p99 during the run.
+The registry is process-wide and thread-safe, so the per-LPA sync threads
+share it; work done in forked analysis workers is recorded by the parent
+with record_span. write_metrics writes everything to out/metrics.json and,
+in Prometheus text format, to out/metrics.prom for a node_exporter textfile
+collector, so runs can be compared over time.
+"""
+
+import bisect
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+PROMETHEUS_PREFIX = "planning_slurper"
+
+# Upper bounds, in seconds, of the default (latency) histogram buckets
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_lock = threading.Lock()
+_spans = {}
+_counters = {}
+_histograms = {}
+_started = {"wall": datetime.now(), "clock": time.perf_counter()}
+
+
+class _SpanStats:
+    __slots__ = ("calls", "seconds", "max_seconds", "errors", "items", "bytes")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.errors = 0
+        self.items = 0
+        self.bytes = 0
+
+
+class Span:
+    """What one timed block reports about the work it did."""
+
+    __slots__ = ("items", "bytes")
+
+    def __init__(self):
+        self.items = 0
+        self.bytes = 0
+
+    def add(self, items=0, nbytes=0):
+        self.items += items
+        self.bytes += nbytes
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def reset():
+    """Clears every span and counter and restarts the run clock."""
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _histograms.clear()
+        _started.update(wall=datetime.now(), clock=time.perf_counter())
+
+
+def record_span(name, seconds, error=False, items=0, nbytes=0, **labels):
+    """Accumulates one timed call of the span name with labels."""
+    key = _key(name, labels)
+    with _lock:
+        stats = _spans.get(key)
+        if stats is None:
+            stats = _spans[key] = _SpanStats()
+        stats.calls += 1
+        stats.seconds += seconds
+        stats.max_seconds = max(stats.max_seconds, seconds)
+        stats.errors += error
+        stats.items += items
+        stats.bytes += nbytes
+
+
+@contextmanager
+def span(name, **labels):
+    """Times the block as one call of the span name with labels; an exception
+    leaving the block counts as an error and propagates."""
+    current = Span()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record_span(name, time.perf_counter() - start, error=error,
+                    items=current.items, nbytes=current.bytes, **labels)
+
+
+def timed(name, label_args=(), **labels):
+    """Decorator timing every call of the function as the span name. Besides
+    the fixed labels, each argument named in label_args (e.g. lpa) becomes a
+    label with the value it was called with."""
+    def decorate(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_labels = dict(labels)
+            if label_args:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                call_labels.update((arg, bound.arguments[arg]) for arg in label_args)
+            with span(name, **call_labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    """Adds value to the counter name with labels."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # One count per bucket, and a last one for values above every bound
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Counts value into the histogram name with labels. A histogram keeps
+    the buckets it was first observed with."""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = _Histogram(buckets)
+        histogram.counts[bisect.bisect_left(histogram.buckets, value)] += 1
+        histogram.sum += value
+
+
+def _quantile(q, buckets, counts):
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    cumulative = 0
+    for i, bucket_count in enumerate(counts):
+        if cumulative + bucket_count >= rank and bucket_count:
+            if i == len(buckets):
+                # Above the last bound: all that is known is that it is at least that
+                return buckets[-1]
+            lower = buckets[i - 1] if i else 0.0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / bucket_count
+        cumulative += bucket_count
+    return buckets[-1]
+
+
+def _histogram_summary(buckets, counts, total):
+    observations = sum(counts)
+    return {
+        "buckets": list(buckets),
+        "counts": list(counts),
+        "count": observations,
+        "sum": total,
+        "mean": total / observations if observations else None,
+        "p50": _quantile(0.5, buckets, counts),
+        "p90": _quantile(0.9, buckets, counts),
+        "p99": _quantile(0.99, buckets, counts),
+    }
+
+
+def histogram(name, **labels):
+    """Summary (count, sum, mean, p50/p90/p99, bucket counts) of every
+    histogram name whose labels include the given ones, e.g. all endpoints
+    of one host; None if there is none."""
+    wanted = set(_key(name, labels)[1])
+    with _lock:
+        matching = [(h.buckets, list(h.counts), h.sum) for (n, key_labels), h in _histograms.items()
+                    if n == name and wanted <= set(key_labels)]
+    if not matching:
+        return None
+    buckets = matching[0][0]
+    counts = [0] * (len(buckets) + 1)
+    total = 0.0
+    for other_buckets, other_counts, other_sum in matching:
+        if other_buckets != buckets:
+            raise ValueError(f"histograms {name} have different buckets")
+        counts = [a + b for a, b in zip(counts, other_counts)]
+        total += other_sum
+    return _histogram_summary(buckets, counts, total)
+
+
+def snapshot():
+    """Everything recorded so far as a JSON-ready dict."""
+    with _lock:
+        spans = sorted(_spans.items())
+        counters = sorted(_counters.items())
+        histograms = sorted((key, (h.buckets, list(h.counts), h.sum)) for key, h in _histograms.items())
+        started, clock = _started["wall"], _started["clock"]
+    return {
+        "started": started.isoformat(),
+        "seconds": time.perf_counter() - clock,
+        "spans": [{
+            "name": name,
+            "labels": dict(labels),
+            "calls": stats.calls,
+            "seconds": stats.seconds,
+            "max_seconds": stats.max_seconds,
+            "errors": stats.errors,
+            "items": stats.items,
+            "bytes": stats.bytes,
+            "items_per_second": stats.items / stats.seconds if stats.items and stats.seconds else None,
+        } for (name, labels), stats in spans],
+        "counters": [{"name": name, "labels": dict(labels), "value": value}
+                     for (name, labels), value in counters],
+        "histograms": [{"name": name, "labels": dict(labels), **_histogram_summary(*values)}
+                       for (name, labels), values in histograms],
+    }
+
+
+def _metric_name(*parts):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', "_".join((PROMETHEUS_PREFIX,) + parts))
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return "{" + ",".join(f'{re.sub(r"[^a-zA-Z0-9_]", "_", key)}="{value}"'
+                          for key, value in zip(labels, escaped)) + "}"
+
+
+def prometheus_text(data):
+    """data (a snapshot) in the Prometheus text exposition format."""
+    families = {}
+
+    def sample(name, kind, labels, value):
+        family = families.setdefault(name, (kind, []))
+        family[1].append(f"{name}{_label_text(labels)} {value}")
+
+    sample(_metric_name("run_seconds"), "gauge", {}, data["seconds"])
+    sample(_metric_name("run_start_timestamp_seconds"), "gauge", {},
+           datetime.fromisoformat(data["started"]).timestamp())
+    for entry in data["spans"]:
+        labels = {"span": entry["name"], **entry["labels"]}
+        sample(_metric_name("span_calls_total"), "counter", labels, entry["calls"])
+        sample(_metric_name("span_seconds_total"), "counter", labels, entry["seconds"])
+        sample(_metric_name("span_max_seconds"), "gauge", labels, entry["max_seconds"])
+        sample(_metric_name("span_errors_total"), "counter", labels, entry["errors"])
+        sample(_metric_name("span_items_total"), "counter", labels, entry["items"])
+        sample(_metric_name("span_bytes_total"), "counter", labels, entry["bytes"])
+    for entry in data["counters"]:
+        sample(_metric_name(entry["name"], "total"), "counter", entry["labels"], entry["value"])
+    for entry in data.get("histograms", []):
+        name = _metric_name(entry["name"])
+        cumulative = 0
+        for bound, bucket_count in zip(entry["buckets"] + ["+Inf"], entry["counts"]):
+            cumulative += bucket_count
+            sample(name + "_bucket", "histogram", {**entry["labels"], "le": bound}, cumulative)
+        families[name + "_bucket"][1].extend([
+            f"{name}_sum{_label_text(entry['labels'])} {entry['sum']}",
+            f"{name}_count{_label_text(entry['labels'])} {entry['count']}",
+        ])
+
+    lines = []
+    for name, (kind, samples) in families.items():
+        if kind == "histogram":
+            # A histogram's family is named without the _bucket suffix
+            name = name[:-len("_bucket")]
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def _replace(path, text):
+    # Written aside and renamed, so a textfile collector never reads half a file
+    with open(path + ".tmp", 'w') as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def write_metrics(out_dir="out"):
+    """Writes the run's metrics to out_dir/metrics.json and out_dir/metrics.prom."""
+    data = snapshot()
+    os.makedirs(out_dir, exist_ok=True)
+    _replace(os.path.join(out_dir, "metrics.json"), json.dumps(data, indent=2))
+    _replace(os.path.join(out_dir, "metrics.prom"), prometheus_text(data))
+    print(f"Metrics written to {out_dir}/metrics.json and {out_dir}/metrics.prom "
+          f"({len(data['spans'])} spans, {len(data['counters'])} counters, "
+          f"{len(data['histograms'])} histograms)", flush=True)
+    return data
@@ -0,0 +1,317 @@
+"""
+Local read-only HTTP query service for dashboards.
+
+Answers the recurring dashboard questions without ad-hoc SQL against the
+database:
+
+  GET /applications?q=&decision=&status=&location=&date_from=&date_to=
+                   &lat=&lon=&radius_m=&bbox=W,S,E,N&after=DATE,ID,LPA&limit=
+  GET /applications/<lpa>/<id>
+  GET /agents/<email or name>?limit=
+  GET /invalids?days=&lpa=&limit=
+
+Queries run on pooled read-only connections (so repeated shapes reuse their
+prepared statements), results are held in an LRU cache that is cleared
+whenever a new sync finishes, and responses are gzip-compressed for clients
+that accept it.
+
+Usage:
+  python query_service.py [--host 127.0.0.1] [--port 8765] [--max-connections 8] [--cache-size 512]
+"""
+
+import argparse
+import gzip
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+import main
+
+MAX_LIMIT = 200
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache with hit/miss counters."""
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class QueryError(Exception):
+    """A client error, reported as HTTP 400/404 with a message."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _rows_to_dicts(rows):
+    return [dict(zip(main.SEARCH_COLUMNS, row)) for row in rows]
+
+
+def _int_param(params, name, default=None, maximum=None):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise QueryError(400, f"{name} must be an integer")
+    if value < 1:
+        raise QueryError(400, f"{name} must be at least 1")
+    return min(value, maximum) if maximum else value
+
+
+def _float_param(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise QueryError(400, f"{name} must be a number")
+
+
+class QueryService:
+    """Routes read queries to pooled connections and caches the encoded results."""
+
+    def __init__(self, dsn=None, min_connections=1, max_connections=8, cache_size=512,
+                 sync_check_interval=30, **connect_kwargs):
+        self.pool = ThreadedConnectionPool(min_connections, max_connections,
+                                           dsn or main.DATABASE_URL, **connect_kwargs)
+        # ThreadingHTTPServer runs one thread per request; callers beyond the
+        # pool size wait here instead of getting a PoolError from getconn
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.cache = LRUCache(cache_size)
+        self.sync_check_interval = sync_check_interval
+        self._last_sync = None
+        # Bumped whenever the cache is cleared for a new sync
+        self._sync_generation = 0
+        self._last_sync_check = 0.0
+        self._sync_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                if not conn.readonly:
+                    conn.set_session(readonly=True, autocommit=True)
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                # A connection the server dropped is closed rather than handed
+                # to the next request
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def close(self):
+        self.pool.closeall()
+
+    def check_sync(self, force=False):
+        """Clears the result cache if a sync has finished since the last check."""
+        now = time.monotonic()
+        if not force and now - self._last_sync_check < self.sync_check_interval:
+            return
+        with self._sync_lock:
+            self._last_sync_check = now
+            try:
+                with self.connection() as conn:
+                    latest = main.get_last_sync_time(conn=conn)
+            except psycopg2.Error as e:
+                # Keep serving the cached results; the next check tries again
+                print(f"[query] Sync check failed: {e}", flush=True)
+                return
+            if latest != self._last_sync:
+                if self._last_sync is not None:
+                    print(f"[query] Sync finished at {latest}; clearing {len(self.cache)} cached results", flush=True)
+                self.cache.clear()
+                self._last_sync = latest
+                self._sync_generation += 1
+
+    def query(self, path, params):
+        """Dispatches a request path and its (single-valued) query parameters."""
+        parts = [unquote(p) for p in path.strip('/').split('/') if p]
+        if not parts:
+            raise QueryError(404, "not found")
+
+        with self.connection() as conn:
+            if parts[0] == 'applications' and len(parts) == 1:
+                return self._search(conn, params)
+            if parts[0] == 'applications' and len(parts) == 3:
+                try:
+                    app_id = int(parts[2])
+                except ValueError:
+                    raise QueryError(400, "application id must be an integer")
+                app = main.get_application_detail(app_id, parts[1], conn=conn)
+                if app is None:
+                    raise QueryError(404, "application not found")
+                return app
+            if parts[0] == 'agents' and len(parts) == 2:
+                limit = _int_param(params, 'limit', 100, MAX_LIMIT)
+                return {'results': _rows_to_dicts(main.get_agent_history(parts[1], limit=limit, conn=conn))}
+            if parts[0] == 'invalids' and len(parts) == 1:
+                rows = main.get_recent_invalids(days=_int_param(params, 'days', 30),
+                                                lpa=params.get('lpa'),
+                                                limit=_int_param(params, 'limit', 100, MAX_LIMIT),
+                                                conn=conn)
+                return {'results': _rows_to_dicts(rows)}
+        raise QueryError(404, "not found")
+
+    def _search(self, conn, params):
+        near = None
+        lat, lon = _float_param(params, 'lat'), _float_param(params, 'lon')
+        if lat is not None and lon is not None:
+            near = (lat, lon)
+
+        bbox = None
+        if params.get('bbox'):
+            try:
+                bbox = tuple(float(v) for v in params['bbox'].split(','))
+            except ValueError:
+                bbox = ()
+            if len(bbox) != 4:
+                raise QueryError(400, "bbox must be west,south,east,north")
+
+        after = None
+        if params.get('after'):
+            try:
+                after_date, after_id, after_lpa = params['after'].split(',', 2)
+                after = (after_date or None, int(after_id), after_lpa)
+            except ValueError:
+                raise QueryError(400, "after must be the next_cursor from a previous page")
+
+        try:
+            rows = main.search_applications(
+                date_from=params.get('date_from'), date_to=params.get('date_to'),
+                decision=params.get('decision'), status=params.get('status'),
+                location_keyword=params.get('location'), text_query=params.get('q'),
+                near=near, radius_m=_float_param(params, 'radius_m') or (500 if near else None),
+                bbox=bbox, after=after, limit=_int_param(params, 'limit', 20, MAX_LIMIT), conn=conn)
+        except ValueError as e:
+            raise QueryError(400, str(e))
+
+        cursor = main.next_page_cursor(rows) if not params.get('q') else None
+        next_cursor = None
+        if cursor:
+            next_cursor = f"{cursor[0].isoformat() if cursor[0] else ''},{cursor[1]},{cursor[2]}"
+        return {'results': _rows_to_dicts(rows), 'next_cursor': next_cursor}
+
+    def respond(self, path, params):
+        """Returns (status, entry) where entry holds the JSON body and its gzip form."""
+        self.check_sync()
+        key = (path, tuple(sorted(params.items())))
+        entry = self.cache.get(key)
+        if entry is not None:
+            return 200, entry
+
+        generation = self._sync_generation
+        try:
+            payload = self.query(path, params)
+        except QueryError as e:
+            return e.status, {'body': json.dumps({'error': str(e)}).encode(), 'gzip': None}
+
+        body = json.dumps(payload, separators=(',', ':'), default=str).encode()
+        entry = {
+            'body': body,
+            'gzip': gzip.compress(body, compresslevel=6) if len(body) >= MIN_COMPRESS_BYTES else None,
+        }
+        # A sync that finished mid-query may have cleared the cache already;
+        # don't put a result from before it back in
+        if generation == self._sync_generation:
+            self.cache.put(key, entry)
+        return 200, entry
+
+
+def make_handler(service):
+    class QueryHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                status, entry = service.respond(url.path, params)
+            except Exception as e:
+                print(f"[query] Error serving {self.path}: {e}", flush=True)
+                status, entry = 500, {'body': b'{"error":"internal error"}', 'gzip': None}
+
+            accepts_gzip = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+            body = entry['body']
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if accepts_gzip and entry['gzip'] is not None:
+                body = entry['gzip']
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return QueryHandler
+
+
+def serve(host="127.0.0.1", port=8765, max_connections=8, cache_size=512):
+    service = QueryService(max_connections=max_connections, cache_size=cache_size)
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"[query] Serving on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Local read-only query service")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind (default: localhost only)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-connections", type=int, default=8, help="Size of the read connection pool")
+    parser.add_argument("--cache-size", type=int, default=512, help="Number of cached responses")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_connections, args.cache_size)
+
+
+if __name__ == "__main__":
+    main_cli()
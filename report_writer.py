@@ -0,0 +1,266 @@
+"""
+Writes the analysis reports to disk, precompressed and only when they change.
+
+Each report is encoded incrementally with compact separators and streamed
+to the JSON file and to its .gz and .br siblings in one pass, so the full
+encoded text is never held in memory. A SHA-256 of the report's data
+(everything but its timestamp) is recorded in out/manifest.json; when a
+report's digest matches the one recorded, the new files are discarded, the
+previous ones (and their timestamp) are kept, and the report is left out of
+the run's list of changed files the deploy workflow uploads.
+
+Reports clients read one entity of at a time are also split into shards,
+one file per agent or LPA, with an index of each shard's key, size and
+hash (ReportWriter.write_shards). Shards are written and uploaded under
+the same digest rule, so a daily upload sends only the shards that changed.
+Shards of names that are gone are deleted locally and listed in the
+manifest, so the upload can delete them from the bucket too:
+
+  python report_writer.py changed [out]   # paths to upload, one per line
+  python report_writer.py removed [out]   # paths to delete, one per line
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import brotli
+
+MANIFEST_FILENAME = "manifest.json"
+COMPRESSED_SUFFIXES = (".gz", ".br")
+
+# Encoder output comes in small pieces; hand it on in blocks of this size
+_BLOCK_SIZE = 64 * 1024
+
+_ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+
+class _Outputs:
+    """The JSON file and its compressed siblings, written together as temp files."""
+
+    def __init__(self, path):
+        self.path = path
+        self.raw = open(path + ".tmp", 'wb')
+        self.gz_raw = open(path + ".gz.tmp", 'wb')
+        # mtime=0 keeps identical reports byte-identical
+        self.gz = gzip.GzipFile(filename='', mode='wb', fileobj=self.gz_raw, mtime=0)
+        self.br = open(path + ".br.tmp", 'wb')
+        self.br_compressor = brotli.Compressor(mode=brotli.MODE_TEXT)
+        self.size = 0
+        self.closed = False
+
+    def write(self, block):
+        self.size += len(block)
+        self.raw.write(block)
+        self.gz.write(block)
+        self.br.write(self.br_compressor.process(block))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.br.write(self.br_compressor.finish())
+        for f in (self.raw, self.gz, self.gz_raw, self.br):
+            f.close()
+
+    def commit(self):
+        for suffix in ("",) + COMPRESSED_SUFFIXES:
+            os.replace(self.path + suffix + ".tmp", self.path + suffix)
+
+    def discard(self):
+        for suffix in ("",) + COMPRESSED_SUFFIXES:
+            if os.path.exists(self.path + suffix + ".tmp"):
+                os.remove(self.path + suffix + ".tmp")
+
+
+def _blocks(chunks):
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= _BLOCK_SIZE:
+            yield "".join(buffer).encode()
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def shard_keys(names):
+    """File names for names: lower-cased, runs of anything but letters and
+    digits becoming "-". Names are keyed in sorted order, and one whose key
+    is already taken gets a suffix from its hash, so a name's key does not
+    depend on the order the names come in. Returns {name: key}."""
+    keys, taken = {}, set()
+    for name in sorted(names):
+        key = re.sub(r'[^0-9a-z]+', '-', name.lower()).strip('-')[:80] or "unnamed"
+        if key in taken:
+            key = f"{key}-{hashlib.sha1(name.encode()).hexdigest()[:8]}"
+        taken.add(key)
+        keys[name] = key
+    return keys
+
+
+def _hashed(digest, blocks):
+    for block in blocks:
+        digest.update(block)
+        yield block
+
+
+def load_manifest(out_dir):
+    """The manifest in out_dir, or an empty one if there is none yet."""
+    path = os.path.join(out_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {"reports": {}, "changed": [], "removed": []}
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest.setdefault("reports", {})
+    manifest.setdefault("changed", [])
+    manifest.setdefault("removed", [])
+    return manifest
+
+
+class ReportWriter:
+    """
+    Writes the reports of one analysis run into out_dir. With force, every
+    report is rewritten whether or not its digest changed.
+    """
+
+    def __init__(self, out_dir, force=False):
+        self.out_dir = out_dir
+        self.force = force
+        self.manifest = load_manifest(out_dir)
+        # Only this run's changes are uploaded (or deleted)
+        self.manifest["changed"] = []
+        self.manifest["removed"] = []
+        self._save_manifest()
+
+    def write(self, filename, timestamp, data):
+        """Writes {"timestamp", "data"} to filename and its compressed siblings.
+        Returns False (writing nothing) if the data is unchanged."""
+        changed = self._write(filename, timestamp, data)
+        if changed:
+            self._save_manifest()
+        return changed
+
+    def write_shards(self, directory, timestamp, shards):
+        """
+        Writes each (name, data) of shards to directory/<key>.json, the key
+        being the name made URL-safe, and an index of them to
+        <directory>_index.json: {"shards": [{name, key, size, sha256}]}, so
+        clients fetch only the shards they show and see from the hash
+        whether their copy is current. Like whole reports, shards whose data
+        is unchanged are not rewritten. Shards of names no longer present
+        are removed, and listed in the manifest's "removed" for the upload
+        to delete. Returns the number of shards written.
+        """
+        os.makedirs(os.path.join(self.out_dir, directory), exist_ok=True)
+        shards = list(shards)
+        keys = shard_keys(name for name, _ in shards)
+        index, written = [], 0
+        for name, data in shards:
+            key = keys[name]
+            filename = f"{directory}/{key}.json"
+            written += self._write(filename, timestamp, data, quiet=True, buffered=True)
+            entry = self.manifest["reports"][filename]
+            index.append({"name": name, "key": key, "size": entry["bytes"], "sha256": entry["sha256"]})
+
+        taken = set(keys.values())
+        stale = [filename for filename in self.manifest["reports"]
+                 if filename.startswith(directory + "/") and filename[len(directory) + 1:-5] not in taken]
+        for filename in stale:
+            del self.manifest["reports"][filename]
+            self.manifest["removed"].append(filename)
+            for suffix in ("",) + COMPRESSED_SUFFIXES:
+                path = os.path.join(self.out_dir, filename + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        self._save_manifest()
+        print(f"{directory}: {len(index)} shards, {written} written, {len(stale)} removed", flush=True)
+        self.write(f"{directory}_index.json", timestamp, {"shards": index})
+        return written
+
+    def _write(self, filename, timestamp, data, quiet=False, buffered=False):
+        # Buffered data (a shard) is encoded up front, so when it is unchanged
+        # no file is touched; a whole report is streamed and digested on the way
+        path = os.path.join(self.out_dir, filename)
+        if buffered:
+            body = _ENCODER.encode(data).encode()
+            digest = hashlib.sha256(body)
+            if self._unchanged(filename, digest, quiet):
+                return False
+            blocks = [body]
+        else:
+            digest = hashlib.sha256()
+            blocks = _hashed(digest, _blocks(_ENCODER.iterencode(data)))
+
+        outputs = _Outputs(path)
+        try:
+            outputs.write(b'{"timestamp":' + _ENCODER.encode(timestamp).encode() + b',"data":')
+            for block in blocks:
+                outputs.write(block)
+            outputs.write(b'}')
+            outputs.close()
+
+            if not buffered and self._unchanged(filename, digest, quiet):
+                outputs.discard()
+                return False
+
+            if not quiet:
+                print(f"Writing to {path}", flush=True)
+            outputs.commit()
+        except BaseException:
+            outputs.close()
+            outputs.discard()
+            raise
+
+        self.manifest["reports"][filename] = {
+            "sha256": digest.hexdigest(),
+            "bytes": outputs.size,
+            "gz_bytes": os.path.getsize(path + ".gz"),
+            "br_bytes": os.path.getsize(path + ".br"),
+            "timestamp": timestamp,
+        }
+        self.manifest["changed"].append(filename)
+        return True
+
+    def _unchanged(self, filename, digest, quiet):
+        previous = self.manifest["reports"].get(filename)
+        if self.force or previous is None or previous["sha256"] != digest.hexdigest():
+            return False
+        if not quiet:
+            print(f"Unchanged {os.path.join(self.out_dir, filename)} (written {previous['timestamp']})", flush=True)
+        return True
+
+    def _save_manifest(self):
+        self.manifest["updated"] = datetime.now().isoformat()
+        path = os.path.join(self.out_dir, MANIFEST_FILENAME)
+        with open(path + ".tmp", 'w') as f:
+            f.write(json.dumps(self.manifest, separators=(',', ':'), sort_keys=True))
+        os.replace(path + ".tmp", path)
+
+
+def changed_files(out_dir):
+    """Paths of the files written by the last run: each changed report and its siblings."""
+    return [os.path.join(out_dir, filename + suffix)
+            for filename in sorted(load_manifest(out_dir)["changed"])
+            for suffix in ("",) + COMPRESSED_SUFFIXES]
+
+
+def removed_files(out_dir):
+    """Paths of the files the last run removed: each stale shard and its siblings."""
+    return [os.path.join(out_dir, filename + suffix)
+            for filename in sorted(load_manifest(out_dir)["removed"])
+            for suffix in ("",) + COMPRESSED_SUFFIXES]
+
+
+if __name__ == "__main__":
+    commands = {"changed": changed_files, "removed": removed_files}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print("Usage: python report_writer.py changed|removed [out_dir]")
+        sys.exit(1)
+    for path in commands[sys.argv[1]](sys.argv[2] if len(sys.argv) > 2 else "out"):
+        print(path)
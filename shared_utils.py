@@ -1,5 +1,15 @@
 import re
 import math
+import functools
+import bisect
+from collections import Counter, defaultdict
+import os
+import sys
+import time
+import json
+from datetime import datetime, date
+
+from metrics import record_span
 
 # Application types that represent substantive planning applications.
 # Excludes compliance submissions, S5 declarations, exemption certificates,
@@ -26,23 +36,97 @@ def is_planning_application(raw_json):
     return app_type in PLANNING_APPLICATION_TYPES
 
 
-def normalize_text(text):
-    if not text: return "Unknown/None"
+# Keywords classify_decision sorts decision texts by (compared upper-cased)
+DECISION_SUBSTANTIVE_KEYWORDS = (
+    'GRANT PERMISSION', 'REFUSE PERMISSION', 'GRANT RETENTION', 'REFUSE RETENTION',
+    'GRANT OUTLINE', 'REFUSE OUTLINE', 'SPLIT DECISION',
+    'DECLARE APPLICATION INVALID', 'INVALID APPLICATION', 'DECLARE INVALID',
+    'WITHDRAWN', 'WITHDRAW APPLICATION',
+)
+DECISION_ADMIN_KEYWORDS = (
+    'COMPLIANCE', 'CERTIFICATE OF EXEMPTION', 'EXTENSION OF DURATION',
+    'SECTION 254', 'S5', 'EXEMPTED DEVELOPMENT', 'FIRE CERT', 'SECTION 96',
+)
+
+@functools.lru_cache(maxsize=4096)
+def classify_decision(decision):
+    """Sorts a decision text into 'invalid', 'substantive' (any other planning
+    decision), 'admin' (compliance, exemptions, extensions, ...) or 'other';
+    None for an empty decision. Stored as applications.decision_category.
+
+    Any decision mentioning INVALID is an invalidation, whatever else it says."""
+    if not decision:
+        return None
+    upper = decision.upper()
+    if 'INVALID' in upper:
+        return 'invalid'
+    if any(keyword in upper for keyword in DECISION_ADMIN_KEYWORDS):
+        return 'admin'
+    if any(keyword in upper for keyword in DECISION_SUBSTANTIVE_KEYWORDS):
+        return 'substantive'
+    return 'other'
+
+
+def backfill_decision_categories(conn):
+    """Fills applications.decision_category for rows saved before it was
+    computed at ingest, one UPDATE per distinct decision text."""
+    cur = conn.cursor()
+    cur.execute("""SELECT DISTINCT decision FROM applications
+                   WHERE decision_category IS NULL AND decision <> ''""")
+    decisions = [decision for (decision,) in cur.fetchall()]
+    filled = 0
+    if decisions:
+        from psycopg2.extras import execute_values
+        execute_values(cur, """UPDATE applications SET decision_category = v.category
+                               FROM (VALUES %s) AS v (decision, category)
+                               WHERE applications.decision = v.decision
+                                 AND applications.decision_category IS NULL""",
+                       [(decision, classify_decision(decision)) for decision in decisions],
+                       page_size=len(decisions))
+        filled = cur.rowcount
+    conn.commit()
+    cur.close()
+    if filled:
+        print(f"Backfilled decision_category for {filled} applications", flush=True)
+    return filled
+
+
+# Precompiled patterns for the normalisation hot paths
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_PARENTHESES_RE = re.compile(r'\([^\)]+\)')
+_AGENT_NOISE_RE = re.compile(r'\b(ltd|limited|arch|architects|planning|assoc|associates|consultants|unknown|services|design|engineers)\b')
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_ST_RE = re.compile(r'\bst\b')
+_RD_RE = re.compile(r'\brd\b')
+_AVE_RE = re.compile(r'\bave\b')
+_EMAIL_IN_BRACKETS_RE = re.compile(r'<([^>]+)>')
+_EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+')
+
+# Bound on distinct strings memoised by each normalisation cache
+NORMALISE_CACHE_SIZE = 1 << 16
+
+
+@functools.lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def _normalize_text_cached(text):
     text = text.lower()
-    text = re.sub(r'<[^>]+>', '', text)
-    text = re.sub(r'\([^\)]+\)', '', text)
-    text = re.sub(r'\b(ltd|limited|arch|architects|planning|assoc|associates|consultants|unknown|services|design|engineers)\b', '', text)
-    text = re.sub(r'[^\w\s]', '', text) # Remove punctuation
+    text = _HTML_TAG_RE.sub('', text)
+    text = _PARENTHESES_RE.sub('', text)
+    text = _AGENT_NOISE_RE.sub('', text)
+    text = _PUNCTUATION_RE.sub('', text) # Remove punctuation
     return " ".join(text.split())
 
+def normalize_text(text):
+    if not text: return "Unknown/None"
+    return _normalize_text_cached(text)
+
 def extract_email(text):
     if not text: return ""
     # Try to find email inside < >
-    match = re.search(r'<([^>]+)>', text)
+    match = _EMAIL_IN_BRACKETS_RE.search(text)
     if match:
         return match.group(1).strip()
     # Otherwise assume the whole thing or look for simple email pattern
-    match = re.search(r'[\w\.-]+@[\w\.-]+', text)
+    match = _EMAIL_RE.search(text)
     if match:
         return match.group(0)
     return text.strip()
@@ -52,18 +136,25 @@ def get_fullname(raw_app):
     sur = raw_app.get('applicantSurname') or ''
     return normalize_text(f"{fore} {sur}")
 
-def get_agent(raw_app, dedup_map=None):
+def get_agent(raw_app, dedup_map=None, name_clusters=None):
     """Returns the normalised agent name for an application.
     If dedup_map is provided, uses the agent's email to resolve to a
-    canonical practice name, collapsing spelling variants."""
+    canonical practice name, collapsing spelling variants. name_clusters
+    (see clustering.cluster_agent_names) then maps near-duplicate names,
+    whatever their email, to their cluster's canonical name."""
+    agent = None
     if dedup_map:
         email = (raw_app.get('agentEmail') or '').strip().lower()
         if email and email in dedup_map:
-            return dedup_map[email]
-    name = raw_app.get('agentContactName') or raw_app.get('agentName') or ''
-    sur = raw_app.get('agentSurname') or ''
-    if not name and sur: name = sur
-    return normalize_text(name)
+            agent = dedup_map[email]
+    if agent is None:
+        name = raw_app.get('agentContactName') or raw_app.get('agentName') or ''
+        sur = raw_app.get('agentSurname') or ''
+        if not name and sur: name = sur
+        agent = normalize_text(name)
+    if name_clusters:
+        return name_clusters.get(agent, agent)
+    return agent
 
 
 def _extract_domain(email):
@@ -82,6 +173,48 @@ def _extract_domain(email):
     return domain
 
 
+def _add_alias_source(email_names, email, surname, count, first_seen):
+    """Counts count uses of surname with email, applying the dedup map's filters."""
+    if not email or not surname or len(surname) < 3:
+        return
+    normalised = normalize_text(surname)
+    if normalised == "unknown/none":
+        return
+    names = email_names.setdefault(email, {})
+    seen = names.get(normalised)
+    if seen is None:
+        names[normalised] = [count, first_seen]
+    else:
+        seen[0] += count
+        seen[1] = min(seen[1], first_seen)
+
+
+def _canonical_names(email_names):
+    """Maps every email in email_names ({email: {normalised name: [count,
+    first seen]}}) to its practice's canonical name (see build_agent_dedup_map).
+
+    Ties go to the name seen earliest, then alphabetically, so the result does
+    not depend on the order the sources were read in."""
+    # Group emails by professional domain
+    groups = defaultdict(set)  # domain -> set of emails
+    for email in email_names:
+        # For free-provider emails, use per-email canonical name (no domain grouping)
+        groups[_extract_domain(email) or ('', email)].add(email)
+
+    # For each group, merge all name counts and pick the canonical name
+    dedup_map = {}
+    for emails in groups.values():
+        merged = {}
+        for email in emails:
+            for name, (count, first_seen) in email_names[email].items():
+                total = merged.get(name)
+                merged[name] = [count, first_seen] if total is None else [total[0] + count, min(total[1], first_seen)]
+        canonical = min(merged, key=lambda name: (-merged[name][0], merged[name][1], name))
+        for email in emails:
+            dedup_map[email] = canonical
+    return dedup_map
+
+
 def build_agent_dedup_map(apps):
     """Builds an email -> canonical agent name mapping from a list of raw_json dicts.
 
@@ -92,50 +225,173 @@ def build_agent_dedup_map(apps):
     2. Within each domain group, pick the most frequently used normalised
        agentSurname as the canonical name.
 
-    For free-provider emails (gmail, hotmail, etc.), falls back to per-email grouping."""
-    from collections import Counter, defaultdict
-
-    # Collect all (email, normalised_name, count) tuples
-    email_names = {}  # email -> Counter of normalised names
+    For free-provider emails (gmail, hotmail, etc.), falls back to per-email grouping.
+    The pipeline persists the same mapping in agent_aliases (see update_agent_aliases)."""
+    email_names = {}  # email -> {normalised name: [count, first seen]}
     for app in apps:
         email = (app.get('agentEmail') or '').strip().lower()
-        surname = app.get('agentSurname') or ''
-        if not email or not surname or len(surname) < 3:
-            continue
-        normalised = normalize_text(surname)
-        if normalised == "unknown/none":
-            continue
-        if email not in email_names:
-            email_names[email] = Counter()
-        email_names[email][normalised] += 1
+        _add_alias_source(email_names, email, app.get('agentSurname') or '', 1, to_datetime(app.get('_dt')))
+    return _canonical_names(email_names)
 
-    # Group emails by professional domain
-    domain_emails = defaultdict(set)  # domain -> set of emails
-    free_emails = set()  # emails with free provider domains
-    for email in email_names:
-        domain = _extract_domain(email)
-        if domain:
-            domain_emails[domain].add(email)
-        else:
-            free_emails.add(email)
 
-    # For each domain group, merge all name counters and pick the canonical name
-    dedup_map = {}
+# --- Persisted agent aliases ---
 
-    for domain, emails in domain_emails.items():
-        merged = Counter()
-        for email in emails:
-            merged.update(email_names[email])
-        canonical = merged.most_common(1)[0][0]
-        for email in emails:
-            dedup_map[email] = canonical
+ALIASES_WATERMARK = 'agent_aliases'
 
-    # For free-provider emails, use per-email canonical name (no domain grouping)
-    for email in free_emails:
-        canonical = email_names[email].most_common(1)[0][0]
-        dedup_map[email] = canonical
+# How agent_aliases keys and groups emails, as SQL over applications.agent_email
+# (both expressions are indexed, see main._create_schema). btrim strips the
+# characters str.strip() does, so these key an email as build_agent_dedup_map does.
+# (there are none above U+3000)
+_WHITESPACE_SQL = "E'" + "".join(f"\\u{ord(c):04x}" for c in map(chr, range(0x3001)) if c.isspace()) + "'"
+ALIAS_EMAIL_SQL = f"lower(btrim(agent_email, {_WHITESPACE_SQL}))"
+ALIAS_DOMAIN_SQL = (f"btrim(substr({ALIAS_EMAIL_SQL}, strpos({ALIAS_EMAIL_SQL}, '@') + 1), "
+                    f"{_WHITESPACE_SQL})")
+
+
+def _alias_sources(cur, domains=None, emails=None):
+    """Reads (email, surname, count, first registration) from the planning
+    applications, for all of them or just the given domains and emails."""
+    condition = "TRUE"
+    params = [sorted(PLANNING_APPLICATION_TYPES)]
+    if domains is not None:
+        condition = f"({ALIAS_DOMAIN_SQL} = ANY(%s) OR {ALIAS_EMAIL_SQL} = ANY(%s))"
+        params += [sorted(domains), sorted(emails)]
+    # A missing date sorts first, as to_datetime(None) does in build_agent_dedup_map
+    cur.execute(f"""SELECT {ALIAS_EMAIL_SQL}, agent_surname, COUNT(*),
+                           CASE WHEN bool_and(registration_date IS NOT NULL) THEN MIN(registration_date) END
+                    FROM applications
+                    WHERE application_type = ANY(%s) AND agent_email IS NOT NULL AND {condition}
+                    GROUP BY 1, 2""", params)
+    email_names = {}
+    for email, surname, count, first_seen in cur.fetchall():
+        _add_alias_source(email_names, email, surname or '', count, to_datetime(first_seen))
+    return email_names
+
+
+def update_agent_aliases(conn, full_rebuild=False):
+    """Brings agent_aliases up to date with the applications saved since it was
+    last updated, recomputing only the domains (and free-provider emails) they
+    touch; the first run (or full_rebuild) builds it from everything.
+
+    An application's previous email is read from analysis_facts, so the
+    update falls back to a full build when those are older than the aliases.
+    Rows whose canonical agent changes get a new updated_at; emails that lose
+    every source keep a row with a NULL agent, so the change stays visible.
+    Returns the number of emails recomputed."""
+    cur = conn.cursor()
+    cur.execute("""SELECT aliases.folded_until, facts.folded_until >= aliases.folded_until
+                   FROM analysis_watermark aliases
+                   LEFT JOIN analysis_watermark facts ON facts.name = 'analysis'
+                   WHERE aliases.name = %s""", (ALIASES_WATERMARK,))
+    row = cur.fetchone()
+    cur.execute("SELECT LOCALTIMESTAMP")
+    folded_until = cur.fetchone()[0]
+
+    if full_rebuild or row is None or not row[1]:
+        email_names = _alias_sources(cur)
+        cur.execute("SELECT email FROM agent_aliases")
+    else:
+        cur.execute(f"""SELECT DISTINCT {ALIAS_EMAIL_SQL} FROM applications
+                        WHERE updated_at > %s AND updated_at <= %s AND agent_email IS NOT NULL""",
+                    (row[0], folded_until))
+        touched = {email for (email,) in cur.fetchall()}
+        # An application's previous email, as last folded into the analysis aggregates
+        cur.execute("""SELECT DISTINCT f.agent_email FROM analysis_facts f
+                       JOIN applications a ON a.id = f.id AND a.lpa = f.lpa
+                       WHERE a.updated_at > %s AND a.updated_at <= %s AND f.agent_email <> ''""",
+                    (row[0], folded_until))
+        touched.update(email for (email,) in cur.fetchall())
+        domains = {d for d in map(_extract_domain, touched) if d}
+        emails = {e for e in touched if not _extract_domain(e)}
+        email_names = _alias_sources(cur, domains, emails)
+        cur.execute("SELECT email FROM agent_aliases WHERE domain = ANY(%s) OR email = ANY(%s)",
+                    (sorted(domains), sorted(emails)))
+
+    previous = {email for (email,) in cur.fetchall()}
+    aliases = _canonical_names(email_names)
+    rows = [(email, _extract_domain(email), agent) for email, agent in aliases.items()]
+    rows += [(email, _extract_domain(email), None) for email in previous - set(aliases)]
+    if rows:
+        from psycopg2.extras import execute_values
+        execute_values(cur, """INSERT INTO agent_aliases (email, domain, agent, updated_at)
+                               VALUES %s
+                               ON CONFLICT (email) DO UPDATE SET
+                                  agent = EXCLUDED.agent,
+                                  updated_at = EXCLUDED.updated_at
+                               WHERE agent_aliases.agent IS DISTINCT FROM EXCLUDED.agent""",
+                       rows, template="(%s, %s, %s, LOCALTIMESTAMP)", page_size=1000)
+    cur.execute("""INSERT INTO analysis_watermark (name, folded_until, updated_at)
+                   VALUES (%s, %s, NOW())
+                   ON CONFLICT (name) DO UPDATE SET
+                      folded_until = EXCLUDED.folded_until,
+                      updated_at = EXCLUDED.updated_at""",
+                (ALIASES_WATERMARK, folded_until))
+    conn.commit()
+    cur.close()
+    return len(rows)
+
+
+def load_agent_aliases(conn):
+    """Reads the persisted email -> canonical agent map in one query, or
+    returns None if agent_aliases has never been built or applications have
+    been saved since its last update."""
+    cur = conn.cursor()
+    cur.execute("""SELECT a.email, a.agent
+                   FROM analysis_watermark w
+                   LEFT JOIN agent_aliases a ON a.agent IS NOT NULL
+                   WHERE w.name = %s
+                     AND NOT EXISTS (SELECT 1 FROM applications WHERE updated_at > w.folded_until)""",
+                (ALIASES_WATERMARK,))
+    rows = cur.fetchall()
+    cur.close()
+    if not rows:
+        return None
+    return {email: agent for email, agent in rows if email is not None}
+
+# Address words too generic to count towards a location match
+_COMMON_LOCATION_TOKENS = {'at', 'the', 'of', 'site', 'land', 'co', 'dublin', 'road', 'street',
+                           'avenue', 'house', 'development', 'permission'}
+
+# Easting/northing distance (metres) under which two sites are the same
+LOCATION_MATCH_DISTANCE = 50
+
+
+@functools.lru_cache(maxsize=NORMALISE_CACHE_SIZE)
+def _location_tokens_cached(loc):
+    loc = loc.lower().replace(',', ' ').replace('.', '')
+    loc = _ST_RE.sub('street', loc)
+    loc = _RD_RE.sub('road', loc)
+    loc = _AVE_RE.sub('avenue', loc)
+    return frozenset(loc.split()) - _COMMON_LOCATION_TOKENS
+
+
+def location_tokens(loc):
+    """Returns the significant address tokens used by location_match."""
+    if not loc: return frozenset()
+    return _location_tokens_cached(loc)
+
+
+def normalisation_cache_stats():
+    """Returns hit-rate summaries for the memoised normalisation functions."""
+    stats = {}
+    for name, func in (('normalize_text', _normalize_text_cached), ('location_tokens', _location_tokens_cached)):
+        info = func.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
+    return stats
+
+
+def _tokens_match(loc1, loc2):
+    if not loc1 or not loc2: return False
+    overlap = len(loc1 & loc2)
+    union = len(loc1 | loc2)
+    return union > 0 and (overlap / union) > 0.6
 
-    return dedup_map
 
 def location_match(app1, app2):
     try:
@@ -143,27 +399,182 @@ def location_match(app1, app2):
         x2, y2 = app2.get('easting'), app2.get('northing')
         if x1 and y1 and x2 and y2:
             dist = math.sqrt((x1-x2)**2 + (y1-y2)**2)
-            if dist < 50: return True
+            if dist < LOCATION_MATCH_DISTANCE: return True
     except: pass
-    
-    def clean_loc(loc):
-        if not loc: return set()
-        loc = loc.lower().replace(',', ' ').replace('.', '')
-        loc = re.sub(r'\bst\b', 'street', loc)
-        loc = re.sub(r'\brd\b', 'road', loc)
-        loc = re.sub(r'\bave\b', 'avenue', loc)
-        return set(loc.split())
-        
-    loc1 = clean_loc(app1.get('location', ''))
-    loc2 = clean_loc(app2.get('location', ''))
-    common = {'at', 'the', 'of', 'site', 'land', 'co', 'dublin', 'road', 'street', 'avenue', 'house', 'development', 'permission'}
-    loc1 -= common
-    loc2 -= common
-    
-    if not loc1 or not loc2: return False
-    overlap = len(loc1.intersection(loc2))
-    union = len(loc1.union(loc2))
-    return union > 0 and (overlap / union) > 0.6
+
+    return _tokens_match(location_tokens(app1.get('location', '')),
+                         location_tokens(app2.get('location', '')))
+
+
+def _app_coords(app):
+    """Returns (easting, northing) if location_match would compare them, else None."""
+    x, y = app.get('easting'), app.get('northing')
+    if x and y and isinstance(x, (int, float)) and isinstance(y, (int, float)):
+        return x, y
+    return None
+
+
+class _ApplicantCandidates:
+    """One applicant's applications in date order, indexed for follow-up search."""
+
+    # Below this many candidates a straight scan beats the index lookups
+    SCAN_LIMIT = 32
+
+    def __init__(self, apps, derived):
+        self.apps = apps
+        self.dts = [a['_dt'] for a in apps]
+        self.derived = [derived.location(a) for a in apps]
+        self.grid = None
+        self.token_index = None
+        if len(apps) > self.SCAN_LIMIT:
+            self.grid = defaultdict(list)
+            self.token_index = defaultdict(list)
+            for pos, (coords, tokens) in enumerate(self.derived):
+                if coords:
+                    self.grid[_grid_cell(coords)].append(pos)
+                for token in tokens:
+                    self.token_index[token].append(pos)
+
+    def _matches(self, inv_id, inv_coords, inv_tokens, pos, within):
+        if self.apps[pos]['_id'] == inv_id:
+            return False
+        if within is not None and not within(self.apps[pos]):
+            return False
+        coords, tokens = self.derived[pos]
+        if inv_coords and coords:
+            dx = inv_coords[0] - coords[0]
+            dy = inv_coords[1] - coords[1]
+            if math.sqrt(dx * dx + dy * dy) < LOCATION_MATCH_DISTANCE:
+                return True
+        return _tokens_match(inv_tokens, tokens)
+
+    def first_match(self, inv, inv_coords, inv_tokens, within=None):
+        start = bisect.bisect_right(self.dts, inv['_dt'])
+        n = len(self.apps)
+        inv_id = inv['_id']
+
+        if self.grid is None:
+            for pos in range(start, n):
+                if self._matches(inv_id, inv_coords, inv_tokens, pos, within):
+                    return self.apps[pos]
+            return None
+
+        # A match is either within 50 m (so in a neighbouring grid cell) or
+        # shares at least one address token; take the earliest of either.
+        best = n
+        position_lists = []
+        if inv_coords:
+            cx, cy = _grid_cell(inv_coords)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    position_lists.append(self.grid.get((cx + dx, cy + dy)))
+        for token in inv_tokens:
+            position_lists.append(self.token_index.get(token))
+
+        for positions in position_lists:
+            if not positions:
+                continue
+            for i in range(bisect.bisect_left(positions, start), len(positions)):
+                pos = positions[i]
+                if pos >= best:
+                    break
+                if self._matches(inv_id, inv_coords, inv_tokens, pos, within):
+                    best = pos
+                    break
+        return self.apps[best] if best < n else None
+
+
+def _grid_cell(coords):
+    return (int(coords[0] // LOCATION_MATCH_DISTANCE), int(coords[1] // LOCATION_MATCH_DISTANCE))
+
+
+class DerivedFieldCache:
+    """Per-run cache of each app's normalised applicant, agent, coordinates and
+    address tokens, so the nested loops of the analyses compute them once.
+
+    Entries are keyed by object identity and hold a reference to the app, so a
+    cache should live no longer than the analysis run that created it."""
+
+    def __init__(self, dedup_map=None, name_clusters=None):
+        self.dedup_map = dedup_map
+        self.name_clusters = name_clusters
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def _entry(self, app):
+        entry = self._entries.get(id(app))
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        # [app, fullname, agent (lazy), coords, tokens]
+        entry = [app, get_fullname(app), None, _app_coords(app), location_tokens(app.get('location', ''))]
+        self._entries[id(app)] = entry
+        return entry
+
+    def fullname(self, app):
+        return self._entry(app)[1]
+
+    def agent(self, app):
+        entry = self._entry(app)
+        if entry[2] is None:
+            entry[2] = get_agent(app, self.dedup_map, self.name_clusters)
+        return entry[2]
+
+    def location(self, app):
+        """Returns (coords, tokens) as compared by location_match."""
+        entry = self._entry(app)
+        return entry[3], entry[4]
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        rate = (self.hits / lookups * 100) if lookups else 0.0
+        text = f"derived fields: {len(self._entries)} apps, {rate:.1f}% hit rate"
+        for name, info in normalisation_cache_stats().items():
+            text += f"; {name}: {info['hit_rate'] * 100:.1f}% hit rate ({info['size']} cached)"
+        return text
+
+
+class FollowUpMatcher:
+    """Finds the application an applicant submitted after an invalidation.
+
+    The follow-up to an invalid application is the earliest later application
+    by the same applicant (get_fullname) whose location_match()es it — exactly
+    the linear search the analyses used to do, but each app's coordinates and
+    address tokens are computed once, candidates are found by bisecting a
+    date-sorted list, and large applicant groups (e.g. "unknown/none") are
+    searched through a 50 m grid and an address-token index.
+
+    apps must be sorted by '_dt' (as AnalysisDataset.apps is). Pass a shared
+    DerivedFieldCache to reuse normalised fields across matchers."""
+
+    def __init__(self, apps, derived=None):
+        self.derived = derived or DerivedFieldCache()
+        groups = defaultdict(list)
+        for a in apps:
+            name = self.derived.fullname(a)
+            if name: groups[name].append(a)
+        self._groups = {name: _ApplicantCandidates(group, self.derived) for name, group in groups.items()}
+
+    def find(self, inv, within=None):
+        """Returns the follow-up application for inv, or None.
+        within optionally restricts the candidates, e.g. to inv's own LPA."""
+        group = self._groups.get(self.derived.fullname(inv))
+        if group is None:
+            return None
+        return group.first_match(inv, *self.derived.location(inv), within=within)
+
+
+def is_agent_change(agent_inv, agent_new):
+    """True if a follow-up was lodged by a different agent from the invalidated
+    application's (one name containing the other counts as the same agent)."""
+    if agent_inv and agent_new:
+        if agent_inv == agent_new: return False
+        if agent_inv in agent_new or agent_new in agent_inv: return False
+        return True
+    return False
+
 
 def clean_note(text):
     """Extracts the specific note from the long description."""
@@ -177,3 +588,168 @@ def clean_note(text):
         # Return the clean text after "Note:", removing newlines
         return " ".join(match.group(1).split()).strip()
     return None
+
+
+# --- Shared analysis dataset ---
+
+# raw_json keys read by the analyses, projected at ingest into stored generated
+# columns on applications (see main._create_schema) as (column, key) pairs
+PROJECTED_FIELDS = (
+    ('application_type', 'applicationType'),
+    ('agent_email', 'agentEmail'),
+    ('agent_surname', 'agentSurname'),
+    ('agent_contact_name', 'agentContactName'),
+    ('agent_name', 'agentName'),
+    ('agent_telephone', 'agentTelephoneNumber'),
+    ('applicant_forename', 'applicantForename'),
+    ('applicant_surname', 'applicantSurname'),
+    ('easting', 'easting'),
+    ('northing', 'northing'),
+)
+# Projected as DOUBLE PRECISION (non-numeric JSON values become NULL)
+PROJECTED_NUMERIC_COLUMNS = {'easting', 'northing'}
+
+# Everything else is dropped at load time
+ANALYSIS_FIELDS = tuple(key for _, key in PROJECTED_FIELDS) + ('location',)
+
+
+def to_datetime(reg_date):
+    """Normalises a registration date (date, datetime, ISO string or None) to a datetime.
+    Missing or unparseable dates become datetime.min so they sort first."""
+    if not reg_date:
+        return datetime.min
+    if isinstance(reg_date, str):
+        try:
+            return datetime.fromisoformat(reg_date.replace('Z', ''))
+        except ValueError:
+            return datetime.min
+    if isinstance(reg_date, datetime):
+        return reg_date
+    if isinstance(reg_date, date):
+        return datetime.combine(reg_date, datetime.min.time())
+    return datetime.min
+
+
+def _estimate_size(apps):
+    """Approximate bytes held by the compact app dicts (containers plus values)."""
+    total = sys.getsizeof(apps)
+    for app in apps:
+        total += sys.getsizeof(app)
+        for value in app.values():
+            total += sys.getsizeof(value)
+    return total
+
+
+class AnalysisDataset:
+    """Substantive planning applications, loaded once and shared by the analyses.
+
+    apps holds one compact dict per application with the ANALYSIS_FIELDS keys
+    plus _id, _lpa, _decision, _category (classify_decision) and _dt, sorted by
+    _dt. Analyses must treat the dicts as read-only. snapshot_time is the
+    database time the rows were read at, when loaded from the database."""
+
+    def __init__(self, apps, load_seconds=0.0, snapshot_time=None, agent_aliases=None):
+        self.apps = apps
+        self.load_seconds = load_seconds
+        self.snapshot_time = snapshot_time
+        self.agent_aliases = agent_aliases
+        self._name_clusters = None
+        self.memory_bytes = _estimate_size(apps)
+
+    def __len__(self):
+        return len(self.apps)
+
+    def dedup_map(self):
+        """The email -> canonical agent map: the persisted agent_aliases when
+        they were loaded with the dataset, otherwise built from the apps (once)."""
+        if self.agent_aliases is None:
+            self.agent_aliases = build_agent_dedup_map(self.apps)
+        return self.agent_aliases
+
+    def name_clusters(self):
+        """The agent name -> canonical name map for spelling variants the
+        dedup map leaves apart (see clustering.py), built once."""
+        if self._name_clusters is None:
+            from clustering import cluster_agent_names
+            self._name_clusters = cluster_agent_names(agent_name_counts(self.apps, self.dedup_map()))
+        return self._name_clusters
+
+    def summary(self):
+        return (f"{len(self.apps)} planning applications loaded in {self.load_seconds:.2f}s "
+                f"(~{self.memory_bytes / 1_000_000:.1f} MB in memory)")
+
+
+def agent_name_counts(apps, dedup_map=None):
+    """How many apps resolve to each agent name, before name clustering."""
+    keys = Counter((a.get('agentEmail'), a.get('agentContactName'), a.get('agentName'), a.get('agentSurname'))
+                   for a in apps)
+    counts = Counter()
+    for (email, contact, name, surname), n in keys.items():
+        counts[get_agent({'agentEmail': email, 'agentContactName': contact,
+                          'agentName': name, 'agentSurname': surname}, dedup_map)] += n
+    return counts
+
+
+def build_analysis_dataset(rows, load_seconds=0.0):
+    """Builds an AnalysisDataset from (id, lpa, decision, registration_date, raw_json) rows."""
+    apps = []
+    for app_id, lpa, decision, reg_date, js in rows:
+        if isinstance(js, str):
+            js = json.loads(js)
+        if not js or not is_planning_application(js):
+            continue
+        app = {key: js[key] for key in ANALYSIS_FIELDS if key in js}
+        app['_id'] = app_id
+        app['_lpa'] = lpa or 'unknown'
+        app['_decision'] = decision or ''
+        app['_category'] = classify_decision(decision)
+        app['_dt'] = to_datetime(reg_date)
+        apps.append(app)
+    apps.sort(key=lambda x: x['_dt'])
+    return AnalysisDataset(apps, load_seconds=load_seconds)
+
+
+def _projected_rows(cur):
+    """Adapts narrow-column rows to the (id, lpa, decision, registration_date, fields) shape."""
+    keys = [key for _, key in PROJECTED_FIELDS] + ['location']
+    for row in cur:
+        fields = {key: value for key, value in zip(keys, row[4:]) if value is not None}
+        yield row[0], row[1], row[2], row[3], fields
+
+
+def load_analysis_dataset(database_url=None, conn=None):
+    """Fetches the projected analysis columns once and returns the compact AnalysisDataset,
+    along with the persisted agent aliases.
+
+    Only the narrow generated columns are selected, and non-planning types are
+    filtered server-side, so raw_json never crosses the wire."""
+    import sql_profile  # local import — keeps shared_utils importable without a driver
+
+    start = time.perf_counter()
+    columns = ", ".join(column for column, _ in PROJECTED_FIELDS)
+    own_conn = conn is None
+    if own_conn:
+        conn = sql_profile.connect(database_url or os.getenv("DATABASE_URL"))
+    try:
+        snapshot = conn.cursor()
+        snapshot.execute("SELECT LOCALTIMESTAMP")
+        snapshot_time = snapshot.fetchone()[0]
+        snapshot.close()
+
+        # Server-side cursor so rows are compacted as they stream in
+        cur = conn.cursor(name='analysis_dataset')
+        cur.itersize = 5000
+        cur.execute(f"""SELECT id, lpa, decision, registration_date, {columns}, location
+                        FROM applications
+                        WHERE application_type = ANY(%s)""",
+                    (sorted(PLANNING_APPLICATION_TYPES),))
+        dataset = build_analysis_dataset(_projected_rows(cur))
+        cur.close()
+        dataset.agent_aliases = load_agent_aliases(conn)
+    finally:
+        if own_conn:
+            conn.close()
+    dataset.load_seconds = time.perf_counter() - start
+    dataset.snapshot_time = snapshot_time
+    record_span("analysis.load_dataset", dataset.load_seconds, items=len(dataset.apps), source="database")
+    return dataset
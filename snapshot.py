@@ -0,0 +1,362 @@
+"""
+Columnar on-disk snapshot of the analysis-relevant tables.
+
+An export writes the columns the analyses read from applications, conditions,
+documents, agent_aliases and note_clusters to a directory of NumPy .npy files
+plus a manifest.json:
+
+  - text columns are dictionary-encoded: <table>.<column>.npy holds int32
+    codes into the list in <table>.<column>.dict.json, with -1 for NULL
+  - numeric columns are float64 (NaN for NULL), integer columns int64 (-1
+    for NULL) and dates datetime64[D] (NaT for NULL)
+
+Snapshot memory-maps the arrays, so loading is close to instant and repeated
+analysis iterations never touch the database:
+
+  python snapshot.py export out/snapshot
+  python main.py --analyze-only --snapshot out/snapshot
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+
+from analyze_invalid import GENERIC_NOTE, backfill_clean_notes, report_detailed_failures, update_note_clusters
+from analyze_spread import report_spread
+from metrics import record_span
+from shared_utils import (PLANNING_APPLICATION_TYPES, PROJECTED_FIELDS, PROJECTED_NUMERIC_COLUMNS,
+                          backfill_decision_categories, build_analysis_dataset, classify_decision,
+                          update_agent_aliases)
+
+SNAPSHOT_VERSION = 1
+
+NULL_CODE = -1
+NULL_INT = -1
+
+# table -> [(column, kind)], kind being one of 'int', 'float', 'date' or 'str'
+SNAPSHOT_TABLES = {
+    'applications': [('id', 'int'), ('lpa', 'str'), ('decision', 'str'),
+                     ('registration_date', 'date'), ('location', 'str')]
+                    + [(column, 'float' if column in PROJECTED_NUMERIC_COLUMNS else 'str')
+                       for column, _ in PROJECTED_FIELDS],
+    'conditions': [('app_id', 'int'), ('lpa', 'str'), ('order_num', 'int'),
+                   ('short_desc', 'str'), ('clean_note', 'str')],
+    'documents': [('app_id', 'int'), ('lpa', 'str'), ('description', 'str'),
+                  ('media_description', 'str'), ('received_date', 'str'), ('content_hash', 'str')],
+    'agent_aliases': [('email', 'str'), ('agent', 'str')],
+    'note_clusters': [('note', 'str'), ('cluster', 'str')],
+}
+
+
+# --- Export ---
+
+class _ColumnWriter:
+    """Accumulates one column's values in compact buffers while rows stream in."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        if kind == 'str':
+            self.values = array('i')
+            self.codes = {}
+        elif kind == 'int':
+            self.values = array('q')
+        elif kind == 'float':
+            self.values = array('d')
+        else:
+            self.values = []
+
+    def append(self, value):
+        if self.kind == 'str':
+            if value is None:
+                self.values.append(NULL_CODE)
+            else:
+                code = self.codes.get(value)
+                if code is None:
+                    code = self.codes[value] = len(self.codes)
+                self.values.append(code)
+        elif self.kind == 'int':
+            self.values.append(NULL_INT if value is None else value)
+        elif self.kind == 'float':
+            self.values.append(float('nan') if value is None else value)
+        else:
+            self.values.append(value)
+
+    def save(self, directory, table, column):
+        prefix = os.path.join(directory, f"{table}.{column}")
+        if self.kind == 'str':
+            np.save(prefix + ".npy", np.frombuffer(self.values, dtype=np.int32))
+            with open(prefix + ".dict.json", 'w') as f:
+                json.dump(list(self.codes), f)
+        elif self.kind == 'int':
+            np.save(prefix + ".npy", np.frombuffer(self.values, dtype=np.int64))
+        elif self.kind == 'float':
+            np.save(prefix + ".npy", np.frombuffer(self.values, dtype=np.float64))
+        else:
+            np.save(prefix + ".npy", np.array(self.values, dtype='datetime64[D]'))
+
+
+def _write_table(directory, table, columns, rows):
+    writers = [_ColumnWriter(kind) for _, kind in columns]
+    count = 0
+    for row in rows:
+        for writer, value in zip(writers, row):
+            writer.append(value)
+        count += 1
+    for (column, kind), writer in zip(columns, writers):
+        writer.save(directory, table, column)
+    return {'rows': count, 'columns': {column: kind for column, kind in columns}}
+
+
+def _table_rows(conn, table, columns):
+    cur = conn.cursor(name=f'snapshot_{table}')
+    cur.itersize = 10000
+    cur.execute(f"SELECT {', '.join(column for column, _ in columns)} FROM {table}")
+    yield from cur
+    cur.close()
+
+
+def write_snapshot(path, tables):
+    """Writes a snapshot of tables ({table: iterable of rows, their values in
+    SNAPSHOT_TABLES column order}) to path, replacing any previous one only
+    once the new one is complete. Returns the manifest."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    try:
+        manifest = {
+            'version': SNAPSHOT_VERSION,
+            'exported_at': datetime.now().isoformat(),
+            'tables': {table: _write_table(tmp_path, table, SNAPSHOT_TABLES[table], rows)
+                       for table, rows in tables.items()},
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def export_snapshot(conn, path):
+    """Writes a fresh snapshot of the database to path (see write_snapshot).
+
+    The tables are read in one REPEATABLE READ, READ ONLY transaction, so
+    they are consistent with each other even while a sync writes. Returns
+    the manifest."""
+    start = time.perf_counter()
+    backfill_decision_categories(conn)
+    backfill_clean_notes(conn)
+    update_note_clusters(conn)
+    update_agent_aliases(conn)
+    conn.commit()
+
+    isolation_level, readonly = conn.isolation_level, conn.readonly
+    conn.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+    try:
+        manifest = write_snapshot(path, {table: _table_rows(conn, table, columns)
+                                         for table, columns in SNAPSHOT_TABLES.items()})
+    finally:
+        conn.rollback()
+        conn.isolation_level, conn.readonly = isolation_level, readonly
+
+    counts = ", ".join(f"{info['rows']} {table}" for table, info in manifest['tables'].items())
+    print(f"Snapshot written to {path}: {counts} in {time.perf_counter() - start:.2f}s", flush=True)
+    return manifest
+
+
+# --- Reading ---
+
+class Snapshot:
+    """Read-only view of an exported snapshot. Arrays are memory-mapped on
+    first access, so only the columns an analysis touches are paged in."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {self.manifest.get('version')} in {path}")
+        self._arrays = {}
+        self._dictionaries = {}
+
+    def rows(self, table):
+        return self.manifest['tables'][table]['rows']
+
+    def column(self, table, column):
+        """The raw column array: codes for text columns, values otherwise."""
+        key = (table, column)
+        if key not in self._arrays:
+            self._arrays[key] = np.load(os.path.join(self.path, f"{table}.{column}.npy"), mmap_mode='r')
+        return self._arrays[key]
+
+    def dictionary(self, table, column):
+        """The distinct values of a text column, indexed by code."""
+        key = (table, column)
+        if key not in self._dictionaries:
+            with open(os.path.join(self.path, f"{table}.{column}.dict.json")) as f:
+                self._dictionaries[key] = json.load(f)
+        return self._dictionaries[key]
+
+    def code_mask(self, table, column, predicate):
+        """Boolean array over the dictionary (plus a trailing False for NULL),
+        so mask[codes] evaluates predicate for every row at once."""
+        return np.array([bool(predicate(v)) for v in self.dictionary(table, column)] + [False])
+
+    def values(self, table, column, indices=None):
+        """Decodes a column (optionally just the rows at indices) to Python values, None for NULL."""
+        data = self.column(table, column)
+        if indices is not None:
+            data = data[indices]
+        kind = self.manifest['tables'][table]['columns'][column]
+        if kind == 'str':
+            lookup = self.dictionary(table, column) + [None]
+            return [lookup[code] for code in data.tolist()]
+        if kind == 'float':
+            return [None if v != v else v for v in data.tolist()]
+        if kind == 'int':
+            return [None if v == NULL_INT else v for v in data.tolist()]
+        return data.tolist()
+
+    def summary(self):
+        counts = ", ".join(f"{info['rows']} {table}" for table, info in self.manifest['tables'].items())
+        return f"snapshot {self.path} exported {self.manifest['exported_at']}: {counts}"
+
+
+# --- Analyses over a snapshot ---
+
+def load_snapshot_dataset(snapshot):
+    """The AnalysisDataset load_analysis_dataset would build, read from a snapshot."""
+    start = time.perf_counter()
+    planning = snapshot.code_mask('applications', 'application_type',
+                                  lambda t: t in PLANNING_APPLICATION_TYPES)
+    indices = np.flatnonzero(planning[snapshot.column('applications', 'application_type')])
+
+    keys = [key for _, key in PROJECTED_FIELDS] + ['location']
+    columns = [column for column, _ in PROJECTED_FIELDS] + ['location']
+    field_values = [snapshot.values('applications', column, indices) for column in columns]
+    rows = zip(snapshot.values('applications', 'id', indices),
+               snapshot.values('applications', 'lpa', indices),
+               snapshot.values('applications', 'decision', indices),
+               snapshot.values('applications', 'registration_date', indices),
+               ({key: value for key, value in zip(keys, values) if value is not None}
+                for values in zip(*field_values)))
+    dataset = build_analysis_dataset(rows)
+    # Snapshots exported before agent_aliases existed fall back to building the map
+    if 'agent_aliases' in snapshot.manifest['tables']:
+        dataset.agent_aliases = {email: agent for email, agent in
+                                 zip(snapshot.values('agent_aliases', 'email'),
+                                     snapshot.values('agent_aliases', 'agent'))
+                                 if agent is not None}
+    dataset.load_seconds = time.perf_counter() - start
+    record_span("analysis.load_dataset", dataset.load_seconds, items=len(dataset.apps), source="snapshot")
+    return dataset
+
+
+def _invalid_application_mask(snapshot):
+    # decision_category = 'invalid', as the SQL analyses filter, classified once per distinct decision
+    mask = snapshot.code_mask('applications', 'decision', lambda d: classify_decision(d) == 'invalid')
+    return mask[snapshot.column('applications', 'decision')]
+
+
+def _lpa_codes(snapshot, table):
+    """The table's lpa column re-coded into the applications lpa dictionary (-2 if absent)."""
+    app_codes = {lpa: i for i, lpa in enumerate(snapshot.dictionary('applications', 'lpa'))}
+    app_codes[None] = NULL_CODE
+    recode = np.array([app_codes.get(lpa, -2) for lpa in snapshot.dictionary(table, 'lpa')] + [NULL_CODE])
+    return recode[snapshot.column(table, 'lpa')]
+
+
+def _row_keys(ids, lpa_codes):
+    # (id, lpa) packed into one int64 so joins become set membership tests
+    return (lpa_codes.astype(np.int64) + 2) * (1 << 33) + (ids.astype(np.int64) + 1)
+
+
+def detailed_failures(snapshot, categories=30, notes_per_category=5):
+    """analyze_detailed_failures computed from a snapshot."""
+    invalid = _invalid_application_mask(snapshot)
+    app_keys = _row_keys(snapshot.column('applications', 'id'), _lpa_codes(snapshot, 'applications'))
+    cond_keys = _row_keys(snapshot.column('conditions', 'app_id'), _lpa_codes(snapshot, 'conditions'))
+    selected = np.isin(cond_keys, app_keys[invalid])
+
+    short_codes = snapshot.column('conditions', 'short_desc')[selected].astype(np.int64)
+    note_codes = snapshot.column('conditions', 'clean_note')[selected].astype(np.int64)
+    pairs, counts = np.unique(np.stack([short_codes, note_codes]), axis=1, return_counts=True)
+
+    shorts = snapshot.dictionary('conditions', 'short_desc') + [None]
+    notes = snapshot.dictionary('conditions', 'clean_note') + [None]
+    # Count notes by their near-duplicate cluster (snapshots from before note_clusters count them exactly)
+    if 'note_clusters' in snapshot.manifest['tables']:
+        clusters = dict(zip(snapshot.values('note_clusters', 'note'), snapshot.values('note_clusters', 'cluster')))
+        notes = [clusters.get(note, note) for note in notes]
+    by_category = {}
+    for short_code, note_code, n in zip(pairs[0].tolist(), pairs[1].tolist(), counts.tolist()):
+        note = notes[note_code] or GENERIC_NOTE
+        category = by_category.setdefault(shorts[short_code], {})
+        category[note] = category.get(note, 0) + n
+
+    totals = {category: sum(note_counts.values()) for category, note_counts in by_category.items()}
+    ranked = sorted(totals, key=lambda c: (-totals[c], c is None, c or ''))[:categories]
+    rows = []
+    for rank, category in enumerate(ranked, 1):
+        note_counts = by_category[category]
+        for note in sorted(note_counts, key=lambda n: (-note_counts[n], n))[:notes_per_category]:
+            rows.append((rank, category, totals[category], note, note_counts[note]))
+    return report_detailed_failures(rows)
+
+
+def spread(snapshot):
+    """analyze_spread computed from a snapshot.
+
+    Conditions are joined to invalid applications on app_id alone, as the SQL
+    version does, so a condition counts once per invalid application with
+    that id in any LPA."""
+    invalid_ids = snapshot.column('applications', 'id')[_invalid_application_mask(snapshot)]
+    ids, per_id = np.unique(invalid_ids, return_counts=True)
+    app_ids = np.asarray(snapshot.column('conditions', 'app_id'))
+    multiplicity = np.zeros(len(app_ids), dtype=np.int64)
+    if len(ids):
+        positions = np.minimum(np.searchsorted(ids, app_ids), len(ids) - 1)
+        found = ids[positions] == app_ids
+        multiplicity[found] = per_id[positions[found]]
+
+    short_codes = snapshot.column('conditions', 'short_desc').astype(np.int64) + 1
+    freq = np.bincount(short_codes, weights=multiplicity,
+                       minlength=len(snapshot.dictionary('conditions', 'short_desc')) + 1)
+    reasons = [None] + snapshot.dictionary('conditions', 'short_desc')
+    rows = [(reasons[code], int(n)) for code, n in enumerate(freq.tolist()) if n]
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return report_spread(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or inspect a columnar analysis snapshot")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the database to a snapshot directory")
+    export_parser.add_argument("path")
+    info_parser = subparsers.add_parser("info", help="Describe an existing snapshot")
+    info_parser.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        import main
+        main.setup_database()
+        connection = main.get_db_connection()
+        try:
+            export_snapshot(connection, args.path)
+        finally:
+            connection.close()
+    else:
+        print(Snapshot(args.path).summary())
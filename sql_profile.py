@@ -0,0 +1,353 @@
+"""
+Opt-in SQL profiling: where the database time goes, statement by statement.
+
+Once enable() has been called (main.py --profile-sql, backfill_geom.py
+--profile-sql), connect() returns connections whose cursors, whatever their
+cursor_factory, time every execute, executemany and copy_expert. Calls are
+grouped under the statement's template: its text with literals replaced by
+?, lists of values collapsed and whitespace normalised, so the pages of an
+execute_values or a query built per row show up as one statement:
+
+  SELECT id FROM documents WHERE app_id = ? AND lpa = ? AND filename = ?
+
+Each template accumulates calls, total and slowest seconds, rows (rowcount,
+or the rows fetched from a named cursor, whose fetches also count towards
+its time) and errors, and keeps the bound SQL of its slowest call.
+write_report ranks the templates by total time, runs EXPLAIN (ANALYZE,
+BUFFERS) on the slowest call of the top ones in a transaction that is rolled
+back, and flags sequential scans and statements run once per row (an N+1
+pattern), writing out/sql_profile.json and a readable out/sql_profile.txt.
+"""
+
+import functools
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+# Statements explained by write_report, by total time
+EXPLAIN_LIMIT = 10
+# A statement called at least this often, averaging under REPEATED_MEAN_SECONDS, is probably run per row
+REPEATED_CALLS = 100
+REPEATED_MEAN_SECONDS = 0.005
+# Statements EXPLAIN can run (DDL, COPY, ANALYZE, ... cannot be explained)
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "VALUES")
+
+_lock = threading.Lock()
+_state = {"enabled": False}
+_statements = {}
+
+
+class _StatementStats:
+    __slots__ = ("calls", "seconds", "max_seconds", "rows", "errors", "sample")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.sample = None
+
+
+def enable():
+    """Profiles the cursors of every connection connect() opens from now on."""
+    _state["enabled"] = True
+
+
+def is_enabled():
+    return _state["enabled"]
+
+
+def reset():
+    """Clears every recorded statement."""
+    with _lock:
+        _statements.clear()
+
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w$])\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PARAMETER_RE = re.compile(r"%(?:\(\w+\))?s")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_LISTS_RE = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_ARRAY_RE = re.compile(r"ARRAY\[[^\]]*\]", re.IGNORECASE)
+
+
+# Templates of statements up to this long are memoised
+_CACHED_LENGTH = 4096
+
+
+def statement_template(query):
+    """query with its literals and parameters as ?, value lists as (...)
+    and whitespace collapsed."""
+    # Long statements (a page of execute_values) are rarely repeated verbatim
+    if len(query) > _CACHED_LENGTH:
+        return _template(query)
+    return _cached_template(query)
+
+
+def _template(query):
+    template = _STRING_RE.sub("?", query)
+    template = _PARAMETER_RE.sub("?", template)
+    template = _NUMBER_RE.sub("?", template)
+    template = _ARRAY_RE.sub("ARRAY[...]", template)
+    template = _LIST_RE.sub("(...)", template)
+    template = _LISTS_RE.sub("(...), ...", template)
+    return " ".join(template.split())
+
+
+_cached_template = functools.lru_cache(maxsize=4096)(_template)
+
+
+def _record(template, seconds, rows=0, error=False, calls=1, sample=None, call_seconds=None):
+    # call_seconds: the whole call's time so far, when seconds is only part of it (a fetch)
+    call_seconds = seconds if call_seconds is None else call_seconds
+    with _lock:
+        stats = _statements.get(template)
+        if stats is None:
+            stats = _statements[template] = _StatementStats()
+        stats.calls += calls
+        stats.seconds += seconds
+        stats.rows += rows
+        stats.errors += error
+        if sample is not None and call_seconds >= stats.max_seconds:
+            stats.max_seconds = call_seconds
+            stats.sample = sample() if callable(sample) else sample
+
+
+class _ProfilingCursor:
+    """Mixed in before a cursor class to time its statements."""
+
+    _profile_template = None
+    _profile_sample = None
+    _profile_seconds = 0.0
+
+    def _profiled(self, run, query, vars):
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        template = statement_template(text)
+        start = time.perf_counter()
+        error = False
+        try:
+            return run()
+        except BaseException:
+            error = True
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            # Bound lazily: only the slowest call's SQL is kept
+            sample = functools.partial(self._bound, text, vars)
+            self._profile_template, self._profile_sample, self._profile_seconds = template, sample, seconds
+            _record(template, seconds, 0 if error else max(self.rowcount, 0), error, sample=sample)
+
+    def _bound(self, text, vars):
+        if not isinstance(vars, (tuple, list, dict)):
+            return text
+        try:
+            return self.mogrify(text, vars).decode()
+        except (psycopg2.Error, TypeError, ValueError):
+            return text
+
+    def execute(self, query, vars=None):
+        execute = super().execute
+        return self._profiled(lambda: execute(query, vars), query, vars)
+
+    def executemany(self, query, vars_list):
+        executemany = super().executemany
+        # The bound SQL of one call stands for the whole batch
+        return self._profiled(lambda: executemany(query, vars_list), query, None)
+
+    def copy_expert(self, sql, file, size=8192):
+        copy_expert = super().copy_expert
+        return self._profiled(lambda: copy_expert(sql, file, size), sql, None)
+
+    # A named cursor's statement runs as its rows are fetched
+    def _fetched(self, start, rows):
+        if self.name is not None and self._profile_template is not None:
+            seconds = time.perf_counter() - start
+            self._profile_seconds += seconds
+            _record(self._profile_template, seconds, rows, calls=0, sample=self._profile_sample,
+                    call_seconds=self._profile_seconds)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __iter__(self):
+        if self.name is None:
+            return iter(super().fetchone, None)
+        return self._iter_named()
+
+    def _iter_named(self):
+        while True:
+            start = time.perf_counter()
+            rows = super().fetchmany(self.itersize)
+            self._fetched(start, len(rows))
+            if not rows:
+                return
+            yield from rows
+
+
+@functools.lru_cache(maxsize=None)
+def _profiling_class(cursor_class):
+    return type(f"Profiling{cursor_class.__name__}", (_ProfilingCursor, cursor_class), {})
+
+
+class ProfilingConnection(psycopg2.extensions.connection):
+    """A connection whose cursors, of any cursor_factory, are profiled."""
+
+    def cursor(self, *args, **kwargs):
+        cursor_class = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs["cursor_factory"] = _profiling_class(cursor_class)
+        return super().cursor(*args, **kwargs)
+
+
+def connect(dsn):
+    """psycopg2.connect(dsn), profiled once enable() has been called."""
+    if _state["enabled"]:
+        return psycopg2.connect(dsn, connection_factory=ProfilingConnection)
+    return psycopg2.connect(dsn)
+
+
+def take():
+    """The statements recorded so far, cleared; for a worker process to
+    hand back to the parent's merge()."""
+    with _lock:
+        taken = {template: (s.calls, s.seconds, s.max_seconds, s.rows, s.errors, s.sample)
+                 for template, s in _statements.items()}
+        _statements.clear()
+    return taken
+
+
+def merge(taken):
+    """Adds statements recorded elsewhere (see take())."""
+    with _lock:
+        for template, (calls, seconds, max_seconds, rows, errors, sample) in taken.items():
+            stats = _statements.get(template)
+            if stats is None:
+                stats = _statements[template] = _StatementStats()
+            stats.calls += calls
+            stats.seconds += seconds
+            stats.rows += rows
+            stats.errors += errors
+            if max_seconds >= stats.max_seconds:
+                stats.max_seconds = max_seconds
+                stats.sample = sample
+
+
+def statements():
+    """Every recorded statement, by total time descending."""
+    with _lock:
+        entries = [{
+            "template": template,
+            "calls": s.calls,
+            "seconds": s.seconds,
+            "mean_seconds": s.seconds / s.calls if s.calls else None,
+            "max_seconds": s.max_seconds,
+            "rows": s.rows,
+            "errors": s.errors,
+            "sample": s.sample,
+        } for template, s in _statements.items()]
+    entries.sort(key=lambda entry: (-entry["seconds"], entry["template"]))
+    return entries
+
+
+def explain(conn, sql):
+    """The EXPLAIN (ANALYZE, BUFFERS) plan of sql, which is executed in a
+    transaction on conn that is then rolled back."""
+    # A plain cursor, so the EXPLAIN itself is not profiled
+    cur = psycopg2.extensions.cursor(conn)
+    try:
+        cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+        return "\n".join(line for (line,) in cur.fetchall())
+    finally:
+        cur.close()
+        conn.rollback()
+
+
+_SEQ_SCAN_RE = re.compile(r"Seq Scan on (\w+)")
+
+
+def _flags(entry):
+    flags = []
+    if (entry["calls"] >= REPEATED_CALLS and entry["mean_seconds"] is not None
+            and entry["mean_seconds"] < REPEATED_MEAN_SECONDS):
+        flags.append("repeated: run once per row? (N+1)")
+    for table in dict.fromkeys(_SEQ_SCAN_RE.findall(entry.get("plan") or "")):
+        flags.append(f"seq scan on {table}")
+    return flags
+
+
+def report(conn=None, explain_limit=EXPLAIN_LIMIT):
+    """The ranked profile: every statement by total time, with its share of
+    the profiled time and flags, and for the explain_limit slowest the plan
+    of their slowest call, if conn is given."""
+    entries = statements()
+    total = sum(entry["seconds"] for entry in entries)
+    for rank, entry in enumerate(entries, 1):
+        entry["rank"] = rank
+        entry["share"] = entry["seconds"] / total if total else 0.0
+        entry["plan"] = None
+        if conn is not None and rank <= explain_limit and entry["sample"] \
+                and entry["template"].split(None, 1)[0].upper() in _EXPLAINABLE:
+            try:
+                entry["plan"] = explain(conn, entry["sample"])
+            except psycopg2.Error as e:
+                entry["plan_error"] = str(e).strip()
+        entry["flags"] = _flags(entry)
+    return {"generated": datetime.now().isoformat(), "seconds": total, "statements": entries}
+
+
+def report_text(data, limit=30):
+    """data (a report) as a ranked table followed by the captured plans."""
+    lines = [f"SQL profile {data['generated']}: {len(data['statements'])} statements, "
+             f"{data['seconds']:.2f}s in total", "",
+             f"{'#':>3} {'Total s':>9} {'Share':>6} {'Calls':>8} {'Mean ms':>9} {'Max ms':>9} {'Rows':>10}  Statement"]
+    for entry in data["statements"][:limit]:
+        lines.append(f"{entry['rank']:>3} {entry['seconds']:>9.3f} {entry['share']:>6.1%} {entry['calls']:>8} "
+                     f"{entry['mean_seconds'] * 1000:>9.2f} {entry['max_seconds'] * 1000:>9.2f} "
+                     f"{entry['rows']:>10}  {entry['template'][:120]}")
+        for flag in entry["flags"]:
+            lines.append(f"{'':>60}  ! {flag}")
+    for entry in data["statements"]:
+        if entry["plan"] or entry.get("plan_error"):
+            lines += ["", f"--- #{entry['rank']}: {entry['template']}",
+                      entry["plan"] or f"(not explained: {entry['plan_error']})"]
+    return "\n".join(lines) + "\n"
+
+
+def _replace(path, text):
+    with open(path + ".tmp", 'w') as f:
+        f.write(text)
+    os.replace(path + ".tmp", path)
+
+
+def write_report(out_dir="out", conn=None, explain_limit=EXPLAIN_LIMIT):
+    """Writes the report to out_dir/sql_profile.json and out_dir/sql_profile.txt
+    and prints its top statements. Returns the report."""
+    data = report(conn, explain_limit)
+    os.makedirs(out_dir, exist_ok=True)
+    _replace(os.path.join(out_dir, "sql_profile.json"), json.dumps(data, indent=2))
+    text = report_text(data)
+    _replace(os.path.join(out_dir, "sql_profile.txt"), text)
+    print("\n" + "\n".join(text.splitlines()[:13]), flush=True)
+    print(f"SQL profile written to {out_dir}/sql_profile.json and {out_dir}/sql_profile.txt", flush=True)
+    return data
@@ -0,0 +1,525 @@
+"""
+Synthetic planning data for scale testing.
+
+generate() produces a seeded stream of applications across the four LPAs,
+in the shapes the sync stores: each application's raw_json as the Agile API
+returns it, and its documents and conditions as the API (or, for Dublin City
+and South Dublin, the portal parsers) return them. The data has what the
+analyses look for:
+
+  - practices lodging under spelling variants of their name, from a few
+    staff emails at a shared domain or from one free-mail address
+  - INVALID decisions whose conditions carry notes in recurring,
+    near-duplicate wordings, among grants, refusals, pending and admin records
+  - applicants who re-apply after an invalidation at the same site (a few
+    metres away) weeks or months later, often through another agent
+
+It is loaded into Postgres with batched COPY, or written straight to the
+snapshot format (see snapshot.py) without a database:
+
+  python synthetic_data.py postgres --applications 1000000 [--seed 1] [--first-id 1]
+  python synthetic_data.py snapshot out/synthetic --applications 1000000
+  python main.py --analyze-only --snapshot out/synthetic
+
+The same seed, size and first id always give the same data. Application ids
+run from first_id, so load into a database without applications of its own
+(or pick a first id above theirs). geom is left for backfill_geom.py to fill
+from grid_x/grid_y.
+"""
+
+import argparse
+import bisect
+import concurrent.futures
+import io
+import json
+import random
+import re
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+
+from shared_utils import PROJECTED_FIELDS, PROJECTED_NUMERIC_COLUMNS, classify_decision, clean_note
+
+API_BASE_URL = "https://planningapi.agileapplications.ie/api"
+
+FIRST_DATE = date(2018, 1, 1)
+LAST_DATE = date(2025, 12, 31)
+
+# LPA -> (share of applications, ITM centre, reference format, Agile client code)
+LPA_PROFILES = {
+    "dunlaoghaire": (0.20, (722000, 726000), "D{yy}A/{seq:04d}", "DLR"),
+    "fingal": (0.25, (715000, 744000), "F{yy}A/{seq:04d}", "FCC"),
+    "dublincity": (0.35, (715500, 734000), "{seq:04d}/{yy}", None),
+    "southdublin": (0.20, (705000, 727000), "SD{yy}A/{seq:04d}", None),
+}
+# Metres either side of an LPA's centre its areas lie within, and of an area's centre its sites
+LPA_SPREAD = 4000
+AREA_SPREAD = 1200
+# Metres a re-application's coordinates move from the invalidated one's
+REAPPLY_JITTER = 15
+
+AREAS = ["Dalkey", "Blackrock", "Stillorgan", "Sandyford", "Swords", "Malahide", "Balbriggan",
+         "Howth", "Rathmines", "Drumcondra", "Phibsborough", "Clontarf", "Tallaght", "Lucan",
+         "Clondalkin", "Rathfarnham", "Terenure", "Glasnevin", "Cabinteely", "Castleknock"]
+STREETS = ["Main Street", "Church Road", "Seafield Avenue", "Mount Anville Park", "Strand Road",
+           "Castle Court", "Station Road", "Kilmacud Road Upper", "Orchard Lane", "Willow Grove",
+           "Sycamore Drive", "Beech Park", "Harbour Road", "College Green", "Meadow Vale",
+           "Abbey Street", "Green Lane", "Convent Road", "Priory Walk", "Woodbine Avenue"]
+FORENAMES = ["Mary", "John", "Aoife", "Sean", "Patrick", "Siobhan", "Ciara", "Michael", "Niamh",
+             "Declan", "Orla", "Brian", "Sinead", "Conor", "Emma", "David", "Grainne", "Eoin",
+             "Catherine", "Padraig", "Fiona", "Kevin", "Roisin", "Liam", "Deirdre", "Colm",
+             "Sarah", "Darragh", "Maeve", "Ronan"]
+SURNAMES = ["Murphy", "Kelly", "Byrne", "Ryan", "O'Sullivan", "Walsh", "O'Brien", "Doyle",
+            "McCarthy", "Gallagher", "Kennedy", "Lynch", "Murray", "Quinn", "Moore", "McLoughlin",
+            "O'Carroll", "Connolly", "Daly", "O'Connell", "Wilson", "Dunne", "Brennan", "Burke",
+            "Collins", "Campbell", "Clarke", "Johnston", "Hughes", "Farrell", "Fitzgerald", "Brown",
+            "Martin", "Maguire", "Nolan", "Flynn", "Thompson", "Callaghan", "O'Donnell", "Duffy",
+            "Mahony", "Boyle", "Healy", "Shea", "White", "Sweeney", "Hayes", "Kavanagh", "Power",
+            "McGrath", "Moran", "Brady", "Stewart", "Casey", "Foley", "Fitzpatrick", "Leary",
+            "McDonnell", "MacMahon", "Donnelly"]
+PRACTICE_FORMATS = ["{a} {b} Architects", "{a} & Associates", "{a} Planning Consultants",
+                    "{a} Design", "{a} {b} Architecture", "{a} Building Surveyors"]
+FREE_MAIL_DOMAINS = ["gmail.com", "eircom.net", "hotmail.com", "yahoo.ie"]
+WORKS = ["Single storey extension to the rear of", "Two storey extension to the side of",
+         "Demolition of existing garage and construction of a dwelling at",
+         "Attic conversion with dormer window to the rear of", "Widening of vehicular entrance at",
+         "Change of use from retail to residential at", "Construction of 24 apartments at",
+         "Garden room to the rear of", "Replacement windows and external insulation at",
+         "Construction of a 2 storey detached house in the side garden of"]
+RETENTION_WORKS = ["Retention of a timber shed to the rear of", "Retention of alterations to the front elevation of",
+                   "Retention of a boundary wall at"]
+
+# (applicationType, share); types outside PLANNING_APPLICATION_TYPES are admin records
+APPLICATION_TYPES = [("Permission", 70), ("Permission and Retention", 6), ("Retention", 6),
+                     ("Outline Permission", 1), ("Permission (LRD)", 1),
+                     ("Compliance", 8), ("Section 5 Declaration", 5), ("Extension of Duration", 3)]
+ADMIN_DECISIONS = {"Compliance": "COMPLIANCE ACCEPTABLE", "Section 5 Declaration": "EXEMPTED DEVELOPMENT",
+                   "Extension of Duration": "Extension of Duration GRANTED"}
+# (decisionText, share) of planning applications; None is still pending
+DECISIONS = [("GRANT PERMISSION", 52), ("REFUSE PERMISSION", 9), ("GRANT RETENTION", 4),
+             ("SPLIT DECISION", 2), ("WITHDRAWN", 3), ("DECLARE APPLICATION INVALID", 9),
+             ("Invalid Application", 4), (None, 17)]
+
+# Invalidation reasons (conditions' shortPrescription) and the notes they come with
+INVALID_NOTES = {
+    "Site Notice": ["Site notice not erected at {location}", "site notice not legible from the public road",
+                    "Site notice not displayed in a conspicuous position"],
+    "Newspaper Notice": ["Newspaper notice published {days} days before lodgement, outside the two week period",
+                         "newspaper notice does not refer to the retention element",
+                         "Newspaper is not on the approved list"],
+    "Fee": ["Incorrect fee of EUR {fee} lodged", "No fee received with the application"],
+    "Drawings": ["drawings not to scale", "Elevations of adjoining buildings not shown",
+                 "No site layout plan submitted"],
+    "Site Location Map": ["Site not outlined in red on the site location map",
+                          "Site location map not at 1:1000 scale"],
+    "Public Notice": ["Public notice does not state the nature and extent of the development"],
+}
+STANDARD_CONDITIONS = ["Compliance with plans", "Development Contributions", "Surface Water",
+                       "Hours of Work", "Residential Amenity", "Landscaping"]
+DOCUMENT_DESCRIPTIONS = ["Application Form", "Site Notice", "Newspaper Notice", "Site Location Map",
+                         "Drawings", "Planning Report", "Cover Letter", "Photographs", "Letter of Consent"]
+
+# Share of applications: lodged without an agent, without coordinates, invalidations
+# re-applied for, re-applications through another practice
+NO_AGENT = 0.12
+NO_COORDINATES = 0.05
+REAPPLY = 0.65
+AGENT_CHANGE = 0.45
+
+APPLICATION_COLUMNS = ("id", "lpa", "reference", "registration_date", "description", "raw_json",
+                       "location", "decision", "decision_category", "status", "grid_x", "grid_y",
+                       "last_hydrated_at")
+DOCUMENT_COLUMNS = ("app_id", "lpa", "filename", "document_hash", "raw_json", "doc_id", "description",
+                    "media_description", "received_date", "media_id", "download_url")
+CONDITION_COLUMNS = ("app_id", "lpa", "order_num", "short_desc", "long_desc", "code", "code_desc",
+                     "complied_id", "complied_desc", "complied_date", "raw_json", "clean_note")
+
+
+class _Weighted:
+    """Picks from (value, weight) pairs."""
+
+    def __init__(self, pairs):
+        self.values = [value for value, _ in pairs]
+        self.cumulative = list(accumulate(weight for _, weight in pairs))
+
+    def pick(self, rng):
+        return self.values[bisect.bisect_right(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def _iso(day):
+    return f"{day.isoformat()}T00:00:00"
+
+
+class _Generator:
+    def __init__(self, seed, first_id, practices):
+        self.rng = rng = random.Random(seed)
+        self.next_id = first_id
+        self.next_file_id = 100000
+        self.references = {}
+        self.lpas = _Weighted([(lpa, profile[0]) for lpa, profile in LPA_PROFILES.items()])
+        self.types = _Weighted(APPLICATION_TYPES)
+        self.decisions = _Weighted(DECISIONS)
+        self.areas = {}
+        for lpa, (_, (x, y), _, _) in LPA_PROFILES.items():
+            self.areas[lpa] = [(area, x + rng.uniform(-LPA_SPREAD, LPA_SPREAD), y + rng.uniform(-LPA_SPREAD, LPA_SPREAD))
+                               for area in rng.sample(AREAS, 6)]
+        domains = set()
+        self.practices = [self._practice(domains) for _ in range(practices)]
+
+    def _practice(self, domains):
+        rng = self.rng
+        a, b = rng.choice(SURNAMES), rng.choice(SURNAMES)
+        name = rng.choice(PRACTICE_FORMATS).format(a=a, b=b)
+        slug = re.sub(r'[^a-z]', '', (a + b).lower())
+        staff = rng.sample(FORENAMES, rng.randint(1, 4))
+        if rng.random() < 0.7:
+            domain = f"{slug}.ie"
+            if domain in domains:
+                domain = f"{slug}{len(domains)}.ie"
+            domains.add(domain)
+            emails = [f"info@{domain}"] + [f"{forename.lower()}@{domain}" for forename in staff]
+        else:
+            emails = [f"{slug}{rng.randint(1, 999)}@{rng.choice(FREE_MAIL_DOMAINS)}"]
+        phone = f"01 {rng.randint(2000000, 2999999)}" if rng.random() < 0.7 else f"08{rng.randint(5, 7)} {rng.randint(1000000, 9999999)}"
+        return {"name": name, "emails": emails, "staff": staff, "surname": a, "phone": phone}
+
+    def _agent_fields(self, practice):
+        rng = self.rng
+        name = practice["name"]
+        r = rng.random()
+        if r < 0.12:
+            name = name.upper()
+        elif r < 0.2:
+            name = name + " Ltd"
+        elif r < 0.25:
+            name = name.replace(" Architects", " Archs").replace("&", "and")
+        elif r < 0.28:
+            name = name.lower() + " "
+        email = rng.choice(practice["emails"])
+        r = rng.random()
+        if r < 0.06:
+            email = email.capitalize()
+        elif r < 0.08:
+            email = email + " "
+        fields = {"agentSurname": name, "agentName": name, "agentEmail": email,
+                  "agentTelephoneNumber": practice["phone"]}
+        if rng.random() < 0.15:
+            fields["agentContactName"] = f"{rng.choice(practice['staff'])} {practice['surname']}"
+        return fields
+
+    def _practice_index(self):
+        # Skewed, so a few practices lodge a large share of the applications
+        return int(len(self.practices) * self.rng.random() ** 2.5)
+
+    def _reference(self, lpa, day):
+        key = (lpa, day.year)
+        seq = self.references[key] = self.references.get(key, 0) + 1
+        return LPA_PROFILES[lpa][2].format(yy=f"{day.year % 100:02d}", seq=seq)
+
+    def application(self, lpa=None, day=None, previous=None):
+        """A new application, or with previous (an invalidated one) its re-application."""
+        rng = self.rng
+        app_id = self.next_id
+        self.next_id += 1
+        if previous is None:
+            lpa = self.lpas.pick(rng)
+            day = FIRST_DATE + timedelta(days=rng.randrange((LAST_DATE - FIRST_DATE).days + 1))
+            area, x, y = rng.choice(self.areas[lpa])
+            location = f"{rng.randint(1, 250)} {rng.choice(STREETS)}, {area}, Co. Dublin"
+            if rng.random() < 0.1:
+                applicant = {"applicantForename": "",
+                             "applicantSurname": f"{rng.choice(SURNAMES)} {rng.choice(['Developments', 'Homes'])} Ltd"}
+            else:
+                applicant = {"applicantForename": rng.choice(FORENAMES), "applicantSurname": rng.choice(SURNAMES)}
+            coords = None
+            if rng.random() >= NO_COORDINATES:
+                coords = (round(x + rng.uniform(-AREA_SPREAD, AREA_SPREAD), 1),
+                          round(y + rng.uniform(-AREA_SPREAD, AREA_SPREAD), 1))
+            practice = None if rng.random() < NO_AGENT else self._practice_index()
+            app_type = self.types.pick(rng)
+        else:
+            location = previous["location"]
+            if rng.random() < 0.2:
+                location = rng.choice(["No. ", "Site at "]) + location
+            applicant = {"applicantForename": previous["applicantForename"],
+                         "applicantSurname": previous["applicantSurname"]}
+            coords = None
+            if "easting" in previous:
+                coords = (round(previous["easting"] + rng.uniform(-REAPPLY_JITTER, REAPPLY_JITTER), 1),
+                          round(previous["northing"] + rng.uniform(-REAPPLY_JITTER, REAPPLY_JITTER), 1))
+            practice = previous["_practice"]
+            if practice is None or rng.random() < AGENT_CHANGE:
+                practice = self._practice_index()
+            app_type = previous["applicationType"]
+
+        if app_type in ADMIN_DECISIONS:
+            decision = ADMIN_DECISIONS[app_type]
+        else:
+            decision = self.decisions.pick(rng)
+        works = rng.choice(RETENTION_WORKS if "Retention" in app_type else WORKS)
+        app = {
+            "id": app_id,
+            "reference": self._reference(lpa, day),
+            "applicationType": app_type,
+            "registrationDate": _iso(day),
+            "receivedDate": _iso(day - timedelta(days=rng.randint(0, 5))),
+            "proposal": f"{works} {location}",
+            "location": location,
+            "status": "Decided" if decision else rng.choice(["New Application", "Further Information Requested"]),
+            "decisionText": decision,
+            "decisionDate": _iso(day + timedelta(days=rng.randint(5, 56))) if decision else None,
+            **applicant,
+        }
+        if coords:
+            app["easting"], app["northing"] = coords
+            app["gridReference"] = f"{coords[0]}, {coords[1]}"
+        if practice is not None:
+            app.update(self._agent_fields(self.practices[practice]))
+        # Kept for the re-application, not part of the record
+        app["_practice"] = practice
+        return lpa, day, app
+
+    def documents(self, lpa, day, app, invalid):
+        rng = self.rng
+        docs = []
+        for n in range(rng.randint(2, 4) if invalid else rng.randint(3, 8)):
+            description = DOCUMENT_DESCRIPTIONS[n] if n < 5 else rng.choice(DOCUMENT_DESCRIPTIONS[5:])
+            received = _iso(day - timedelta(days=rng.randint(0, 3)))
+            if lpa == "dublincity":
+                guid = f"{rng.getrandbits(128):032X}"
+                guid = f"{guid[:8]}-{guid[8:12]}-{guid[12:16]}-{guid[16:20]}-{guid[20:]}"
+                doc = {"documentHash": guid, "description": description,
+                       "name": f"{app['reference']} {description}", "receivedDate": received}
+                url = f"https://webapps.dublincity.ie/PublicAccess_Live/Document/ViewDocument?id={guid}"
+            elif lpa == "southdublin":
+                file_id = str(self.next_file_id)
+                self.next_file_id += 1
+                doc = {"documentHash": file_id, "documentId": file_id, "description": description,
+                       "name": description, "receivedDate": received}
+                url = f"https://planning.southdublin.ie/Home/ViewDocument?fileId={file_id}"
+            else:
+                doc_hash = f"{rng.getrandbits(128):032x}"
+                media_id = rng.randint(1, 9999999)
+                doc = {"documentId": media_id, "documentHash": doc_hash, "name": f"{description}.pdf",
+                       "originalFileName": f"{description.replace(' ', '_')}.pdf", "description": description,
+                       "mediaDescription": "PDF", "receivedDate": received, "mediaId": media_id}
+                url = f"{API_BASE_URL}/application/document/{LPA_PROFILES[lpa][3]}/{doc_hash}"
+            docs.append((doc, url))
+        return docs
+
+    def conditions(self, app, invalid):
+        rng = self.rng
+        conds = []
+        if invalid:
+            for order, reason in enumerate(rng.sample(list(INVALID_NOTES), rng.randint(1, 3)), 1):
+                text = (f"The application is invalid under Article {rng.choice([19, 22, 23, 26])} "
+                        f"of the Planning and Development Regulations 2001, as amended.")
+                if rng.random() < 0.75:
+                    note = rng.choice(INVALID_NOTES[reason]).format(
+                        location=app["location"], days=rng.randint(15, 40), fee=rng.choice([34, 65, 80, 240]))
+                    # The same note in the wordings officers vary it by
+                    r = rng.random()
+                    if r < 0.15:
+                        note = note.lower()
+                    elif r < 0.3:
+                        note = note + "."
+                    elif r < 0.4:
+                        note = "The " + note[0].lower() + note[1:]
+                    text += f"\n{rng.choice(['Note: ', 'NOTE - ', 'Note:'])}{note}"
+                conds.append({"orderNumber": order, "shortPrescription": reason, "longPrescription": text,
+                              "prescriptionCode": "INV", "prescriptionCodeDescription": "Invalidation Reason"})
+        elif app["decisionText"] and "GRANT" in app["decisionText"]:
+            for order, name in enumerate(rng.sample(STANDARD_CONDITIONS, rng.randint(2, 6)), 1):
+                conds.append({"orderNumber": order, "shortPrescription": name,
+                              "longPrescription": f"{name}: the development shall comply with the conditions "
+                                                  f"of this permission. Reason: In the interest of proper planning.",
+                              "prescriptionCode": "STD", "prescriptionCodeDescription": "Standard Condition",
+                              "compliedId": 0, "compliedStatusDescription": "Not Complied"})
+        return conds
+
+
+def generate(applications, seed=1, first_id=1):
+    """
+    Yields applications synthetic applications as (lpa, raw_json, documents,
+    conditions): documents as the (doc, download_url) pairs hydration saves
+    and conditions as the API's applicationPrescriptions. Ids run from
+    first_id. An invalidated application's re-application, if any, follows
+    it directly (its registration date is later).
+    """
+    generator = _Generator(seed, first_id, practices=max(applications // 50, 20))
+    produced = 0
+    previous = None
+    while produced < applications:
+        if previous is not None:
+            lpa, day, app = generator.application(previous[0], previous[1], previous[2])
+        else:
+            lpa, day, app = generator.application()
+        practice = app.pop("_practice")
+        invalid = classify_decision(app["decisionText"]) == "invalid"
+        documents = generator.documents(lpa, day, app, invalid)
+        conditions = generator.conditions(app, invalid)
+        produced += 1
+        yield lpa, app, documents, conditions
+
+        previous = None
+        if invalid and generator.rng.random() < REAPPLY:
+            reapply_day = day + timedelta(days=generator.rng.randint(7, 300))
+            if reapply_day <= LAST_DATE:
+                previous = (lpa, reapply_day, dict(app, _practice=practice))
+
+
+# --- Postgres ---
+
+# COPY reads its buffer in pieces this big, each needing the GIL back from the generating thread
+_COPY_READ_SIZE = 1 << 20
+
+
+def _copy_value(value):
+    # COPY text format: backslash escapes, \N for NULL (str.replace returns
+    # the string itself when there is nothing to replace)
+    if value is None:
+        return '\\N'
+    if value.__class__ is not str:
+        return str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy_line(values):
+    return "\t".join(map(_copy_value, values)) + "\n"
+
+
+def _application_row(lpa, app):
+    # As save_application maps an API record
+    decision = app.get("decisionText")
+    return (app["id"], lpa, app["reference"], app["registrationDate"][:10], app["proposal"], json.dumps(app),
+            app["location"], decision, classify_decision(decision), app["status"],
+            app.get("easting"), app.get("northing"), f"{app['registrationDate'][:10]} 06:00:00")
+
+
+def _document_row(app_id, lpa, doc, download_url):
+    # As save_document_metadata maps one
+    doc_id = str(doc["documentId"]) if doc.get("documentId") else None
+    return (app_id, lpa, doc.get("name") or doc.get("originalFileName"), doc.get("documentHash"), json.dumps(doc),
+            doc_id, doc.get("description"), doc.get("mediaDescription"), doc.get("receivedDate"),
+            doc.get("mediaId"), download_url)
+
+
+def _condition_row(app_id, lpa, cond):
+    # As save_condition_record maps one
+    return (app_id, lpa, cond.get("orderNumber"), cond.get("shortPrescription"), cond.get("longPrescription"),
+            cond.get("prescriptionCode"), cond.get("prescriptionCodeDescription"), cond.get("compliedId"),
+            cond.get("compliedStatusDescription"), cond.get("compliedDate"), json.dumps(cond),
+            clean_note(cond.get("longPrescription")) or '')
+
+
+def load_postgres(conn, applications, seed=1, first_id=1, batch_size=20000):
+    """
+    Loads applications synthetic applications, their documents and their
+    conditions into the database (whose schema must exist, see
+    main.setup_database) with one COPY per table per batch_size
+    applications, committing each batch. A batch is copied in a background
+    thread while the next one is generated, so the server's index updates
+    overlap the generation. Returns the row counts.
+    """
+    start = time.perf_counter()
+    cur = conn.cursor()
+    tables = {"applications": APPLICATION_COLUMNS, "documents": DOCUMENT_COLUMNS, "conditions": CONDITION_COLUMNS}
+    counts = dict.fromkeys(tables, 0)
+
+    def copy(buffers, loaded):
+        # Applications first: documents and conditions reference them
+        for table, columns in tables.items():
+            buffers[table].seek(0)
+            cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffers[table], size=_COPY_READ_SIZE)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        print(f"  {loaded['applications']} applications, {loaded['documents']} documents, "
+              f"{loaded['conditions']} conditions ({loaded['applications'] / elapsed:.0f} applications/s)",
+              flush=True)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        copying = None
+        buffers = {table: io.StringIO() for table in tables}
+        pending = 0
+        for lpa, app, documents, conditions in generate(applications, seed, first_id):
+            buffers["applications"].write(_copy_line(_application_row(lpa, app)))
+            for doc, download_url in documents:
+                buffers["documents"].write(_copy_line(_document_row(app["id"], lpa, doc, download_url)))
+            for cond in conditions:
+                buffers["conditions"].write(_copy_line(_condition_row(app["id"], lpa, cond)))
+            counts["applications"] += 1
+            counts["documents"] += len(documents)
+            counts["conditions"] += len(conditions)
+            pending += 1
+            if pending == batch_size:
+                if copying is not None:
+                    copying.result()
+                copying = executor.submit(copy, buffers, dict(counts))
+                buffers = {table: io.StringIO() for table in tables}
+                pending = 0
+        if copying is not None:
+            copying.result()
+        if pending:
+            copy(buffers, counts)
+
+    for table in tables:
+        cur.execute(f"ANALYZE {table}")
+    conn.commit()
+    print(f"Loaded {counts['applications']} synthetic applications in {time.perf_counter() - start:.1f}s", flush=True)
+    return counts
+
+
+# --- Snapshot ---
+
+def write_synthetic_snapshot(path, applications, seed=1, first_id=1):
+    """Writes the data load_postgres would load as a snapshot (see
+    snapshot.write_snapshot) to path. Returns the manifest."""
+    from snapshot import write_snapshot
+
+    start = time.perf_counter()
+    conditions, documents = [], []
+
+    def application_rows():
+        for lpa, app, docs, conds in generate(applications, seed, first_id):
+            app_id = app["id"]
+            yield (app_id, lpa, app.get("decisionText"), date.fromisoformat(app["registrationDate"][:10]),
+                   app["location"],
+                   *[(value if isinstance(value, (int, float)) else None) if column in PROJECTED_NUMERIC_COLUMNS
+                     else value
+                     for column, value in ((column, app.get(key)) for column, key in PROJECTED_FIELDS)])
+            conditions.extend((app_id, lpa, cond["orderNumber"], cond["shortPrescription"],
+                               clean_note(cond["longPrescription"]) or '') for cond in conds)
+            documents.extend((app_id, lpa, doc.get("description"), doc.get("mediaDescription"),
+                              doc.get("receivedDate"), None) for doc, _ in docs)
+
+    # Tables are written in order, so applications fills the other two first
+    manifest = write_snapshot(path, {"applications": application_rows(), "conditions": conditions,
+                                     "documents": documents})
+    counts = ", ".join(f"{info['rows']} {table}" for table, info in manifest['tables'].items())
+    print(f"Synthetic snapshot written to {path}: {counts} in {time.perf_counter() - start:.1f}s", flush=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic planning data for scale testing")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    postgres_parser = subparsers.add_parser("postgres", help="Load into the database at DATABASE_URL")
+    snapshot_parser = subparsers.add_parser("snapshot", help="Write a snapshot directory")
+    snapshot_parser.add_argument("path")
+    for subparser in (postgres_parser, snapshot_parser):
+        subparser.add_argument("--applications", type=int, default=100000)
+        subparser.add_argument("--seed", type=int, default=1)
+        subparser.add_argument("--first-id", type=int, default=1)
+    postgres_parser.add_argument("--batch-size", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == "postgres":
+        import main
+        main.setup_database()
+        connection = main.get_db_connection()
+        try:
+            load_postgres(connection, args.applications, args.seed, args.first_id, args.batch_size)
+        finally:
+            connection.close()
+    else:
+        write_synthetic_snapshot(args.path, args.applications, args.seed, args.first_id)
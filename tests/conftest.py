@@ -0,0 +1,56 @@
+"""Shared fixtures for tests that need a PostgreSQL database.
+
+Database tests run against TEST_DATABASE_URL and are skipped when it is not
+set. Each test gets a private schema with the pipeline tables created by
+main._create_schema, dropped again afterwards.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+# main.py refuses to import without DATABASE_URL; tests only ever use the
+# connections handed to them by the fixtures below.
+os.environ.setdefault("DATABASE_URL", TEST_DATABASE_URL or "postgresql://localhost/planning_test")
+
+
+@pytest.fixture
+def pg_conn():
+    """A connection whose search_path points at a fresh, fully migrated schema."""
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+
+    import psycopg2
+    import main
+
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA {schema}")
+    cur.execute(f"SET search_path TO {schema}, public")
+    conn.commit()
+
+    main._create_schema(cur)
+    conn.commit()
+
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+def has_extension(conn, name):
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM pg_extension WHERE extname = %s", (name,))
+    found = cur.fetchone() is not None
+    cur.close()
+    return found
@@ -0,0 +1,209 @@
+"""Tests for the persisted, incrementally maintained analysis aggregates."""
+import json
+import random
+
+from analysis_aggregates import Fact, diff_aggregates, sum_contributions
+
+AGENTS = [("Smith Architects", "info@smitharch.ie"), ("Smyth Architects", "john@smitharch.ie"),
+          ("Jones Design", "jones@gmail.com"), ("Kelly Planning Ltd", "kelly@kp.ie"), ("", "")]
+APPLICANTS = [("John", "Murphy"), ("Mary", "Kelly"), ("Pat", "Byrne"), ("", "")]
+DECISIONS = ["GRANT PERMISSION", "DECLARE APPLICATION INVALID", "REFUSE PERMISSION", None]
+LPAS = ["fingal", "dublincity"]
+
+
+def _fact(**overrides):
+    values = dict.fromkeys(Fact._fields)
+    values.update(id=1, lpa="fingal", month="2025-01", agent="Smith Architects", agent_email="",
+                  applicant="John Murphy", is_invalid=False, email="", phone="")
+    values.update(overrides)
+    return Fact(**values)
+
+
+def test_contributions_cancel_out():
+    invalid = _fact(is_invalid=True, email="info@smitharch.ie", follow_up_id=2, follow_up_lpa="fingal",
+                    follow_up_days=30, agent_changed=True, lpa_follow_up_id=2, lpa_follow_up_lpa="fingal",
+                    lpa_follow_up_days=30, lpa_agent_changed=True)
+    totals = sum_contributions([invalid, _fact(id=2)])
+    assert totals["agg_agent_month"][("Smith Architects", "fingal", "2025-01")] == [2, 1, 1, 0]
+    assert totals["agg_agent_contact"] == {("Smith Architects", "email", "info@smitharch.ie"): [1]}
+    assert totals["agg_lpa_month"][("fingal", "2025-01")] == [2, 1, 1, 30, 1, 1, 30, 1]
+
+    sum_contributions([invalid], sign=-1, totals=totals)
+    assert diff_aggregates(totals, sum_contributions([_fact(id=2)])) == []
+
+
+def _random_app(rng):
+    agent, email = rng.choice(AGENTS)
+    fore, sur = rng.choice(APPLICANTS)
+    house = rng.randint(1, 6)
+    return {
+        "applicationType": "Permission", "agentSurname": agent, "agentEmail": email,
+        "agentTelephoneNumber": rng.choice(["01 234", None]),
+        "applicantForename": fore, "applicantSurname": sur,
+        "location": f"{house} Main Street, Dublin", "easting": 715000 + house * 100, "northing": 734000,
+    }
+
+
+def _insert(cur, app_id, rng, js=None):
+    js = js or _random_app(rng)
+    cur.execute(
+        "INSERT INTO applications (id, lpa, registration_date, decision, location, raw_json) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        (app_id, LPAS[app_id % 2], f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+         rng.choice(DECISIONS), js["location"], json.dumps(js)),
+    )
+
+
+def _assert_same_reports(conn, dataset):
+    """The aggregate reports match the full analyses, order included."""
+    from analysis_aggregates import agents_report, churn_report, lifecycle_report
+    from analyze_agents import analyze_agents
+    from analyze_churn_agents import analyze_churn_agents
+    from analyze_lifecycle import analyze_lifecycle
+
+    assert agents_report(conn) == analyze_agents(dataset=dataset)
+    assert churn_report(conn) == analyze_churn_agents(dataset=dataset)
+    assert json.dumps(lifecycle_report(conn)) == json.dumps(analyze_lifecycle(dataset=dataset))
+
+
+def _change_applications(cur, rng):
+    """New applications, changed decisions and an agent rename that moves the dedup map."""
+    for app_id in range(200, 215):
+        _insert(cur, app_id, rng)
+    cur.execute("UPDATE applications SET decision = 'DECLARE APPLICATION INVALID', updated_at = LOCALTIMESTAMP "
+                "WHERE id IN (3, 4, 5)")
+    cur.execute("UPDATE applications SET raw_json = raw_json || '{\"agentSurname\": \"Smith Design\"}', "
+                "updated_at = LOCALTIMESTAMP WHERE raw_json->>'agentEmail' = 'john@smitharch.ie'")
+    cur.connection.commit()
+
+
+def test_full_rebuild_verifies_the_pending_incremental_update(pg_conn):
+    from analysis_aggregates import refresh_aggregates, update_aggregates
+    from shared_utils import load_analysis_dataset
+
+    rng = random.Random(11)
+    cur = pg_conn.cursor()
+    for app_id in range(200):
+        _insert(cur, app_id, rng)
+    pg_conn.commit()
+
+    dataset = load_analysis_dataset(conn=pg_conn)
+    # The first update has no watermark and builds everything
+    assert update_aggregates(pg_conn, dataset) == 200
+    _assert_same_reports(pg_conn, dataset)
+
+    # Changes not folded in yet: the rebuild applies them incrementally before comparing
+    _change_applications(cur, rng)
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert refresh_aggregates(pg_conn, dataset, full_rebuild=True) == []
+    _assert_same_reports(pg_conn, dataset)
+
+    # Nothing changed since: an update re-derives nothing
+    assert update_aggregates(pg_conn, load_analysis_dataset(conn=pg_conn)) == 0
+
+
+def test_full_rebuild_reports_incremental_drift(pg_conn):
+    from analysis_aggregates import refresh_aggregates, update_aggregates
+    from shared_utils import load_analysis_dataset
+
+    rng = random.Random(11)
+    cur = pg_conn.cursor()
+    for app_id in range(200):
+        _insert(cur, app_id, rng)
+    pg_conn.commit()
+    update_aggregates(pg_conn, load_analysis_dataset(conn=pg_conn))
+
+    # A stored aggregate row the incremental path got wrong
+    cur.execute("UPDATE agg_lpa_month SET total = total + 1 WHERE lpa = 'fingal' AND month = '2024-01'")
+    _change_applications(cur, rng)
+    dataset = load_analysis_dataset(conn=pg_conn)
+    mismatches = refresh_aggregates(pg_conn, dataset, full_rebuild=True)
+    assert [(table, key) for table, key, _, _ in mismatches] == [("agg_lpa_month", ("fingal", "2024-01"))]
+    # The rebuild repairs it
+    assert refresh_aggregates(pg_conn, dataset, full_rebuild=True) == []
+
+
+def test_agent_aliases_follow_the_applications(pg_conn):
+    from analysis_aggregates import update_aggregates
+    from shared_utils import build_agent_dedup_map, load_analysis_dataset, update_agent_aliases
+
+    rng = random.Random(5)
+    cur = pg_conn.cursor()
+    for app_id in range(100):
+        _insert(cur, app_id, rng)
+    pg_conn.commit()
+
+    # Nothing persisted yet: the dataset builds the map itself
+    assert load_analysis_dataset(conn=pg_conn).agent_aliases is None
+    assert update_agent_aliases(pg_conn) == 4
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert dataset.agent_aliases == build_agent_dedup_map(dataset.apps)
+    update_aggregates(pg_conn, dataset)
+
+    # A rename within one domain, and a practice whose every application loses its email
+    cur.execute("UPDATE applications SET raw_json = raw_json || '{\"agentSurname\": \"Smith Design\"}', "
+                "updated_at = LOCALTIMESTAMP WHERE raw_json->>'agentEmail' = 'john@smitharch.ie'")
+    cur.execute("UPDATE applications SET raw_json = raw_json || '{\"agentEmail\": \"\"}', "
+                "updated_at = LOCALTIMESTAMP WHERE raw_json->>'agentEmail' = 'kelly@kp.ie'")
+    pg_conn.commit()
+
+    # Aliases are stale until updated, so they are not used
+    assert load_analysis_dataset(conn=pg_conn).agent_aliases is None
+    assert update_agent_aliases(pg_conn) == 3
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert dataset.agent_aliases == build_agent_dedup_map(dataset.apps)
+    assert 'kelly@kp.ie' not in dataset.agent_aliases
+    cur.execute("SELECT agent FROM agent_aliases WHERE email = 'kelly@kp.ie'")
+    assert cur.fetchone() == (None,)
+
+
+def test_agent_aliases_break_ties_like_the_dedup_map(pg_conn):
+    from shared_utils import build_agent_dedup_map, load_analysis_dataset, update_agent_aliases
+
+    rng = random.Random(7)
+    cur = pg_conn.cursor()
+    # Two names used twice each on one domain: the one with an undated
+    # application was seen first, and one email is padded with a tab
+    for app_id, (agent, email, registered) in enumerate([
+            ("Alpha Architects", "alpha@tie.ie", "2024-01-01"), ("Alpha Architects", "alpha@tie.ie", "2024-01-01"),
+            ("Zulu Architects", "\tzulu@tie.ie\n", "2025-01-01"), ("Zulu Architects", "zulu@tie.ie", None)]):
+        js = _random_app(rng)
+        js.update(agentSurname=agent, agentEmail=email)
+        cur.execute("INSERT INTO applications (id, lpa, registration_date, location, raw_json) "
+                    "VALUES (%s, 'fingal', %s, %s, %s)", (app_id, registered, js["location"], json.dumps(js)))
+    pg_conn.commit()
+
+    update_agent_aliases(pg_conn)
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert dataset.agent_aliases == build_agent_dedup_map(dataset.apps)
+    assert dataset.agent_aliases == {"alpha@tie.ie": "zulu", "zulu@tie.ie": "zulu"}
+
+
+def test_incremental_update_follows_name_clusters(pg_conn):
+    from analysis_aggregates import rebuild_aggregates, update_aggregates
+    from shared_utils import load_analysis_dataset
+
+    rng = random.Random(3)
+    cur = pg_conn.cursor()
+    for app_id in range(60):
+        js = _random_app(rng)
+        js.update(agentSurname=rng.choice(["Fitzgerald Kelly", "Fitzgerld Kelly", "Byrne Planning"]), agentEmail="")
+        _insert(cur, app_id, rng, js)
+    pg_conn.commit()
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert dataset.name_clusters() == {"fitzgerld kelly": "fitzgerald kelly"}
+    update_aggregates(pg_conn, dataset)
+
+    # The misspelling becomes the more common name, so the cluster's canonical name moves
+    for app_id in range(60, 120):
+        js = _random_app(rng)
+        js.update(agentSurname="Fitzgerld Kelly", agentEmail="")
+        _insert(cur, app_id, rng, js)
+    pg_conn.commit()
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert dataset.name_clusters() == {"fitzgerald kelly": "fitzgerld kelly"}
+    update_aggregates(pg_conn, dataset)
+
+    assert rebuild_aggregates(pg_conn, dataset)[1] == []
+    cur.execute("SELECT DISTINCT agent FROM agg_agent_month ORDER BY agent")
+    assert [agent for (agent,) in cur.fetchall()] == ["byrne", "fitzgerld kelly"]
@@ -0,0 +1,33 @@
+"""Tests for loading the shared analysis dataset from the generated columns."""
+import json
+from datetime import datetime
+
+
+def test_load_analysis_dataset_projects_columns(pg_conn):
+    from shared_utils import load_analysis_dataset
+    cur = pg_conn.cursor()
+    apps = [
+        (1, {"applicationType": "Permission", "agentEmail": "info@arch.ie", "agentSurname": "Arch Ltd",
+             "easting": 715000, "northing": 734000, "location": "1 Main St", "description": "x" * 5000}),
+        (2, {"applicationType": "Permission", "easting": "n/a", "applicantSurname": "Byrne"}),
+        (3, {"applicationType": "Compliance", "agentEmail": "info@arch.ie"}),
+    ]
+    for app_id, js in apps:
+        cur.execute(
+            "INSERT INTO applications (id, lpa, decision, registration_date, location, raw_json) "
+            "VALUES (%s, 'fingal', 'GRANT', %s, %s, %s)",
+            (app_id, f"2025-02-0{app_id}", js.get("location"), json.dumps(js)),
+        )
+    pg_conn.commit()
+
+    dataset = load_analysis_dataset(conn=pg_conn)
+    assert [a["_id"] for a in dataset.apps] == [1, 2]
+    first, second = dataset.apps
+    assert first["agentEmail"] == "info@arch.ie"
+    assert first["easting"] == 715000.0
+    assert first["location"] == "1 Main St"
+    assert first["_dt"] == datetime(2025, 2, 1)
+    assert "description" not in first
+    # Non-numeric coordinates are projected as NULL and omitted
+    assert "easting" not in second
+    assert second["applicantSurname"] == "Byrne"
@@ -0,0 +1,76 @@
+"""Tests for running the analysis stage, sequentially and in parallel."""
+import json
+import os
+
+import pytest
+
+
+def _dataset_size(dataset=None):
+    # Reads the dataset inherited from the parent process
+    return {'apps': len(dataset.apps), 'pid': os.getpid()}
+
+
+def _queries_database():
+    return {'ok': True}
+
+
+def _broken():
+    raise ValueError("boom")
+
+
+@pytest.fixture
+def stage(monkeypatch, tmp_path):
+    import main
+    from shared_utils import AnalysisDataset
+
+    def unavailable():
+        raise RuntimeError("no database")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "setup_database", lambda: None)
+    monkeypatch.setattr(main, "load_analysis_dataset", lambda url: AnalysisDataset([{'_id': 1}, {'_id': 2}]))
+    # Aggregates cannot be refreshed, so the dataset analyses run in full
+    monkeypatch.setattr(main, "get_db_connection", unavailable)
+    monkeypatch.setattr(main, "DATASET_ANALYSES", {_dataset_size})
+    monkeypatch.setattr(main, "ANALYSIS_OUTPUTS", {
+        "size_latest.json": _dataset_size,
+        "query_latest.json": _queries_database,
+        "broken_latest.json": _broken,
+    })
+    return main, tmp_path / "out"
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_failures_are_isolated(stage, parallel, capsys):
+    main, out_dir = stage
+    main.run_analysis_stage(parallel=parallel, workers=2)
+
+    reports = ["query_latest.json", "size_latest.json"]
+    assert sorted(os.listdir(out_dir)) == sorted(
+        ["manifest.json"] + [name + suffix for name in reports for suffix in ("", ".gz", ".br")])
+    size = json.loads((out_dir / "size_latest.json").read_text())["data"]
+    assert size["apps"] == 2
+    assert (size["pid"] != os.getpid()) == parallel
+
+    output = capsys.readouterr().out
+    assert "Error running _broken: boom" in output
+    assert "_dataset_size" in output.split("Analysis timings:")[1]
+    assert main._analysis_context["dataset"] is None
+
+
+def test_shards_cut_from_reports(stage):
+    main, out_dir = stage
+    main.ANALYSIS_OUTPUTS.update({
+        "agents_latest.json": lambda: [{"name": "smyth", "total": 2}, {"name": "kelly", "total": 1}],
+        "churn_latest.json": lambda: [{"name": "smyth", "fired": 1}],
+        "lifecycle_latest.json": lambda: {"overall": {}, "by_lpa": {"fingal": {"total_applications": 5}}},
+    })
+    main.run_analysis_stage(shards=True)
+
+    def data(path):
+        return json.loads((out_dir / path).read_text())["data"]
+
+    assert data("agents/smyth.json") == {"agent": {"name": "smyth", "total": 2}, "churn": {"name": "smyth", "fired": 1}}
+    assert data("agents/kelly.json")["churn"] is None
+    assert [s["key"] for s in data("agents_index.json")["shards"]] == ["smyth", "kelly"]
+    assert data("lifecycle/fingal.json") == {"total_applications": 5}
@@ -0,0 +1,37 @@
+"""Parity tests: vectorised agent_stats must match the per-application loop."""
+import random
+
+from analyze_agents import agent_stats
+from benchmarks.bench_agents import agent_stats_loop
+from shared_utils import build_agent_dedup_map, classify_decision
+
+
+def synthetic_apps(seed, count):
+    rng = random.Random(seed)
+    # Few agents and contacts, so count and most_common ties are frequent
+    agents = ["Smith Architects", "SMITH ARCHITECTS", "Smyth Design Ltd", "Jo", "", None, "Kelly Planning"]
+    emails = ["info@smith.ie", "John Smith <john@smith.ie>", "kelly@gmail.com", "", None, "not an email"]
+    phones = ["01 234 5678", " 01 234 5678 ", "   ", "", None, "087 1111"]
+    decisions = ["GRANT PERMISSION", "DECLARE APPLICATION INVALID", "Invalid application", ""]
+    apps = []
+    for i in range(count):
+        decision = rng.choice(decisions)
+        app = {'_id': i, '_lpa': 'fingal', '_decision': decision, '_category': classify_decision(decision)}
+        for key, values in [('agentSurname', agents), ('agentContactName', agents[:2] + [None] * 8),
+                            ('agentEmail', emails), ('agentTelephoneNumber', phones)]:
+            value = rng.choice(values)
+            if value is not None:
+                app[key] = value
+        apps.append(app)
+    return apps
+
+
+def test_agent_stats_matches_loop():
+    for seed in range(10):
+        apps = synthetic_apps(seed, 400)
+        for dedup_map in (None, build_agent_dedup_map(apps)):
+            assert agent_stats(apps, dedup_map) == agent_stats_loop(apps, dedup_map)
+
+
+def test_agent_stats_empty():
+    assert agent_stats([]) == []
@@ -0,0 +1,77 @@
+"""Tests for the single-query detailed failure analysis."""
+
+
+def test_detailed_failures_ranks_categories_and_notes(pg_conn):
+    from analyze_invalid import GENERIC_NOTE, analyze_detailed_failures
+    cur = pg_conn.cursor()
+    cur.execute("INSERT INTO applications (id, lpa, decision) VALUES "
+                "(1, 'fingal', 'DECLARE APPLICATION INVALID'), (2, 'fingal', 'DECLARE APPLICATION INVALID'), "
+                "(3, 'fingal', 'GRANT PERMISSION')")
+    conditions = [
+        (1, "Site Notice", "Site notice missing. Note: not legible"),
+        (2, "Site Notice", "Note - not   legible"),
+        (2, "Site Notice", "No note here"),
+        (1, "Fee", "Note: wrong amount"),
+        (2, "Fee", None),
+        (3, "Fee", "Note: ignored, application was valid"),
+        (3, "Drawings", "Note: ignored too"),
+    ]
+    for order_num, (app_id, short_desc, long_desc) in enumerate(conditions):
+        # clean_note left NULL, as for rows saved before it was computed at ingest
+        cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc, long_desc) "
+                    "VALUES (%s, 'fingal', %s, %s, %s)", (app_id, order_num, short_desc, long_desc))
+    pg_conn.commit()
+
+    results = analyze_detailed_failures(conn=pg_conn, notes_per_category=1)
+    assert results == [
+        {'category': "Site Notice", 'total_count': 3, 'top_notes': [{'note': "not legible", 'count': 2}]},
+        {'category': "Fee", 'total_count': 2, 'top_notes': [{'note': GENERIC_NOTE, 'count': 1}]},
+    ]
+    # Plain ints, so the results serialise to JSON
+    assert type(results[0]['total_count']) is int
+
+    cur.execute("SELECT COUNT(*) FROM conditions WHERE clean_note IS NULL")
+    assert cur.fetchone()[0] == 0
+
+
+def test_near_duplicate_notes_are_counted_together(pg_conn):
+    from analyze_invalid import analyze_detailed_failures, backfill_clean_notes, update_note_clusters
+    cur = pg_conn.cursor()
+    cur.execute("INSERT INTO applications (id, lpa, decision) "
+                "SELECT g, 'fingal', 'DECLARE APPLICATION INVALID' FROM generate_series(1, 6) g")
+    notes = [
+        "Note: the site notice at 12 Main Street was not legible on 03/02/2024",
+        "Note: the site notice at 4 Main Street was not legible on 11/05/2024",
+        "Note: the site notice at 12  Main Street was  not legible on 03/02/2024",
+        "Note: the fee paid was incorrect",
+    ]
+    for order_num, note in enumerate(notes):
+        cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc, long_desc) "
+                    "VALUES (%s, 'fingal', %s, 'Site Notice', %s)", (order_num + 1, order_num, note))
+    pg_conn.commit()
+
+    results = analyze_detailed_failures(conn=pg_conn)
+    assert results[0]['top_notes'] == [
+        {'note': "the site notice at 12 Main Street was not legible on 03/02/2024", 'count': 3},
+        {'note': "the fee paid was incorrect", 'count': 1},
+    ]
+
+    # Later runs only assign the notes they have not seen, to the cached clusters
+    cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc, long_desc) "
+                "VALUES (5, 'fingal', 9, 'Site Notice', 'Note: the fee paid was incorrect, see 2024/123')")
+    pg_conn.commit()
+    backfill_clean_notes(pg_conn)
+    assert update_note_clusters(pg_conn) == 1
+    assert update_note_clusters(pg_conn) == 0
+    assert analyze_detailed_failures(conn=pg_conn)[0]['top_notes'][1] == \
+        {'note': "the fee paid was incorrect", 'count': 2}
+    cur.execute("SELECT COUNT(*) FROM note_clusters")
+    assert cur.fetchone()[0] == 4
+
+    # Clusters stored with signatures of another kind are computed again
+    cur.execute("UPDATE note_clusters SET signature_kind = NULL, cluster = 'stale' "
+                "WHERE note = 'the fee paid was incorrect'")
+    pg_conn.commit()
+    assert update_note_clusters(pg_conn) == 1
+    cur.execute("SELECT COUNT(*) FROM note_clusters WHERE cluster = 'stale'")
+    assert cur.fetchone()[0] == 0
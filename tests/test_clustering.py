@@ -0,0 +1,57 @@
+"""Tests for the MinHash/LSH near-duplicate clustering."""
+import numpy as np
+
+from clustering import (NOTE_THRESHOLD, candidate_pairs, char_ngrams, cluster_agent_names, cluster_signatures,
+                        connected_components, minhash_signatures, word_shingles)
+from shared_utils import DerivedFieldCache, get_agent
+
+
+def test_char_ngrams_stay_within_each_text():
+    starts, codes = char_ngrams(["ab", "abc"])
+    assert starts.tolist() == [0, 2]
+    # ^ab, ab$ | ^ab, abc, bc$
+    assert len(codes) == 5
+    assert codes[0] == codes[2] == int.from_bytes(b"^ab", "big")
+
+
+def test_identical_texts_always_pair():
+    signatures = minhash_signatures(*char_ngrams(["murphy", "kelly", "murphy"]))
+    i, j = candidate_pairs(signatures)
+    assert (0, 2) in set(zip(i.tolist(), j.tolist()))
+    assert cluster_signatures(signatures, 0.9).tolist() == [0, 1, 0]
+
+
+def test_connected_components_label_by_smallest_member():
+    labels = connected_components(6, np.array([4, 1, 3]), np.array([5, 3, 5]))
+    assert labels.tolist() == [0, 1, 2, 1, 1, 1]
+
+
+def test_cluster_agent_names_joins_spelling_variants():
+    counts = {"fitzgerald kelly": 3, "fitzgerld kelly": 1, "o brien": 2, "obrien": 2,
+              "smith": 5, "smyth": 4, "Unknown/None": 50, "ab": 1}
+    assert cluster_agent_names(counts) == {"fitzgerld kelly": "fitzgerald kelly", "obrien": "o brien"}
+
+
+def test_word_shingles_are_adjacent_word_pairs():
+    starts, codes = word_shingles(["Fee paid 2024/123", "fee  PAID 7/8", "Missing"])
+    assert starts.tolist() == [0, 3, 6]
+    assert codes[:3].tolist() == codes[3:6].tolist()
+    assert len(codes) == 7
+
+
+def test_notes_with_different_findings_stay_apart():
+    notes = ["Location plan missing", "Location plan incorrect", "Fee not paid", "Fee paid incorrect",
+             "the fee paid was incorrect", "the fee paid was incorrect, see 2024/123"]
+    labels = cluster_signatures(minhash_signatures(*word_shingles(notes)), NOTE_THRESHOLD)
+    assert labels.tolist() == [0, 1, 2, 3, 4, 4]
+
+
+def test_name_clusters_feed_get_agent():
+    app = {"agentSurname": "Fitzgerld Kelly Architects"}
+    clusters = {"fitzgerld kelly": "fitzgerald kelly"}
+    assert get_agent(app) == "fitzgerld kelly"
+    assert get_agent(app, name_clusters=clusters) == "fitzgerald kelly"
+    # Names resolved through the email dedup map are clustered too
+    app["agentEmail"] = "info@fk.ie"
+    assert get_agent(app, {"info@fk.ie": "fitzgerld kelly"}, clusters) == "fitzgerald kelly"
+    assert DerivedFieldCache(name_clusters=clusters).agent(app) == "fitzgerald kelly"
@@ -0,0 +1,117 @@
+"""Tests for document text extraction in extract_text.py"""
+import hashlib
+import time
+
+import pytest
+
+import extract_text
+from extract_text import _extract_one, _init_worker, extract_file_text, file_content_hash
+
+
+def test_file_content_hash(tmp_path):
+    path = tmp_path / "letter.txt"
+    path.write_bytes(b"Declared invalid")
+    assert file_content_hash(str(path)) == hashlib.sha256(b"Declared invalid").hexdigest()
+
+
+def test_extract_html_strips_markup(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("<html><style>p {}</style><p>Site notice &amp; plans</p></html>")
+    text, pages, extractor = extract_file_text(str(path))
+    assert text.split() == ["Site", "notice", "&", "plans"]
+    assert pages is None
+    assert extractor == "html"
+
+
+def test_extract_unsupported_type(tmp_path):
+    path = tmp_path / "drawing.dwg"
+    path.write_bytes(b"\x00")
+    with pytest.raises(ValueError):
+        extract_file_text(str(path))
+
+
+def test_known_hash_is_skipped(tmp_path):
+    path = tmp_path / "letter.txt"
+    path.write_text("Cover letter")
+    _init_worker({file_content_hash(str(path))})
+    result = _extract_one(1, str(path), timeout=5)
+    assert result["skipped"] is True
+    assert result["text"] is None
+
+
+def test_per_file_timeout(tmp_path, monkeypatch):
+    path = tmp_path / "slow.txt"
+    path.write_text("slow")
+
+    def slow_extract(p):
+        time.sleep(5)
+
+    monkeypatch.setattr(extract_text, "extract_file_text", slow_extract)
+    _init_worker(set())
+    result = _extract_one(2, str(path), timeout=0.1)
+    assert result["error"].startswith("timeout")
+    assert result["elapsed"] < 2
+
+
+def test_timeout_escapes_parsers_catching_exception(tmp_path, monkeypatch):
+    path = tmp_path / "malformed.txt"
+    path.write_text("malformed")
+
+    def forgiving_extract(p):
+        # Like pypdf's recovery loops, which catch Exception and carry on
+        while True:
+            try:
+                time.sleep(0.05)
+            except Exception:
+                pass
+
+    monkeypatch.setattr(extract_text, "extract_file_text", forgiving_extract)
+    _init_worker(set())
+    result = _extract_one(3, str(path), timeout=0.1)
+    assert result["error"].startswith("timeout")
+    assert result["elapsed"] < 2
+
+
+def _add_documents(conn, paths):
+    cur = conn.cursor()
+    for path in paths:
+        cur.execute("INSERT INTO documents (filename, local_path) VALUES (%s, %s)",
+                    (path.name, str(path)))
+    conn.commit()
+
+
+def test_failed_documents_are_retried(pg_conn, tmp_path, monkeypatch):
+    from extract_text import extract_documents, get_known_hashes, get_pending_documents
+
+    good, bad = tmp_path / "letter.txt", tmp_path / "report.dwg"
+    good.write_text("Cover letter")
+    bad.write_text("Planner's report")
+    _add_documents(pg_conn, [good, bad])
+
+    stats = extract_documents(pg_conn, workers=1)
+    assert (stats["extracted"], stats["failed"]) == (1, 1)
+    assert get_known_hashes(pg_conn) == {file_content_hash(str(good))}
+    assert [path for _, path in get_pending_documents(pg_conn)] == [str(bad)]
+
+    # The next run (here with an extractor that can read it) fills the error row in
+    monkeypatch.setattr(extract_text, "extract_file_text", lambda p: ("Planner's report", None, "text"))
+    assert extract_documents(pg_conn, workers=1)["extracted"] == 1
+    cur = pg_conn.cursor()
+    cur.execute("SELECT text, error FROM document_text WHERE content_hash = %s", (file_content_hash(str(bad)),))
+    assert cur.fetchone() == ("Planner's report", None)
+    assert get_pending_documents(pg_conn) == []
+
+
+def test_dead_worker_fails_files_without_aborting(pg_conn, tmp_path, monkeypatch):
+    import os
+    from extract_text import extract_documents, get_pending_documents
+
+    paths = [tmp_path / f"letter{i}.txt" for i in range(3)]
+    for i, path in enumerate(paths):
+        path.write_text(f"Cover letter {i}")
+    _add_documents(pg_conn, paths)
+
+    monkeypatch.setattr(extract_text, "extract_file_text", lambda p: os._exit(1))
+    stats = extract_documents(pg_conn, workers=1)
+    assert (stats["processed"], stats["failed"]) == (3, 3)
+    assert len(get_pending_documents(pg_conn)) == 3
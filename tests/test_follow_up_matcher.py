@@ -0,0 +1,84 @@
+"""Parity tests: FollowUpMatcher must pick the same follow-up as the linear scan."""
+import random
+from datetime import datetime, timedelta
+
+from shared_utils import FollowUpMatcher, classify_decision, get_fullname, location_match
+
+
+def reference_follow_up(inv, apps):
+    """The original per-invalid scan from analyze_churn_agents/analyze_lifecycle."""
+    name = get_fullname(inv)
+    for cand in apps:
+        if not name or get_fullname(cand) != name: continue
+        if cand['_id'] == inv['_id']: continue
+        if cand['_dt'] <= inv['_dt']: continue
+        if location_match(inv, cand):
+            return cand
+    return None
+
+
+def synthetic_apps(seed, count):
+    rng = random.Random(seed)
+    streets = ["Main St", "Sea Rd.", "Church Ave", "Mill Lane", "The Green", "Park Road"]
+    # Few distinct names so groups get large enough to use the grid/token indexes,
+    # including the catch-all "unknown/none"-style empty applicant
+    names = [("", ""), ("John", "Murphy"), ("Mary", "Kelly"), ("Ltd", "")]
+    base = datetime(2024, 1, 1)
+    apps = []
+    for i in range(count):
+        fore, sur = rng.choice(names)
+        house = rng.randint(1, 25)
+        app = {
+            '_id': i if rng.random() > 0.05 else rng.randint(0, i + 1),  # occasional id reuse across LPAs
+            '_dt': base + timedelta(days=rng.randint(0, 400)),
+            'applicantForename': fore,
+            'applicantSurname': sur,
+            'location': f"{house} {rng.choice(streets)}, Dublin" if rng.random() > 0.1 else None,
+        }
+        if rng.random() > 0.3:
+            app['easting'] = 715000 + house * 40 + rng.uniform(-30, 30)
+            app['northing'] = 734000 + rng.choice([0, 45, 200])
+        apps.append(app)
+    apps.sort(key=lambda a: a['_dt'])
+    return apps
+
+
+def test_matcher_matches_linear_scan():
+    for seed in range(5):
+        apps = synthetic_apps(seed, 600)
+        matcher = FollowUpMatcher(apps)
+        for inv in apps[::3]:
+            assert matcher.find(inv) is reference_follow_up(inv, apps)
+
+
+def test_matcher_same_day_is_not_a_follow_up():
+    day = datetime(2025, 1, 1)
+    inv = {'_id': 1, '_dt': day, 'applicantSurname': 'Byrne', 'location': '4 Main Street'}
+    same_day = {'_id': 2, '_dt': day, 'applicantSurname': 'Byrne', 'location': '4 Main Street'}
+    later = {'_id': 3, '_dt': day + timedelta(days=1), 'applicantSurname': 'Byrne', 'location': '4 Main Street'}
+    matcher = FollowUpMatcher([inv, same_day, later])
+    assert matcher.find(inv) is later
+    assert matcher.find(later) is None
+
+
+def test_single_pass_lpa_matches_per_lpa_matcher():
+    from analyze_lifecycle import match_invalids
+    from shared_utils import DerivedFieldCache
+
+    apps = synthetic_apps(11, 800)
+    rng = random.Random(3)
+    for app in apps:
+        app['_lpa'] = rng.choice(["fingal", "dublincity"])
+        app['_decision'] = "DECLARE APPLICATION INVALID" if rng.random() < 0.3 else "GRANT"
+        app['_category'] = classify_decision(app['_decision'])
+
+    outcomes = match_invalids(apps, DerivedFieldCache())
+    assert len(outcomes) == sum('INVALID' in a['_decision'] for a in apps)
+
+    for lpa in ("fingal", "dublincity"):
+        lpa_apps = [a for a in apps if a['_lpa'] == lpa]
+        per_lpa = FollowUpMatcher(lpa_apps)
+        for inv, match, lpa_match in outcomes:
+            if inv['_lpa'] == lpa:
+                assert match is reference_follow_up(inv, apps)
+                assert lpa_match is per_lpa.find(inv)
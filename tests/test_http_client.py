@@ -0,0 +1,74 @@
+"""Tests for the instrumented HTTP client."""
+import pytest
+import requests
+
+import http_client
+import metrics
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    metrics.reset()
+    queue = []
+
+    def fake_get(url, **kwargs):
+        response = queue.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(http_client.requests, "get", fake_get)
+    yield queue
+    metrics.reset()
+
+
+def test_requests_are_recorded_per_host_and_endpoint(responses):
+    api = "https://planningapi.agileapplications.ie/api"
+    responses.extend([FakeResponse(200, b"x" * 10), FakeResponse(404), FakeResponse(200, b"y" * 5),
+                      requests.exceptions.ConnectTimeout("slow"),
+                      FakeResponse(200, headers={"Content-Length": "2048"})])
+    for app_id in (1, 2):
+        http_client.get(f"{api}/application/{app_id}/document", "/application/{id}/document")
+    http_client.get(f"{api}/application/3", "/application/{id}")
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        http_client.get(f"{api}/application/4", "/application/{id}")
+    http_client.get(f"{api}/application/document/DLR/abc", "/application/document/{lpa}/{hash}", stream=True)
+
+    rows = {row["endpoint"]: row for row in http_client.summary()}
+    assert {row["host"] for row in rows.values()} == {"planningapi.agileapplications.ie"}
+    documents = rows["/application/{id}/document"]
+    assert (documents["requests"], documents["failures"], documents["bytes"]) == (2, 1, 10)
+    assert documents["statuses"] == {"200": 1, "404": 1}
+    details = rows["/application/{id}"]
+    assert (details["requests"], details["failures"]) == (2, 1)
+    assert rows["/application/document/{lpa}/{hash}"]["bytes"] == 2048
+
+    latency = http_client.host_latency("planningapi.agileapplications.ie")
+    assert latency["count"] == 5
+    assert 0 <= latency["p50"] <= latency["p99"]
+    assert http_client.host_latency("example.org") is None
+
+
+def test_histogram_quantiles_follow_buckets():
+    metrics.reset()
+    for seconds in [0.2] * 90 + [3] * 10:
+        metrics.observe("http_request_seconds", seconds, host="h", endpoint="/a")
+    summary = metrics.histogram("http_request_seconds", host="h")
+    assert summary["count"] == 100
+    # 0.2 falls in the (0.1, 0.25] bucket and 3 in (2.5, 5]
+    assert 0.1 < summary["p50"] <= 0.25
+    assert 2.5 < summary["p99"] <= 5
+    assert summary["counts"][metrics.LATENCY_BUCKETS.index(0.25)] == 90
+
+    prom = metrics.prometheus_text(metrics.snapshot()).splitlines()
+    assert "# TYPE planning_slurper_http_request_seconds histogram" in prom
+    assert 'planning_slurper_http_request_seconds_bucket{endpoint="/a",host="h",le="+Inf"} 100' in prom
+    assert 'planning_slurper_http_request_seconds_count{endpoint="/a",host="h"} 100' in prom
+    metrics.reset()
@@ -0,0 +1,58 @@
+"""Tests for the run metrics registry and its JSON and Prometheus output."""
+import json
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_registry():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_spans_accumulate_per_name_and_labels():
+    for items in (3, 4):
+        with metrics.span("sync.fetch", lpa="fingal") as fetched:
+            fetched.add(items=items, nbytes=100)
+    with pytest.raises(ValueError):
+        with metrics.span("sync.fetch", lpa="dublincity"):
+            raise ValueError("timeout")
+    metrics.record_span("analysis.compute", 2.5, analysis="analyze_agents")
+
+    spans = {(s["name"], tuple(s["labels"].values())): s for s in metrics.snapshot()["spans"]}
+    fingal = spans["sync.fetch", ("fingal",)]
+    assert (fingal["calls"], fingal["items"], fingal["bytes"], fingal["errors"]) == (2, 7, 200, 0)
+    assert fingal["max_seconds"] <= fingal["seconds"]
+    assert spans["sync.fetch", ("dublincity",)]["errors"] == 1
+    assert spans["analysis.compute", ("analyze_agents",)]["seconds"] == 2.5
+
+
+def test_timed_labels_calls_with_their_arguments():
+    @metrics.timed("db.write", table="applications", label_args=("lpa",))
+    def save(app, lpa="dunlaoghaire"):
+        return app
+
+    assert save(1) == 1
+    save(2, lpa="fingal")
+    save(3, "fingal")
+    labels = {tuple(sorted(s["labels"].items())): s["calls"] for s in metrics.snapshot()["spans"]}
+    assert labels == {(("lpa", "dunlaoghaire"), ("table", "applications")): 1,
+                      (("lpa", "fingal"), ("table", "applications")): 2}
+
+
+def test_write_metrics(tmp_path):
+    metrics.count("errors", stage="hydrate", lpa="fingal")
+    metrics.count("errors", 2, stage="hydrate", lpa="fingal")
+    metrics.record_span("stage.sync", 1.5)
+    metrics.write_metrics(str(tmp_path))
+
+    data = json.loads((tmp_path / "metrics.json").read_text())
+    assert data["counters"] == [{"name": "errors", "labels": {"lpa": "fingal", "stage": "hydrate"}, "value": 3}]
+
+    prom = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert 'planning_slurper_errors_total{lpa="fingal",stage="hydrate"} 3' in prom
+    assert 'planning_slurper_span_seconds_total{span="stage.sync"} 1.5' in prom
+    assert prom.count("# TYPE planning_slurper_span_calls_total counter") == 1
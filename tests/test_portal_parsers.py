@@ -0,0 +1,31 @@
+"""Tests for the Dublin City and South Dublin document page parsers."""
+import json
+
+
+def test_parse_dublin_city_documents():
+    from main import parse_dublin_city_documents
+    rows = [{"Guid": "abc-1", "Doc_Type": "Drawing", "Doc_Ref": " D1 ", "Date_Received": "2024-03-01"},
+            {"Guid": None, "Doc_Type": "Form", "Doc_Ref": None, "Date_Received": None}]
+    html = f"<script>\nvar model = {json.dumps({'Rows': rows})};\n</script>"
+
+    (doc, url), (blank, no_url) = parse_dublin_city_documents(html)
+    assert doc == {"documentHash": "abc-1", "description": "Drawing", "name": "D1", "receivedDate": "2024-03-01"}
+    assert url.endswith("ViewDocument?id=abc-1")
+    assert blank["name"] == "" and no_url is None
+    assert parse_dublin_city_documents("<html>no model</html>") == []
+
+
+def test_parse_south_dublin_documents():
+    from main import parse_south_dublin_documents
+    html = """<table><tr>
+      <td class="x" headers="DateReceived"> 05/03/2024 </td>
+      <td headers="FileName"><a href="/Home/ViewDocument?fileId=123" target="_blank">Site Notice</a></td>
+      <td>PDF</td></tr>
+      <tr><td headers="DateReceived">unknown</td>
+      <td headers="FileName"><a href="/Home/ViewDocument?fileId=124">Drawings </a></td></tr></table>"""
+
+    (notice, url), (drawings, _) = parse_south_dublin_documents(html)
+    assert notice == {"documentHash": "123", "documentId": "123", "description": "Site Notice",
+                      "name": "Site Notice", "receivedDate": "2024-03-05T00:00:00"}
+    assert url == "https://planning.southdublin.ie/Home/ViewDocument?fileId=123"
+    assert drawings["receivedDate"] == "unknown" and drawings["name"] == "Drawings"
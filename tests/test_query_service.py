@@ -0,0 +1,181 @@
+"""Tests for the read-only query service."""
+import gzip
+import json
+import threading
+import urllib.request
+
+import psycopg2
+import pytest
+
+from conftest import TEST_DATABASE_URL
+
+
+def test_lru_cache_evicts_least_recently_used():
+    from query_service import LRUCache
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+@pytest.fixture
+def service(pg_conn):
+    from query_service import QueryService
+    from shared_utils import backfill_decision_categories
+    cur = pg_conn.cursor()
+    cur.execute("SHOW search_path")
+    search_path = cur.fetchone()[0].replace(" ", "")
+    for i in range(40):
+        cur.execute(
+            "INSERT INTO applications (id, lpa, registration_date, decision, location, raw_json) "
+            "VALUES (%s, 'fingal', CURRENT_DATE - %s, %s, %s, %s)",
+            (i, i, "DECLARE APPLICATION INVALID" if i % 3 == 0 else "GRANT PERMISSION",
+             f"{i} Main Street, Swords", json.dumps({"agentEmail": "info@arch.ie", "agentSurname": "Arch Ltd"})),
+        )
+    pg_conn.commit()
+    # As setup_database does for rows not saved through save_application
+    backfill_decision_categories(pg_conn)
+
+    svc = QueryService(TEST_DATABASE_URL, max_connections=2, options=f"-c search_path={search_path}")
+    yield svc
+    svc.close()
+
+
+def test_search_pages_and_caches(service):
+    status, first = service.respond("/applications", {"limit": "15"})
+    assert status == 200
+    payload = json.loads(first["body"])
+    assert len(payload["results"]) == 15
+
+    status, again = service.respond("/applications", {"limit": "15"})
+    assert again is first
+    assert service.cache.hits == 1
+
+    status, second = service.respond("/applications", {"limit": "15", "after": payload["next_cursor"]})
+    ids = {r["id"] for r in payload["results"]} | {r["id"] for r in json.loads(second["body"])["results"]}
+    assert len(ids) == 30
+
+
+def test_lookups(service):
+    status, entry = service.respond("/applications/fingal/3", {})
+    assert status == 200
+    assert json.loads(entry["body"])["location"] == "3 Main Street, Swords"
+
+    assert service.respond("/applications/fingal/999", {})[0] == 404
+    assert service.respond("/applications/fingal/abc", {})[0] == 400
+
+    status, entry = service.respond("/agents/INFO@arch.ie", {"limit": "5"})
+    assert len(json.loads(entry["body"])["results"]) == 5
+
+    status, entry = service.respond("/invalids", {"days": "10"})
+    assert {r["id"] for r in json.loads(entry["body"])["results"]} == {0, 3, 6, 9}
+
+    for limit in ("0", "-1"):
+        status, entry = service.respond("/applications", {"limit": limit})
+        assert (status, json.loads(entry["body"])) == (400, {"error": "limit must be at least 1"})
+
+
+def test_requests_beyond_pool_size_wait_for_a_connection(service):
+    # The fixture's pool holds two connections; six uncached queries at once
+    # must queue rather than fail with PoolError
+    barrier = threading.Barrier(6)
+    statuses = []
+
+    def request(i):
+        barrier.wait()
+        statuses.append(service.respond("/applications", {"limit": str(i + 1)})[0])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert statuses == [200] * 6
+
+
+def test_cache_cleared_after_sync(service, pg_conn):
+    service.respond("/invalids", {})
+    service.check_sync(force=True)
+    assert len(service.cache) == 1
+
+    cur = pg_conn.cursor()
+    cur.execute("INSERT INTO sync_runs (started_at, finished_at) VALUES (NOW(), NOW())")
+    pg_conn.commit()
+    service.check_sync(force=True)
+    assert len(service.cache) == 0
+
+
+def test_dropped_connections_are_replaced(service, pg_conn):
+    # The server drops both pooled connections
+    with service.connection() as first, service.connection() as second:
+        pids = [first.get_backend_pid(), second.get_backend_pid()]
+    cur = pg_conn.cursor()
+    cur.execute("SELECT pg_terminate_backend(pid) FROM unnest(%s) AS pid", (pids,))
+    pg_conn.commit()
+
+    # The sync checks fail on them, and they are not handed out again
+    service.check_sync(force=True)
+    service.check_sync(force=True)
+    for limit in (11, 12, 13):
+        assert service.respond("/applications", {"limit": str(limit)})[0] == 200
+
+    # A connection-level error closes the connection even if psycopg2 has not
+    with pytest.raises(psycopg2.OperationalError):
+        with service.connection() as conn:
+            raise psycopg2.OperationalError("SSL SYSCALL error: EOF detected")
+    assert conn.closed
+
+
+def test_failed_sync_check_keeps_serving_the_cache(service, monkeypatch):
+    import main
+    service.check_sync(force=True)
+    status, entry = service.respond("/invalids", {})
+
+    def unreachable(conn=None):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(main, "get_last_sync_time", unreachable)
+    service.check_sync(force=True)
+    assert service.respond("/invalids", {}) == (200, entry)
+
+
+def test_result_from_before_sync_is_not_cached(service, pg_conn):
+    service.check_sync(force=True)
+    query = service.query
+
+    def query_across_sync(path, params):
+        result = query(path, params)
+        # A sync finishes, and another request notices, while this one runs
+        cur = pg_conn.cursor()
+        cur.execute("INSERT INTO sync_runs (started_at, finished_at) VALUES (NOW(), NOW())")
+        pg_conn.commit()
+        service.check_sync(force=True)
+        return result
+
+    service.query = query_across_sync
+    assert service.respond("/invalids", {})[0] == 200
+    assert len(service.cache) == 0
+
+
+def test_http_gzip_response(service):
+    from http.server import ThreadingHTTPServer
+    from query_service import make_handler
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/applications?limit=40"
+        request = urllib.request.Request(url, headers={"Accept-Encoding": "gzip"})
+        with urllib.request.urlopen(request) as response:
+            assert response.headers["Content-Encoding"] == "gzip"
+            payload = json.loads(gzip.decompress(response.read()))
+        assert len(payload["results"]) == 40
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,90 @@
+"""Tests for the streaming, precompressed report writer."""
+import gzip
+import json
+
+import brotli
+
+from report_writer import ReportWriter, changed_files, load_manifest, removed_files
+
+
+def test_writes_compact_json_and_compressed_siblings(tmp_path):
+    data = {"agents": [{"name": "Walsh Ltd", "rate": 12.5}] * 3, "total": 3}
+    assert ReportWriter(tmp_path).write("agents_latest.json", "2026-01-01T00:00:00", data)
+
+    raw = (tmp_path / "agents_latest.json").read_bytes()
+    assert json.loads(raw) == {"timestamp": "2026-01-01T00:00:00", "data": data}
+    assert b", " not in raw and b": " not in raw
+    assert gzip.decompress((tmp_path / "agents_latest.json.gz").read_bytes()) == raw
+    assert brotli.decompress((tmp_path / "agents_latest.json.br").read_bytes()) == raw
+
+    entry = load_manifest(tmp_path)["reports"]["agents_latest.json"]
+    assert entry["bytes"] == len(raw)
+    assert entry["timestamp"] == "2026-01-01T00:00:00"
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_unchanged_data_is_not_rewritten(tmp_path):
+    ReportWriter(tmp_path).write("churn_latest.json", "2026-01-01", {"x": 1})
+    ReportWriter(tmp_path).write("spread_latest.json", "2026-01-01", {"y": 1})
+
+    writer = ReportWriter(tmp_path)
+    assert not writer.write("churn_latest.json", "2026-01-02", {"x": 1})
+    assert writer.write("spread_latest.json", "2026-01-02", {"y": 2})
+
+    # The unchanged report keeps the timestamp of the data it holds
+    assert json.loads((tmp_path / "churn_latest.json").read_text())["timestamp"] == "2026-01-01"
+    assert json.loads((tmp_path / "spread_latest.json").read_text())["data"] == {"y": 2}
+    assert changed_files(tmp_path) == [str(tmp_path / f"spread_latest.json{suffix}")
+                                       for suffix in ("", ".gz", ".br")]
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+    assert ReportWriter(tmp_path, force=True).write("churn_latest.json", "2026-01-03", {"x": 1})
+    assert changed_files(tmp_path)[0] == str(tmp_path / "churn_latest.json")
+
+
+def test_failed_encoding_leaves_previous_report(tmp_path):
+    writer = ReportWriter(tmp_path)
+    writer.write("failures_latest.json", "2026-01-01", {"notes": ["a"]})
+    try:
+        writer.write("failures_latest.json", "2026-01-02", {"notes": [object()]})
+    except TypeError:
+        pass
+    assert json.loads((tmp_path / "failures_latest.json").read_text())["data"] == {"notes": ["a"]}
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith(".tmp")]
+
+
+def test_shards_are_indexed_and_only_changed_ones_written(tmp_path):
+    shards = [("o brien", {"total": 3}), ("O'Brien", {"total": 1}), ("Unknown/None", {"total": 9})]
+    assert ReportWriter(tmp_path).write_shards("agents", "2026-01-01", shards) == 3
+
+    index = json.loads((tmp_path / "agents_index.json").read_text())["data"]["shards"]
+    assert [(s["name"], s["key"]) for s in index][1:] == [("O'Brien", "o-brien"), ("Unknown/None", "unknown-none")]
+    assert index[0]["key"].startswith("o-brien-")
+    for shard, (_, data) in zip(index, shards):
+        raw = (tmp_path / "agents" / f"{shard['key']}.json").read_bytes()
+        assert json.loads(raw)["data"] == data
+        assert shard["size"] == len(raw)
+
+    writer = ReportWriter(tmp_path)
+    assert writer.write_shards("agents", "2026-01-02", [("o brien", {"total": 4}), ("O'Brien", {"total": 1})]) == 1
+    assert changed_files(tmp_path)[::3] == [str(tmp_path / "agents" / f"{index[0]['key']}.json"),
+                                            str(tmp_path / "agents_index.json")]
+    # Agents no longer reported lose their shard
+    assert not (tmp_path / "agents" / "unknown-none.json").exists()
+    assert "agents/unknown-none.json" not in load_manifest(tmp_path)["reports"]
+    # ... and are listed for the upload to delete, for this run only
+    assert removed_files(tmp_path) == [str(tmp_path / "agents/unknown-none.json") + suffix
+                                       for suffix in ("", ".gz", ".br")]
+    ReportWriter(tmp_path).write_shards("agents", "2026-01-03", [("o brien", {"total": 4})])
+    assert removed_files(tmp_path)[::3] == [str(tmp_path / "agents" / f"{index[0]['key']}.json")]
+
+
+def test_shard_keys_do_not_depend_on_order(tmp_path):
+    shards = [("o brien", {"total": 3}), ("O'Brien", {"total": 1}), ("O Brien", {"total": 2})]
+    for run, ordered in (("a", shards), ("b", shards[::-1])):
+        (tmp_path / run).mkdir()
+        ReportWriter(tmp_path / run).write_shards("agents", "2026-01-01", ordered)
+
+    indexes = [json.loads((tmp_path / run / "agents_index.json").read_text())["data"]["shards"] for run in "ab"]
+    assert sorted(indexes[0], key=lambda s: s["name"]) == sorted(indexes[1], key=lambda s: s["name"])
+    assert len({s["key"] for s in indexes[0]}) == 3
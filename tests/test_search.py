@@ -0,0 +1,160 @@
+"""Tests for search_applications query building and index usage."""
+import json
+
+import pytest
+
+from conftest import TEST_DATABASE_URL, has_extension
+
+
+def test_build_search_query_escapes_wildcards():
+    from main import build_search_query
+    query, params = build_search_query(location_keyword="50%_off")
+    assert "location ILIKE %s" in query
+    assert params[0] == "%50\\%\\_off%"
+
+
+def test_build_search_query_ranks_text_query():
+    from main import build_search_query
+    query, params = build_search_query(text_query="rear extension", decision="grant")
+    assert "search_tsv @@ q" in query
+    assert "ORDER BY rank DESC" in query
+    assert params == ["rear extension", "%grant%", 20]
+
+
+def _insert_apps(conn):
+    cur = conn.cursor()
+    rows = [
+        (1, "dunlaoghaire", "Single storey rear extension", "12 Main Street, Dalkey", "GRANT PERMISSION"),
+        (2, "dunlaoghaire", "Demolition of garage", "4 Sea Road, Dalkey", "DECLARE APPLICATION INVALID"),
+        (3, "fingal", "Rear extension and attic conversion", "9 Main Street, Swords", "GRANT PERMISSION"),
+    ]
+    for app_id, lpa, desc, loc, decision in rows:
+        cur.execute(
+            "INSERT INTO applications (id, lpa, description, location, decision, raw_json, registration_date) "
+            "VALUES (%s, %s, %s, %s, %s, %s, '2025-01-01')",
+            (app_id, lpa, desc, loc, decision, json.dumps({})),
+        )
+    conn.commit()
+
+
+def _plan(conn, query, params):
+    cur = conn.cursor()
+    cur.execute("SET enable_seqscan = off")
+    cur.execute("EXPLAIN " + query, params)
+    plan = "\n".join(row[0] for row in cur.fetchall())
+    cur.execute("RESET enable_seqscan")
+    return plan
+
+
+def test_text_query_ranked_results(pg_conn):
+    from main import search_applications
+    _insert_apps(pg_conn)
+    results = search_applications(text_query="rear extension", conn=pg_conn)
+    assert {row[0] for row in results} == {1, 3}
+
+
+def test_text_query_uses_gin_index(pg_conn):
+    from main import build_search_query
+    _insert_apps(pg_conn)
+    plan = _plan(pg_conn, *build_search_query(text_query="extension"))
+    assert "idx_applications_search_tsv" in plan
+
+
+def test_substring_filter_uses_trigram_index(pg_conn):
+    if not has_extension(pg_conn, "pg_trgm"):
+        pytest.skip("pg_trgm not available")
+    from main import build_search_query
+    _insert_apps(pg_conn)
+    plan = _plan(pg_conn, *build_search_query(location_keyword="main street"))
+    assert "idx_applications_location_trgm" in plan
+
+
+def test_build_search_query_radius_uses_geom_index_prefilter():
+    from main import build_search_query
+    query, params = build_search_query(near=(53.29, -6.13), radius_m=500)
+    assert "geom && ST_Expand" in query
+    assert "ST_DWithin(geom::geography" in query
+    # lon before lat in ST_MakePoint; margin in degrees covers the radius
+    assert params[:2] == [-6.13, 53.29]
+    assert params[2] > 500 / 111_320
+
+
+def test_build_search_query_rejects_cursor_with_ranking():
+    from main import build_search_query
+    with pytest.raises(ValueError):
+        build_search_query(text_query="extension", after=("2025-01-01", 1, "fingal"))
+
+
+def _insert_dated_apps(conn, count):
+    cur = conn.cursor()
+    for i in range(count):
+        reg_date = None if i % 7 == 0 else f"2025-01-{(i % 28) + 1:02d}"
+        cur.execute(
+            "INSERT INTO applications (id, lpa, registration_date, raw_json) VALUES (%s, %s, %s, '{}')",
+            (i // 2, "fingal" if i % 2 else "dunlaoghaire", reg_date),
+        )
+    conn.commit()
+
+
+def test_keyset_pages_cover_every_row_once(pg_conn):
+    from main import search_applications, next_page_cursor
+    _insert_dated_apps(pg_conn, 45)
+
+    seen = []
+    cursor = None
+    while True:
+        page = search_applications(after=cursor, limit=10, conn=pg_conn)
+        if not page:
+            break
+        seen.extend((row[0], row[9]) for row in page)
+        cursor = next_page_cursor(page)
+
+    assert len(seen) == 45
+    assert len(set(seen)) == 45
+
+
+def test_keyset_query_uses_index(pg_conn):
+    from main import build_search_query
+    _insert_dated_apps(pg_conn, 20)
+    plan = _plan(pg_conn, *build_search_query(after=("2025-01-10", 3, "fingal")))
+    assert "idx_applications_keyset" in plan
+
+
+def test_repeated_query_shape_is_prepared_once(pg_conn):
+    from main import search_applications
+    _insert_apps(pg_conn)
+    search_applications(decision="grant", conn=pg_conn)
+    search_applications(decision="invalid", conn=pg_conn)
+    cur = pg_conn.cursor()
+    cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name LIKE 'q\\_%%'")
+    assert cur.fetchone()[0] == 1
+
+
+def test_prepared_names_are_dropped_with_their_connection():
+    import gc
+    import psycopg2
+    import main
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL not set")
+
+    before = len(main._prepared_statements)
+    conn = psycopg2.connect(TEST_DATABASE_URL)
+    main.execute_prepared(conn.cursor(), "SELECT %s::int", (1,))
+    assert len(main._prepared_statements) == before + 1
+    conn.close()
+    del conn
+    gc.collect()
+    assert len(main._prepared_statements) == before
+
+
+def test_radius_query_finds_nearby(pg_conn):
+    if not has_extension(pg_conn, "postgis"):
+        pytest.skip("postgis not available")
+    from main import search_applications
+    cur = pg_conn.cursor()
+    cur.execute("INSERT INTO applications (id, lpa, raw_json, geom) VALUES "
+                "(1, 'dunlaoghaire', '{}', ST_SetSRID(ST_MakePoint(-6.1300, 53.2900), 4326)), "
+                "(2, 'dunlaoghaire', '{}', ST_SetSRID(ST_MakePoint(-6.2000, 53.2900), 4326))")
+    pg_conn.commit()
+    results = search_applications(near=(53.2900, -6.1310), radius_m=200, conn=pg_conn)
+    assert [row[0] for row in results] == [1]
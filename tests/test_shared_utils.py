@@ -1,5 +1,6 @@
 import unittest
-from shared_utils import normalize_text, extract_email, clean_note, location_match
+from datetime import date, datetime
+from shared_utils import normalize_text, extract_email, clean_note, location_match, build_analysis_dataset, DerivedFieldCache, normalisation_cache_stats, build_agent_dedup_map, classify_decision
 
 class TestSharedUtils(unittest.TestCase):
 
@@ -32,5 +33,62 @@ class TestSharedUtils(unittest.TestCase):
         app2 = {'location': "123 High Street, Dublin"}
         self.assertTrue(location_match(app1, app2))
 
+    def test_build_analysis_dataset(self):
+        rows = [
+            (2, 'fingal', 'GRANT', date(2025, 3, 1), {'applicationType': 'Permission', 'location': 'B', 'extra': 'x' * 1000}),
+            (1, None, None, '2025-01-05', '{"applicationType": "Retention", "agentSurname": "Arch"}'),
+            (3, 'fingal', 'INVALID', None, {'applicationType': 'Compliance'}),
+        ]
+        dataset = build_analysis_dataset(rows)
+        self.assertEqual([a['_id'] for a in dataset.apps], [1, 2])
+        first, second = dataset.apps
+        self.assertEqual(first['_lpa'], 'unknown')
+        self.assertEqual(first['_decision'], '')
+        self.assertIsNone(first['_category'])
+        self.assertEqual(second['_category'], 'other')
+        self.assertEqual(first['_dt'], datetime(2025, 1, 5))
+        self.assertEqual(first['agentSurname'], 'Arch')
+        self.assertNotIn('extra', second)
+        self.assertGreater(dataset.memory_bytes, 0)
+
+    def test_derived_field_cache_computes_once(self):
+        app = {'applicantForename': 'Mary', 'applicantSurname': 'Kelly', 'agentSurname': 'Kelly Architects Ltd',
+               'location': '4 Sea Rd, Dublin', 'easting': 715000, 'northing': 734000}
+        derived = DerivedFieldCache()
+        self.assertEqual(derived.fullname(app), 'mary kelly')
+        self.assertEqual(derived.agent(app), 'kelly')
+        self.assertEqual(derived.location(app), ((715000, 734000), frozenset({'4', 'sea'})))
+        self.assertEqual((derived.hits, derived.misses), (2, 1))
+
+    def test_normalisation_cache_stats(self):
+        normalize_text("Cached Name Ltd")
+        normalize_text("Cached Name Ltd")
+        stats = normalisation_cache_stats()['normalize_text']
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertLessEqual(stats['hit_rate'], 1.0)
+
+    def test_agent_dedup_map_ties_go_to_earliest_name(self):
+        apps = [
+            {'agentEmail': 'info@smitharch.ie', 'agentSurname': 'Smyth Architects', '_dt': datetime(2024, 3, 1)},
+            {'agentEmail': 'John@SmithArch.ie ', 'agentSurname': 'Smith Architects', '_dt': datetime(2024, 1, 1)},
+            {'agentEmail': 'jones@gmail.com', 'agentSurname': 'Jones Design', '_dt': datetime(2024, 2, 1)},
+            {'agentEmail': 'kelly@gmail.com', 'agentSurname': 'Kelly Design', '_dt': datetime(2024, 2, 1)},
+        ]
+        expected = {'info@smitharch.ie': 'smith', 'john@smitharch.ie': 'smith',
+                    'jones@gmail.com': 'jones', 'kelly@gmail.com': 'kelly'}
+        self.assertEqual(build_agent_dedup_map(apps), expected)
+        self.assertEqual(build_agent_dedup_map(apps[::-1]), expected)
+
+    def test_classify_decision(self):
+        self.assertEqual(classify_decision("DECLARE APPLICATION INVALID"), 'invalid')
+        self.assertEqual(classify_decision("Invalid application - site notice"), 'invalid')
+        self.assertEqual(classify_decision("GRANT PERMISSION"), 'substantive')
+        self.assertEqual(classify_decision("Split Decision"), 'substantive')
+        self.assertEqual(classify_decision("GRANT EXTENSION OF DURATION"), 'admin')
+        self.assertEqual(classify_decision("Exempted Development"), 'admin')
+        self.assertEqual(classify_decision("Additional Information Requested"), 'other')
+        self.assertIsNone(classify_decision(""))
+        self.assertIsNone(classify_decision(None))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+"""Tests for the columnar analysis snapshot."""
+import json
+from datetime import date
+
+import numpy as np
+
+
+def test_column_writer_encodes_nulls(tmp_path):
+    from snapshot import _ColumnWriter
+    for kind, values in [("str", ["a", None, "b", "a"]), ("int", [3, None]),
+                         ("float", [1.5, None]), ("date", [date(2024, 1, 2), None])]:
+        writer = _ColumnWriter(kind)
+        for value in values:
+            writer.append(value)
+        writer.save(tmp_path, "t", kind)
+
+    assert np.load(tmp_path / "t.str.npy").tolist() == [0, -1, 1, 0]
+    assert json.loads((tmp_path / "t.str.dict.json").read_text()) == ["a", "b"]
+    assert np.load(tmp_path / "t.int.npy").tolist() == [3, -1]
+    assert np.isnan(np.load(tmp_path / "t.float.npy")[1])
+    assert np.load(tmp_path / "t.date.npy").tolist() == [date(2024, 1, 2), None]
+
+
+def test_snapshot_analyses_match_database(pg_conn, tmp_path):
+    from analyze_invalid import analyze_detailed_failures
+    from analyze_spread import analyze_spread
+    from shared_utils import load_analysis_dataset
+    from snapshot import Snapshot, detailed_failures, export_snapshot, load_snapshot_dataset, spread
+
+    cur = pg_conn.cursor()
+    apps = [
+        (1, "fingal", "DECLARE APPLICATION INVALID", "2025-01-03", {"applicationType": "Permission", "agentSurname": "Walsh Ltd", "agentEmail": "info@walsh.ie", "easting": 715000}),
+        (2, "fingal", "GRANT PERMISSION", "2025-02-01", {"applicationType": "Permission", "applicantSurname": "Byrne"}),
+        (1, "dublincity", "DECLARE APPLICATION INVALID", None, {"applicationType": "Retention"}),
+        (3, "dublincity", "DECLARE APPLICATION INVALID", "2025-01-05", {"applicationType": "Compliance"}),
+    ]
+    for app_id, lpa, decision, reg_date, js in apps:
+        cur.execute("INSERT INTO applications (id, lpa, decision, registration_date, location, raw_json) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)", (app_id, lpa, decision, reg_date, f"{app_id} Main St", json.dumps(js)))
+    conditions = [(1, "fingal", "Site Notice", "Note: not legible"), (1, "fingal", "Fee", None),
+                  (1, "dublincity", "Site Notice", "Note: not legible"), (3, "dublincity", "Site Notice", "Note - wrong"),
+                  (2, "fingal", "Drawings", "Note: valid application")]
+    for order_num, (app_id, lpa, short_desc, long_desc) in enumerate(conditions):
+        cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc, long_desc) VALUES (%s, %s, %s, %s, %s)",
+                    (app_id, lpa, order_num, short_desc, long_desc))
+    pg_conn.commit()
+
+    manifest = export_snapshot(pg_conn, str(tmp_path / "snap"))
+    assert manifest["tables"]["applications"]["rows"] == 4
+
+    snapshot = Snapshot(str(tmp_path / "snap"))
+    dataset = load_snapshot_dataset(snapshot)
+    assert dataset.apps == load_analysis_dataset(conn=pg_conn).apps
+    assert dataset.agent_aliases == load_analysis_dataset(conn=pg_conn).agent_aliases == {"info@walsh.ie": "walsh"}
+    assert detailed_failures(snapshot) == analyze_detailed_failures(conn=pg_conn)
+    assert spread(snapshot) == analyze_spread(conn=pg_conn)
+
+
+def test_export_reads_one_consistent_snapshot(pg_conn, tmp_path, monkeypatch):
+    import psycopg2
+    import snapshot
+    from conftest import TEST_DATABASE_URL
+
+    cur = pg_conn.cursor()
+    cur.execute("SHOW search_path")
+    search_path = cur.fetchone()[0]
+    cur.execute("INSERT INTO applications (id, lpa, decision) VALUES (1, 'fingal', 'DECLARE APPLICATION INVALID')")
+    cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc) VALUES (1, 'fingal', 0, 'Fee')")
+    pg_conn.commit()
+
+    table_rows = snapshot._table_rows
+    writer = psycopg2.connect(TEST_DATABASE_URL, options=f"-c search_path={search_path.replace(' ', '')}")
+
+    def rows_with_concurrent_write(conn, table, columns):
+        cur = conn.cursor()
+        cur.execute("SHOW transaction_isolation")
+        assert cur.fetchone()[0] == "repeatable read"
+        assert conn.readonly
+        yield from table_rows(conn, table, columns)
+        if table == "applications":
+            # A sync saves a condition after applications have been read
+            writer.cursor().execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc) "
+                                    "VALUES (1, 'fingal', 1, 'Site Notice')")
+            writer.commit()
+
+    monkeypatch.setattr(snapshot, "_table_rows", rows_with_concurrent_write)
+    try:
+        manifest = snapshot.export_snapshot(pg_conn, str(tmp_path / "snap"))
+    finally:
+        writer.close()
+    assert manifest["tables"]["conditions"]["rows"] == 1
+    assert (pg_conn.isolation_level, pg_conn.readonly) == (psycopg2.extensions.ISOLATION_LEVEL_DEFAULT, None)
+    cur = pg_conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM conditions")
+    assert cur.fetchone()[0] == 2
+
+
+def test_detailed_failures_break_ties_like_the_database(pg_conn, tmp_path):
+    import psycopg2
+    from analyze_invalid import analyze_detailed_failures
+    from snapshot import Snapshot, detailed_failures, export_snapshot
+
+    cur = pg_conn.cursor()
+    # Sort as a linguistic database collation would ("fee" before "Site"),
+    # where the server has ICU
+    cur.execute("SAVEPOINT icu")
+    try:
+        cur.execute('SELECT %s < %s COLLATE "unicode"', ("fee", "Site"))
+        cur.execute('ALTER TABLE conditions ALTER COLUMN short_desc TYPE TEXT COLLATE "unicode", '
+                    'ALTER COLUMN clean_note TYPE TEXT COLLATE "unicode"')
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT icu")
+    cur.execute("INSERT INTO applications (id, lpa, decision) "
+                "SELECT g, 'fingal', 'DECLARE APPLICATION INVALID' FROM generate_series(1, 4) g")
+    # Two categories with the same total, each with two notes counted once
+    conditions = [(1, "fee", "Note: apple plans"), (2, "fee", "Note: Zebra crossing"),
+                  (3, "Site Notice", "Note: apple plans"), (4, "Site Notice", "Note: Zebra crossing")]
+    for order_num, (app_id, short_desc, long_desc) in enumerate(conditions):
+        cur.execute("INSERT INTO conditions (app_id, lpa, order_num, short_desc, long_desc) "
+                    "VALUES (%s, 'fingal', %s, %s, %s)", (app_id, order_num, short_desc, long_desc))
+    pg_conn.commit()
+
+    results = analyze_detailed_failures(conn=pg_conn)
+    assert [r['category'] for r in results] == ["Site Notice", "fee"]
+    assert [n['note'] for n in results[0]['top_notes']] == ["Zebra crossing", "apple plans"]
+    export_snapshot(pg_conn, str(tmp_path / "snap"))
+    assert detailed_failures(Snapshot(str(tmp_path / "snap"))) == results
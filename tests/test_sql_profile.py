@@ -0,0 +1,94 @@
+"""Tests for the opt-in SQL profiler."""
+import os
+
+import pytest
+
+
+@pytest.fixture
+def profiling_conn(pg_conn):
+    """A profiling connection to pg_conn's schema, with the profile cleared."""
+    import psycopg2
+    import sql_profile
+
+    cur = pg_conn.cursor()
+    cur.execute("SHOW search_path")
+    search_path = cur.fetchone()[0]
+    conn = psycopg2.connect(os.environ["TEST_DATABASE_URL"], connection_factory=sql_profile.ProfilingConnection)
+    conn.cursor().execute(f"SET search_path TO {search_path}")
+    conn.commit()
+    sql_profile.reset()
+    try:
+        yield conn
+    finally:
+        conn.close()
+        sql_profile.reset()
+
+
+def test_statement_template_collapses_literals_and_lists():
+    from sql_profile import statement_template
+    assert statement_template("SELECT id FROM t\n  WHERE lpa = %s AND n > 10 AND s = 'it''s'") == \
+        "SELECT id FROM t WHERE lpa = ? AND n > ? AND s = ?"
+    assert statement_template("UPDATE t SET x = v.x FROM (VALUES (1, 'a'), (2, 'b'), (3, 'c')) v(id, x)") == \
+        "UPDATE t SET x = v.x FROM (VALUES (...), ...) v(id, x)"
+    assert statement_template("SELECT * FROM t WHERE id IN (1, 2, 3) AND k = ANY(ARRAY['a','b'])") == \
+        "SELECT * FROM t WHERE id IN (...) AND k = ANY(ARRAY[...])"
+    assert statement_template("SELECT $1, idx_2, %(name)s") == "SELECT $1, idx_2, ?"
+
+
+def test_take_and_merge_combine_statements():
+    import sql_profile
+    sql_profile.reset()
+    sql_profile._record("SELECT ?", 0.5, rows=3, sample="SELECT 1")
+    taken = sql_profile.take()
+    assert sql_profile.statements() == []
+    sql_profile._record("SELECT ?", 0.25, rows=1, sample="SELECT 2")
+    sql_profile.merge(taken)
+    [entry] = sql_profile.statements()
+    assert (entry["calls"], entry["seconds"], entry["max_seconds"], entry["rows"], entry["sample"]) == \
+        (2, 0.75, 0.5, 4, "SELECT 1")
+    sql_profile.reset()
+
+
+def test_profiles_cursors_and_explains_slowest(profiling_conn, tmp_path):
+    from psycopg2.extras import RealDictCursor, execute_values
+    import sql_profile
+
+    cur = profiling_conn.cursor()
+    execute_values(cur, "INSERT INTO applications (id, lpa, decision) VALUES %s",
+                   [(i, "fingal", "GRANT PERMISSION") for i in range(150)], page_size=50)
+    # One query per application: the N+1 pattern the report should flag
+    for i in range(150):
+        cur.execute("SELECT decision FROM applications WHERE id = %s AND lpa = %s", (i, "fingal"))
+        cur.fetchall()
+    named = profiling_conn.cursor(name="profiled")
+    named.itersize = 40
+    named.execute("SELECT id FROM applications WHERE decision LIKE %s", ("GRANT%",))
+    assert len(list(named)) == 150
+    named.close()
+    dict_cur = profiling_conn.cursor(cursor_factory=RealDictCursor)
+    dict_cur.execute("UPDATE applications SET status = COALESCE(status, '') || %s WHERE id < %s RETURNING id",
+                     ("x", 10))
+    assert isinstance(dict_cur.fetchone(), dict)
+    profiling_conn.commit()
+
+    by_template = {entry["template"]: entry for entry in sql_profile.statements()}
+    inserts = by_template["INSERT INTO applications (id, lpa, decision) VALUES (...), ..."]
+    assert (inserts["calls"], inserts["rows"]) == (3, 150)
+    lookups = by_template["SELECT decision FROM applications WHERE id = ? AND lpa = ?"]
+    assert (lookups["calls"], lookups["rows"]) == (150, 150)
+    assert "WHERE id = " in lookups["sample"] and "%s" not in lookups["sample"]
+    scan = by_template["SELECT id FROM applications WHERE decision LIKE ?"]
+    assert (scan["calls"], scan["rows"]) == (1, 150)
+
+    data = sql_profile.write_report(str(tmp_path), profiling_conn, explain_limit=10)
+    by_template = {entry["template"]: entry for entry in data["statements"]}
+    assert [entry["rank"] for entry in data["statements"]] == list(range(1, len(data["statements"]) + 1))
+    assert "repeated: run once per row? (N+1)" in by_template[lookups["template"]]["flags"]
+    assert "actual time" in by_template[scan["template"]]["plan"]
+    update = by_template["UPDATE applications SET status = COALESCE(status, ?) || ? WHERE id < ? RETURNING id"]
+    assert update["plan"] and "Update on applications" in update["plan"]
+    assert (tmp_path / "sql_profile.txt").read_text().startswith("SQL profile")
+
+    # The explained UPDATE ran in a transaction that was rolled back
+    cur.execute("SELECT COUNT(*) FROM applications WHERE status = 'x'")
+    assert cur.fetchone()[0] == 10
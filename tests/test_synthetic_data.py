@@ -0,0 +1,60 @@
+"""Tests for the synthetic planning data generator."""
+import math
+
+
+def test_generate_is_deterministic():
+    from synthetic_data import generate
+    first = list(generate(300, seed=3))
+    assert first == list(generate(300, seed=3))
+    assert first != list(generate(300, seed=4))
+    assert [app["id"] for _, app, _, _ in generate(5, first_id=100)] == [100, 101, 102, 103, 104]
+
+
+def test_generate_reapplies_after_invalidation_nearby():
+    from shared_utils import LOCATION_MATCH_DISTANCE, classify_decision, get_fullname
+    from synthetic_data import generate
+
+    records = list(generate(2000, seed=1))
+    assert {lpa for lpa, _, _, _ in records} == {"dunlaoghaire", "fingal", "dublincity", "southdublin"}
+    reapplied = 0
+    for (_, app, _, conditions), (_, follow_up, _, _) in zip(records, records[1:]):
+        if classify_decision(app["decisionText"]) != "invalid":
+            continue
+        assert conditions and all(cond["prescriptionCode"] == "INV" for cond in conditions)
+        if get_fullname(follow_up) == get_fullname(app) and follow_up["registrationDate"] > app["registrationDate"]:
+            reapplied += 1
+            if "easting" in app:
+                assert math.dist((app["easting"], app["northing"]),
+                                 (follow_up["easting"], follow_up["northing"])) < LOCATION_MATCH_DISTANCE
+    assert reapplied > 50
+
+
+def test_copy_value_escapes_text_format():
+    from synthetic_data import _copy_line
+    assert _copy_line([1, None, "a\tb\nc\\d", 2.5]) == "1\t\\N\ta\\tb\\nc\\\\d\t2.5\n"
+
+
+def test_snapshot_matches_postgres_load(pg_conn, tmp_path):
+    from analyze_lifecycle import analyze_lifecycle
+    from snapshot import Snapshot, export_snapshot, load_snapshot_dataset, spread
+    from synthetic_data import generate, load_postgres, write_synthetic_snapshot
+
+    counts = load_postgres(pg_conn, 400, seed=2, batch_size=150)
+    manifest = write_synthetic_snapshot(str(tmp_path / "synthetic"), 400, seed=2)
+    assert {table: info["rows"] for table, info in manifest["tables"].items()} == counts
+
+    cur = pg_conn.cursor()
+    cur.execute("SELECT long_desc FROM conditions WHERE long_desc LIKE '%%Note%%' ORDER BY id LIMIT 1")
+    assert "\n" in cur.fetchone()[0]
+    cur.execute("SELECT COUNT(*) FROM applications WHERE decision_category IS NULL AND decision <> ''")
+    assert cur.fetchone()[0] == 0
+    _, first, _, _ = next(generate(1, seed=2))
+    cur.execute("SELECT agent_email, easting FROM applications WHERE id = %s", (first["id"],))
+    assert cur.fetchone() == (first.get("agentEmail"), first.get("easting"))
+
+    export_snapshot(pg_conn, str(tmp_path / "exported"))
+    synthetic, exported = Snapshot(str(tmp_path / "synthetic")), Snapshot(str(tmp_path / "exported"))
+    dataset = load_snapshot_dataset(synthetic)
+    assert dataset.apps == load_snapshot_dataset(exported).apps
+    assert spread(synthetic) == spread(exported)
+    assert analyze_lifecycle(dataset)["overall"]["follow_up_rate"] > 0
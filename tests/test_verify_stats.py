@@ -0,0 +1,19 @@
+"""Tests for the decision classification summary."""
+
+
+def test_verify_stats_counts_by_category(pg_conn):
+    from verify_stats import verify_stats
+    cur = pg_conn.cursor()
+    decisions = ["GRANT PERMISSION", "GRANT PERMISSION", "DECLARE APPLICATION INVALID", "Invalid application",
+                 "REFUSE PERMISSION", "COMPLIANCE SUBMISSION", "Exempted Development", "Further Information",
+                 None, ""]
+    for app_id, decision in enumerate(decisions):
+        cur.execute("INSERT INTO applications (id, lpa, decision) VALUES (%s, 'fingal', %s)", (app_id, decision))
+    pg_conn.commit()
+
+    stats = verify_stats(conn=pg_conn)
+    assert stats == {'total_applications': 10, 'admin': 2, 'substantive': 5, 'invalid': 2,
+                     'invalidation_rate': 40.0}
+
+    cur.execute("SELECT COUNT(*) FROM applications WHERE decision_category = 'invalid'")
+    assert cur.fetchone()[0] == 2